@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks of libpci.
+
+Run the suite and store the results::
+
+    benchmarks/bench.py run -o before.json
+
+Compare two result files, exiting with status 1 on regressions::
+
+    benchmarks/bench.py compare before.json after.json
+
+Result files have the layout of the ones written by ``pci-lookup bench
+--json``, so ``compare`` also reads those.
+
+All benchmarks run against synthetic fixtures (an ID database and a sysfs
+tree) generated in a temporary directory, so they need no network and do
+not depend on the hardware of the machine. The libpci package from this
+source tree is measured, not the installed one.
+
+The ``memory`` benchmark reports the memory retained per device, in bytes,
+by :class:`libpci.Device` objects, by :class:`libpci.PciDevice` records
+with names and by a :class:`libpci.table.DeviceTable` (measured with
+:mod:`tracemalloc`). Records are meant for large
+inventories and should stay within :data:`RECORD_BYTES_TARGET`.
+
+The ``startup`` benchmark runs ``pci-lookup --help`` and ``pci-lookup
+vendor`` in fresh interpreters. Each has a budget in
+:data:`libpci.diagnostics.STARTUP_BUDGET`, and ``run`` exits with status 1
+when one of them is over budget, so that slow imports creeping back into
+the script are caught. The tests check the same budgets.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_TOP = os.path.dirname(_HERE)
+sys.path.insert(0, _TOP)
+
+from libpci.diagnostics import RESULTS_VERSION  # noqa: E402
+from libpci.diagnostics import STARTUP_BUDGET  # noqa: E402
+from libpci.diagnostics import _environment  # noqa: E402
+from libpci.diagnostics import _result  # noqa: E402
+from libpci.fixtures import write_modules_alias  # noqa: E402
+from libpci.fixtures import write_pci_ids  # noqa: E402
+from libpci.fixtures import write_sysfs  # noqa: E402
+from libpci.modalias import ModuleAliases  # noqa: E402
+from libpci.modalias import modalias  # noqa: E402
+from libpci.table import DeviceTable  # noqa: E402
+
+
+#: Memory budget of a single PciDevice record with names, in bytes
+RECORD_BYTES_TARGET = 640
+
+
+def _measure(fn, number, repeat):
+    # Returns the time of a single call to fn, for each repetition
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(number):
+            fn()
+        timings.append((time.perf_counter() - start) / number)
+    return timings
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=_TOP,
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Fixture(object):
+
+    """Synthetic ID database and sysfs tree in a temporary directory."""
+
+    def __init__(self, devices, seed):
+        self._tmp = tempfile.TemporaryDirectory(prefix='libpci-bench-')
+        self.root = self._tmp.name
+        self.ids = os.path.join(self.root, 'pci.ids')
+        ids = write_pci_ids(self.ids, seed=seed)
+        self.known = [(entry.vendor_id, entry.device_id) for entry in ids]
+        self.sysfs = os.path.join(self.root, 'sys')
+        functions = write_sysfs(self.sysfs, ids, devices, seed=seed)
+        self.modules_alias = os.path.join(self.root, 'modules.alias')
+        write_modules_alias(self.modules_alias, functions, seed=seed)
+
+    def open(self):
+        from libpci import LibPCI
+        return LibPCI('linux-sysfs', {'sysfs.path': self.sysfs},
+                      id_file=self.ids)
+
+    def close(self):
+        self._tmp.cleanup()
+
+
+def _spawn(*argv):
+    # Returns the time it takes to run Python with the given arguments
+    env = dict(os.environ, PYTHONPATH=_TOP)
+    start = time.perf_counter()
+    subprocess.check_call([sys.executable] + list(argv), env=env,
+                          stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def bench_import(args, fixture):
+    """Time of ``import libpci`` in a fresh interpreter."""
+    baseline = [_spawn('-c', 'pass') for i in range(args.repeat)]
+    timings = [_spawn('-c', 'import libpci') for i in range(args.repeat)]
+    return {
+        'interpreter_startup': _result(baseline),
+        'import_libpci': _result(timings),
+    }
+
+
+def bench_startup(args, fixture):
+    """Time of running the ``pci-lookup`` script, checked against budgets."""
+    script = os.path.join(_TOP, 'pci-lookup')
+    commands = {
+        'startup_help': [script, '--help'],
+        'startup_vendor': [script, '--id-file', fixture.ids, 'vendor',
+                           '{:04x}'.format(fixture.known[0][0])],
+    }
+    baseline = min(_spawn('-c', 'pass') for i in range(args.repeat))
+    results = {}
+    for name, argv in sorted(commands.items()):
+        results[name] = _result(
+            [_spawn(*argv) for i in range(args.repeat)],
+            budget=baseline + STARTUP_BUDGET[name])
+    return results
+
+
+def bench_lookup(args, fixture):
+    """Latency of name lookups."""
+    rng = random.Random(args.seed)
+    sample = [rng.choice(fixture.known) for i in range(args.batch)]
+    vendor_id, device_id = sample[0]
+    results = {}
+
+    def cold():
+        with fixture.open() as pci:
+            pci.lookup_device_name(vendor_id, device_id)
+    results['lookup_cold'] = _result(_measure(cold, 1, args.repeat))
+    with fixture.open() as pci:
+        pci.lookup_vendor_name(vendor_id)
+        results['lookup_vendor_warm'] = _result(_measure(
+            lambda: pci.lookup_vendor_name(vendor_id),
+            args.number, args.repeat))
+        results['lookup_device_warm'] = _result(_measure(
+            lambda: pci.lookup_device_name(vendor_id, device_id),
+            args.number, args.repeat))
+
+        def batch():
+            for vendor_id, device_id in sample:
+                pci.lookup_device_name(vendor_id, device_id)
+        results['lookup_device_batch'] = _result(
+            _measure(batch, 1, args.repeat), calls=args.batch)
+
+        def unknown():
+            pci.lookup_device_name(0xffff, 0xffff)
+        results['lookup_device_unknown'] = _result(_measure(
+            unknown, args.number, args.repeat))
+    return results
+
+
+def bench_enumerate(args, fixture):
+    """Time to enumerate all the devices."""
+    def scan():
+        with fixture.open() as pci:
+            pci.scan_bus()
+    results = {
+        'scan_bus': _result(
+            _measure(scan, 1, args.repeat), devices=args.devices),
+    }
+    with fixture.open() as pci:
+        pci.scan_bus()
+        results['rescan_unchanged'] = _result(
+            _measure(pci.rescan, 1, args.repeat), devices=args.devices)
+    return results
+
+
+def bench_config(args, fixture):
+    """Time to read the configuration space of all the devices."""
+    results = {}
+    with fixture.open() as pci:
+        devices = pci.scan_bus()
+        for size in (64, 256, 4096):
+            def sweep():
+                for device in devices:
+                    device.read_config(size)
+            results['read_config_{}'.format(size)] = _result(
+                _measure(sweep, 1, args.repeat), devices=len(devices))
+    return results
+
+
+def bench_modalias(args, fixture):
+    """Time to read modules.alias and to find the modules of all devices."""
+    with fixture.open() as pci:
+        aliases = [modalias(device) for device in pci.scan_bus()]
+    results = {
+        'modalias_parse': _result(_measure(
+            lambda: ModuleAliases(fixture.modules_alias), 1, args.repeat)),
+    }
+    # Each repetition gets a new object, so that nothing is cached.
+    resolvers = iter([ModuleAliases(fixture.modules_alias)
+                      for i in range(args.repeat)])
+    results['modalias_resolve'] = _result(_measure(
+        lambda: next(resolvers).resolve(aliases), 1, args.repeat),
+        devices=len(aliases))
+    return results
+
+
+def _retained(fn):
+    # Returns the result of fn and the memory it retained, in bytes
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = fn()
+        return result, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def bench_memory(args, fixture):
+    """Memory retained per device by devices and by records."""
+    results = {}
+    with fixture.open() as pci:
+        devices, size = _retained(pci.scan_bus)
+        results['memory_device'] = _result(
+            [size / len(devices)], unit='B', devices=len(devices))
+        # Look the names up once so that only the records are measured.
+        pci.records(names=True)
+        records, size = _retained(lambda: pci.records(names=True))
+        results['memory_record'] = _result(
+            [size / len(records)], unit='B', devices=len(records),
+            target=RECORD_BYTES_TARGET)
+    with fixture.open() as pci:
+        table, size = _retained(lambda: DeviceTable.from_pci(pci))
+        results['memory_table'] = _result(
+            [size / len(table)], unit='B', devices=len(table))
+    if results['memory_record']['best'] > RECORD_BYTES_TARGET:
+        print("records take {:.0f} bytes per device, above the target of"
+              " {} bytes".format(results['memory_record']['best'],
+                                 RECORD_BYTES_TARGET),
+              file=sys.stderr)
+    return results
+
+
+BENCHMARKS = {
+    'import': bench_import,
+    'lookup': bench_lookup,
+    'enumerate': bench_enumerate,
+    'config': bench_config,
+    'memory': bench_memory,
+    'modalias': bench_modalias,
+    'startup': bench_startup,
+}
+
+
+def run(args):
+    """Run the selected benchmarks and write the results."""
+    fixture = Fixture(args.devices, args.seed)
+    try:
+        results = {}
+        for name in args.only or sorted(BENCHMARKS):
+            print("running {}".format(name), file=sys.stderr)
+            results.update(BENCHMARKS[name](args, fixture))
+    finally:
+        fixture.close()
+    document = {
+        'version': RESULTS_VERSION,
+        'environment': _environment(revision=_git_revision()),
+        'parameters': {
+            'devices': args.devices,
+            'seed': args.seed,
+            'number': args.number,
+            'repeat': args.repeat,
+            'batch': args.batch,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'wt', encoding='utf-8') as stream:
+            json.dump(document, stream, indent=2, sort_keys=True)
+            stream.write('\n')
+    else:
+        json.dump(document, sys.stdout, indent=2, sort_keys=True)
+        print()
+    over_budget = 0
+    for name, result in sorted(results.items()):
+        if 'budget' in result and result['best'] > result['budget']:
+            print("{} took {:.1f}ms, above the budget of {:.1f}ms".format(
+                name, result['best'] * 1e3, result['budget'] * 1e3),
+                file=sys.stderr)
+            over_budget += 1
+    return 1 if over_budget else 0
+
+
+def _format_value(value, unit):
+    # Results carry their unit: seconds for timings, bytes for memory.
+    if unit == 's':
+        if value < 1e-3:
+            return '{:.3f}us'.format(value * 1e6)
+        if value < 1:
+            return '{:.3f}ms'.format(value * 1e3)
+        return '{:.3f}s'.format(value)
+    if unit == 'B':
+        return '{:.0f}B'.format(value)
+    return '{:.3g}{}'.format(value, unit)
+
+
+def compare(args):
+    """Compare two result files and report regressions."""
+    with open(args.old, encoding='utf-8') as stream:
+        old = json.load(stream)
+    with open(args.new, encoding='utf-8') as stream:
+        new = json.load(stream)
+    regressions = 0
+    names = sorted(set(old['results']) & set(new['results']))
+    print('{:28} {:>12} {:>12} {:>8}'.format(
+        'benchmark', 'old', 'new', 'change'))
+    for name in names:
+        unit = old['results'][name].get('unit', 's')
+        if new['results'][name].get('unit', 's') != unit:
+            print('{:28} measured in different units'.format(name))
+            continue
+        before = old['results'][name][args.statistic]
+        after = new['results'][name][args.statistic]
+        change = (after - before) / before if before else 0.0
+        if change > args.threshold:
+            verdict = 'REGRESSION'
+            regressions += 1
+        elif change < -args.threshold:
+            verdict = 'improved'
+        else:
+            verdict = ''
+        print('{:28} {:>12} {:>12} {:>+7.1%} {}'.format(
+            name, _format_value(before, unit), _format_value(after, unit),
+            change, verdict).rstrip())
+    for name in sorted(set(old['results']) ^ set(new['results'])):
+        print('{:28} only in one of the files'.format(name))
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    """Entry point of the benchmark runner."""
+    parser = argparse.ArgumentParser(description="Benchmarks of libpci")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    parser_run = commands.add_parser('run', help=run.__doc__)
+    parser_run.add_argument(
+        '-o', '--output', metavar='FILE', help="write results to FILE")
+    parser_run.add_argument(
+        '--only', action='append', choices=sorted(BENCHMARKS),
+        help="run only the given benchmark (may be repeated)")
+    parser_run.add_argument(
+        '--devices', type=int, default=256,
+        help="number of functions in the synthetic sysfs tree")
+    parser_run.add_argument(
+        '--seed', type=int, default=0, help="seed of the fixtures")
+    parser_run.add_argument(
+        '--number', type=int, default=1000,
+        help="calls per repetition of micro-benchmarks")
+    parser_run.add_argument(
+        '--repeat', type=int, default=5, help="repetitions of each benchmark")
+    parser_run.add_argument(
+        '--batch', type=int, default=1000, help="size of batched lookups")
+    parser_run.set_defaults(func=run)
+    parser_compare = commands.add_parser('compare', help=compare.__doc__)
+    parser_compare.add_argument('old', help="baseline result file")
+    parser_compare.add_argument('new', help="result file to check")
+    parser_compare.add_argument(
+        '--threshold', type=float, default=0.1,
+        help="relative slowdown reported as a regression (default 10%%)")
+    parser_compare.add_argument(
+        '--statistic', choices=('best', 'median'), default='best',
+        help="statistic to compare")
+    parser_compare.set_defaults(func=compare)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,9 +18,43 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Pure-python, high-level bindings to libpci."""
+"""
+Pure-python, high-level bindings to libpci.
 
-__all__ = ('LibPCI',)
+The names listed in ``__all__`` are imported on first use, so importing the
+package (or one of its modules) does not load libpci and its constants
+until they are needed.
+"""
+
+import importlib
+
+__all__ = (
+    'LibPCI', 'Device', 'ChangeSet', 'PciDevice', 'set_tracer', 'shared',
+    'stats')
 __version__ = (0, 2, 0, 'dev', 0)
 
-from libpci.wrapper import LibPCI
+# Module that defines each of the names in __all__
+_exports = {
+    'LibPCI': 'libpci.wrapper',
+    'Device': 'libpci.wrapper',
+    'ChangeSet': 'libpci.wrapper',
+    'PciDevice': 'libpci.wrapper',
+    'shared': 'libpci.wrapper',
+    'set_tracer': 'libpci.tracing',
+    'stats': 'libpci._native',
+}
+
+
+def __getattr__(name):
+    try:
+        module = _exports[name]
+    except KeyError:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
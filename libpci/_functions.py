@@ -25,6 +25,7 @@ import ctypes
 from libpci._native import Function
 from libpci._native import IN
 from libpci._types import pci_access
+from libpci._types import pci_dev
 
 
 # Shared library object
@@ -65,6 +66,218 @@ def pci_cleanup(access: (IN, ctypes.POINTER(pci_access))) -> None:
     pass
 
 
+# Parameters and access methods
+
+
+@Function(libpci)
+def pci_get_param(
+    access: (IN, ctypes.POINTER(pci_access)),
+    param: (IN, ctypes.c_char_p),
+) -> ctypes.c_char_p:
+    """
+    Get the value of a parameter.
+
+    char *pci_get_param(struct pci_access *acc, char *param) PCI_ABI;
+    """
+    pass
+
+
+@Function(libpci)
+def pci_set_param(
+    access: (IN, ctypes.POINTER(pci_access)),
+    param: (IN, ctypes.c_char_p),
+    value: (IN, ctypes.c_char_p),
+) -> ctypes.c_int:
+    """
+    Set the value of a parameter.
+
+    int pci_set_param(
+        struct pci_access *acc, char *param, char *value
+    ) PCI_ABI;
+
+    Returns zero on success and -1 if the parameter is not known.
+    """
+    pass
+
+
+@Function(libpci)
+def pci_lookup_method(name: (IN, ctypes.c_char_p)) -> ctypes.c_int:
+    """
+    Look up the number of an access method by name.
+
+    int pci_lookup_method(char *name) PCI_ABI;
+
+    Returns -1 if there is no such method.
+    """
+    pass
+
+
+@Function(libpci)
+def pci_get_method_name(index: (IN, ctypes.c_int)) -> ctypes.c_char_p:
+    """
+    Get the name of an access method.
+
+    char *pci_get_method_name(int index) PCI_ABI;
+
+    Returns an empty string if the method is not compiled in and NULL if
+    the index is out of range.
+    """
+    pass
+
+
+# Scanning of devices
+
+
+@Function(libpci)
+def pci_scan_bus(access: (IN, ctypes.POINTER(pci_access))) -> None:
+    """
+    Scan the bus and build the list of devices.
+
+    void pci_scan_bus(struct pci_access *acc) PCI_ABI;
+    """
+    pass
+
+
+@Function(libpci)
+def pci_fill_info(
+    dev: (IN, ctypes.POINTER(pci_dev)),
+    flags: (IN, ctypes.c_int),
+) -> ctypes.c_int:
+    """
+    Fill in device information selected by PCI_FILL_xxx flags.
+
+    int pci_fill_info(struct pci_dev *, int flags) PCI_ABI;
+
+    Returns the set of fields that are known after the call.
+    """
+    pass
+
+
+@Function(libpci)
+def pci_get_dev(
+    access: (IN, ctypes.POINTER(pci_access)),
+    domain: (IN, ctypes.c_int),
+    bus: (IN, ctypes.c_int),
+    dev: (IN, ctypes.c_int),
+    func: (IN, ctypes.c_int),
+) -> ctypes.POINTER(pci_dev):
+    """
+    Get a device structure for the given address, without scanning.
+
+    struct pci_dev *pci_get_dev(
+        struct pci_access *acc, int domain, int bus, int dev, int func
+    ) PCI_ABI;
+
+    The device is not added to the list of devices and must be released
+    with pci_free_dev().
+    """
+    pass
+
+
+@Function(libpci)
+def pci_free_dev(dev: (IN, ctypes.POINTER(pci_dev))) -> None:
+    """
+    Free a device structure.
+
+    void pci_free_dev(struct pci_dev *) PCI_ABI;
+    """
+    pass
+
+
+# ID database
+
+
+@Function(libpci)
+def pci_set_name_list_path(
+    access: (IN, ctypes.POINTER(pci_access)),
+    name: (IN, ctypes.c_char_p),
+    to_be_freed: (IN, ctypes.c_int),
+) -> None:
+    """
+    Set the path of the PCI ID database.
+
+    void pci_set_name_list_path(
+        struct pci_access *a, char *name, int to_be_freed
+    ) PCI_ABI;
+
+    If ``to_be_freed`` is non-zero, libpci frees the string on cleanup.
+    """
+    pass
+
+
+@Function(libpci)
+def pci_load_name_list(
+    access: (IN, ctypes.POINTER(pci_access)),
+) -> ctypes.c_int:
+    """
+    Load the PCI ID database, replacing any loaded before.
+
+    int pci_load_name_list(struct pci_access *a) PCI_ABI;
+
+    Returns zero if the database cannot be opened.
+    """
+    pass
+
+
+# Reading of configuration space
+
+
+@Function(libpci)
+def pci_read_byte(
+    dev: (IN, ctypes.POINTER(pci_dev)),
+    pos: (IN, ctypes.c_int),
+) -> ctypes.c_uint8:
+    """
+    Read a byte of the configuration space of a device.
+
+    u8 pci_read_byte(struct pci_dev *, int pos) PCI_ABI;
+    """
+    pass
+
+
+@Function(libpci)
+def pci_read_word(
+    dev: (IN, ctypes.POINTER(pci_dev)),
+    pos: (IN, ctypes.c_int),
+) -> ctypes.c_uint16:
+    """
+    Read a 16-bit word of the configuration space of a device.
+
+    u16 pci_read_word(struct pci_dev *, int pos) PCI_ABI;
+    """
+    pass
+
+
+@Function(libpci)
+def pci_read_long(
+    dev: (IN, ctypes.POINTER(pci_dev)),
+    pos: (IN, ctypes.c_int),
+) -> ctypes.c_uint32:
+    """
+    Read a 32-bit long word of the configuration space of a device.
+
+    u32 pci_read_long(struct pci_dev *, int pos) PCI_ABI;
+    """
+    pass
+
+
+@Function(libpci)
+def pci_read_block(
+    dev: (IN, ctypes.POINTER(pci_dev)),
+    pos: (IN, ctypes.c_int),
+    buf: (IN, ctypes.POINTER(ctypes.c_uint8)),
+    len: (IN, ctypes.c_int),
+) -> ctypes.c_int:
+    """
+    Read a block of the configuration space of a device.
+
+    int pci_read_block(struct pci_dev *, int pos, u8 *buf, int len) PCI_ABI;
+
+    Returns a non-zero value on success.
+    """
+    pass
+
+
 # Calling convention for pci_lookup_name()
 # ========================================
 #
@@ -2031,6 +2031,28 @@ PCI_CLASS_OTHERS = Macro("PCI_CLASS_OTHERS", 0xff)
 PCI_VENDOR_ID_INTEL = Macro("PCI_VENDOR_ID_INTEL", 0x8086)
 #: Constant from pci.h
 PCI_VENDOR_ID_COMPAQ = Macro("PCI_VENDOR_ID_COMPAQ", 0x0e11)
+#: Constant from pci.h
+PCI_FILL_IDENT = Macro("PCI_FILL_IDENT", 0x0001)
+#: Constant from pci.h
+PCI_FILL_IRQ = Macro("PCI_FILL_IRQ", 0x0002)
+#: Constant from pci.h
+PCI_FILL_BASES = Macro("PCI_FILL_BASES", 0x0004)
+#: Constant from pci.h
+PCI_FILL_ROM_BASE = Macro("PCI_FILL_ROM_BASE", 0x0008)
+#: Constant from pci.h
+PCI_FILL_SIZES = Macro("PCI_FILL_SIZES", 0x0010)
+#: Constant from pci.h
+PCI_FILL_CLASS = Macro("PCI_FILL_CLASS", 0x0020)
+#: Constant from pci.h
+PCI_FILL_CAPS = Macro("PCI_FILL_CAPS", 0x0040)
+#: Constant from pci.h
+PCI_FILL_EXT_CAPS = Macro("PCI_FILL_EXT_CAPS", 0x0080)
+#: Constant from pci.h
+PCI_FILL_PHYS_SLOT = Macro("PCI_FILL_PHYS_SLOT", 0x0100)
+#: Constant from pci.h
+PCI_FILL_MODULE_ALIAS = Macro("PCI_FILL_MODULE_ALIAS", 0x0200)
+#: Constant from pci.h
+PCI_FILL_RESCAN = Macro("PCI_FILL_RESCAN", 0x00010000)
 
 
 # Automatically-generated __all__
@@ -23,17 +23,33 @@ This module contains the :func:`native()` function which aids in creating
 type-safe, discoverable and documented bindings to functions in dynamically
 linked libraries.
 
+Bindings can optionally be instrumented to count calls, errors and time
+spent in each native function. Instrumentation is decided once, when this
+module is imported, by the ``LIBPCI_INSTRUMENT`` environment variable (any
+value other than empty or ``0`` enables it). When it is disabled the
+bindings are the plain ctypes foreign functions, with no overhead at all.
+
 This module requires Python 3.4
 """
+from bisect import bisect_left
 from collections import namedtuple
 from ctypes import CDLL
 from ctypes import CFUNCTYPE
 from enum import IntEnum
+from functools import wraps
 from inspect import Parameter
 from inspect import Signature
 from inspect import signature
+import os
+import time
+
+__all__ = ('Function', 'IN', 'OUT', 'Macro', 'INSTRUMENTATION',
+           'LATENCY_BUCKETS', 'CallStats', 'stats', 'reset_stats')
 
-__all__ = ('Function', 'IN', 'OUT', 'Macro')
+
+#: Flag determining if bindings created by :func:`Function()` are
+#: instrumented, see :func:`stats()`
+INSTRUMENTATION = os.getenv("LIBPCI_INSTRUMENT", "") not in ("", "0")
 
 
 # NOTE: a bitmask flag would have been better
@@ -127,10 +143,101 @@ def Function(
             metadata.restype, *metadata.argtypes,
             use_errno=use_errno, use_last_error=use_last_error)
         func_spec = (name_or_ordinal or fn.__name__, library)
-        return prototype(func_spec, metadata.paramflags)
+        func = prototype(func_spec, metadata.paramflags)
+        if INSTRUMENTATION:
+            return _instrument(func, fn, str(func_spec[0]))
+        return func
     return decorator
 
 
+# Instrumentation
+# ===============
+
+#: Upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = (1e-6, 4e-6, 16e-6, 64e-6, 256e-6, 1e-3, 4e-3, 16e-3,
+                   float('inf'))
+
+CallStats = namedtuple("CallStats", "calls errors total_time histogram")
+CallStats.__doc__ = """
+Statistics of calls to one native function.
+
+:attr calls:
+    Number of calls
+:attr errors:
+    Number of calls that raised an exception
+:attr total_time:
+    Cumulative time spent in the function, in seconds
+:attr histogram:
+    Tuple of ``(upper_bound, count)`` pairs, one per bucket of
+    :data:`LATENCY_BUCKETS`
+"""
+
+
+class _Counters(object):
+
+    __slots__ = ('calls', 'errors', 'total_time', 'buckets')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+
+# Counters of each instrumented function, by name. Different bindings of the
+# same native function (e.g. the variants of pci_lookup_name) share them.
+_registry = {}
+
+
+def _instrument(func, fn, name):
+    counters = _registry.setdefault(name, _Counters())
+    clock = time.perf_counter
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            counters.errors += 1
+            raise
+        finally:
+            elapsed = clock() - start
+            counters.calls += 1
+            counters.total_time += elapsed
+            counters.buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def stats():
+    """
+    Get a snapshot of the statistics of instrumented native functions.
+
+    :returns:
+        A dictionary mapping names of native functions to
+        :class:`CallStats`, empty unless :data:`INSTRUMENTATION` is set.
+        Functions that were never called are included, with zero counts.
+
+    Counters are updated without locking, so with many threads calling into
+    libpci at the same time a few updates may be lost.
+    """
+    return {
+        name: CallStats(
+            counters.calls, counters.errors, counters.total_time,
+            tuple(zip(LATENCY_BUCKETS, counters.buckets)))
+        for name, counters in _registry.items()}
+
+
+def reset_stats():
+    """Reset the statistics of all instrumented native functions."""
+    for counters in _registry.values():
+        counters.reset()
+
+
 class Macro(object):
 
     """A preprocessor macro-like thing."""
@@ -0,0 +1,306 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Periodic sampling of Advanced Error Reporting (AER) counters.
+
+:class:`AerSampler` does all the expensive work (walking capability lists,
+opening sysfs files) once, when it is created. Each sample then only reads
+two values per device into preallocated arrays, so sampling every device of
+a machine once a second costs next to nothing.
+"""
+
+from array import array
+import logging
+import os
+import time
+
+from libpci._functions import pci_read_long
+from libpci._macros import PCI_ERR_COR_STATUS
+from libpci._macros import PCI_ERR_UNCOR_STATUS
+
+__all__ = ('AerSampler',)
+
+
+_logger = logging.getLogger("libpci.aer")
+
+# Counter files exported by the kernel for devices with AER enabled
+_SYSFS_CORRECTABLE = ('aer_dev_correctable',)
+_SYSFS_UNCORRECTABLE = ('aer_dev_fatal', 'aer_dev_nonfatal')
+# Each of those ends with a "TOTAL_ERR_xxx <count>" line
+_TOTAL = b'TOTAL_ERR_'
+_SYSFS_BUF_SIZE = 4096
+
+
+# Number of bits set in each byte
+_BITS = bytes(bin(byte).count('1') for byte in range(256))
+
+
+def _popcount_table(value):
+    # Status registers are 32 bits wide
+    return (_BITS[value & 0xff] + _BITS[value >> 8 & 0xff]
+            + _BITS[value >> 16 & 0xff] + _BITS[value >> 24 & 0xff])
+
+
+# int.bit_count() is new in Python 3.10
+_popcount = getattr(int, 'bit_count', _popcount_table)
+
+
+class AerSampler(object):
+
+    """
+    Sampler of correctable and uncorrectable error counts.
+
+    Two sources are supported:
+
+    ``config``
+        The AER status registers, read through libpci. They latch one bit
+        per error type until cleared by the kernel driver, so a delta is the
+        number of error types that were newly flagged since the previous
+        sample.
+    ``sysfs``
+        The ``aer_dev_*`` counters maintained by the kernel, which count
+        every error. A delta is the number of errors since the previous
+        sample.
+
+    Values are kept in flat ``array`` objects with two slots per device:
+    ``[2 * i]`` is the correctable count and ``[2 * i + 1]`` the
+    uncorrectable count of ``devices[i]``.
+
+    :attr devices:
+        Tuple of the sampled :class:`libpci.Device` objects (the ones given
+        to the constructor that support AER)
+    :attr deltas:
+        Array of deltas computed by the most recent :meth:`sample()`
+    :attr present:
+        ``bytearray`` with a flag per device, cleared for devices that are
+        gone (removed by :meth:`libpci.LibPCI.rescan()`, or whose counter
+        files disappeared). Their values and deltas are zero from then on.
+    """
+
+    def __init__(self, devices, source='config', callback=None):
+        """
+        Initialize a sampler and take the baseline sample.
+
+        :param devices:
+            An iterable of :class:`libpci.Device`, typically the result of
+            :meth:`libpci.LibPCI.scan_bus()`. Devices without AER are
+            ignored.
+        :param source:
+            Either ``'config'`` or ``'sysfs'``, see above
+        :param callback:
+            Optional callable invoked with :attr:`deltas` after each sample.
+            The same array object is passed every time and is overwritten by
+            the next sample.
+        :raises ValueError:
+            If the source is unknown.
+        """
+        if source == 'config':
+            self._resolve_config(devices)
+            self._read = self._read_config
+        elif source == 'sysfs':
+            self._resolve_sysfs(devices)
+            self._read = self._read_sysfs
+        else:
+            raise ValueError("unknown source {!r}".format(source))
+        self.source = source
+        self.callback = callback
+        size = 2 * len(self.devices)
+        self.present = bytearray(b'\x01' * len(self.devices))
+        self._current = array('Q', bytes(8 * size))
+        self._previous = array('Q', bytes(8 * size))
+        self.deltas = array('Q', bytes(8 * size))
+        _logger.debug("Sampling AER of %d devices from %s",
+                      len(self.devices), source)
+        self._read(self._previous)
+
+    def _resolve_config(self, devices):
+        sampled = []
+        positions = array('i')
+        for device in devices:
+            offset = device.ext_capabilities().aer
+            if offset is None:
+                continue
+            sampled.append(device)
+            positions.append(offset + PCI_ERR_COR_STATUS.value)
+            positions.append(offset + PCI_ERR_UNCOR_STATUS.value)
+        self.devices = tuple(sampled)
+        self._positions = positions
+        self._owners = tuple({id(d._pci): d._pci for d in sampled}.values())
+
+    def _resolve_sysfs(self, devices):
+        sampled = []
+        fds = []
+        for device in devices:
+            path = os.path.join(
+                device._pci.get_param("sysfs.path") or "/sys", "bus", "pci",
+                "devices", device.slot)
+            try:
+                correctable = [os.open(os.path.join(path, name), os.O_RDONLY)
+                               for name in _SYSFS_CORRECTABLE]
+            except OSError:
+                continue
+            uncorrectable = []
+            for name in _SYSFS_UNCORRECTABLE:
+                try:
+                    uncorrectable.append(
+                        os.open(os.path.join(path, name), os.O_RDONLY))
+                except OSError:
+                    pass
+            sampled.append(device)
+            fds.append((tuple(correctable), tuple(uncorrectable)))
+        self.devices = tuple(sampled)
+        self._fds = tuple(fds)
+        self._buf = bytearray(_SYSFS_BUF_SIZE)
+        self._bufs = (self._buf,)
+
+    def close(self):
+        """Release file descriptors held by the sampler."""
+        for group in getattr(self, '_fds', ()):
+            for fds in group:
+                for fd in fds:
+                    os.close(fd)
+        self._fds = ()
+
+    def __enter__(self):
+        """Enter a context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Exit a context manager, closing the sampler."""
+        self.close()
+
+    @property
+    def values(self):
+        """
+        Array of the values read by the most recent sample.
+
+        With the ``sysfs`` source these are the totals maintained by the
+        kernel, with the ``config`` source the raw status registers.
+        """
+        return self._previous
+
+    def _read_config(self, values):
+        for pci in self._owners:
+            if pci.closed:
+                raise ValueError("attempt to use closed LibPCI object")
+        read = pci_read_long
+        positions = self._positions
+        present = self.present
+        index = 0
+        for number, device in enumerate(self.devices):
+            # Re-read on every sample since rescan() rebinds devices.
+            dev = device._dev
+            if dev is not None:
+                values[index] = read(dev, positions[index])
+                values[index + 1] = read(dev, positions[index + 1])
+            else:
+                if present[number]:
+                    _logger.debug("%s is gone", device.slot)
+                    present[number] = 0
+                values[index] = values[index + 1] = 0
+            index += 2
+
+    def _read_sysfs(self, values):
+        buf = self._buf
+        bufs = self._bufs
+        present = self.present
+        total = self._total
+        index = 0
+        for number, (correctable, uncorrectable) in enumerate(self._fds):
+            if present[number]:
+                try:
+                    values[index] = total(correctable, buf, bufs)
+                    values[index + 1] = total(uncorrectable, buf, bufs)
+                except OSError:
+                    # The kernel fails reads of removed devices.
+                    _logger.debug("%s is gone", self.devices[number].slot)
+                    present[number] = 0
+            if not present[number]:
+                values[index] = values[index + 1] = 0
+            index += 2
+
+    @staticmethod
+    def _total(fds, buf, bufs):
+        # Parses the digits in place so that sampling allocates nothing.
+        total = 0
+        for fd in fds:
+            size = os.preadv(fd, bufs, 0)
+            pos = buf.rfind(_TOTAL, 0, size)
+            if pos < 0:
+                continue
+            pos = buf.find(b' ', pos, size)
+            if pos < 0:
+                continue
+            pos += 1
+            value = 0
+            while pos < size:
+                digit = buf[pos] - 48
+                if not 0 <= digit <= 9:
+                    break
+                value = value * 10 + digit
+                pos += 1
+            total += value
+        return total
+
+    def sample(self):
+        """
+        Take a sample and compute deltas against the previous one.
+
+        :returns:
+            :attr:`deltas`
+        """
+        current = self._current
+        previous = self._previous
+        deltas = self.deltas
+        self._read(current)
+        if self.source == 'config':
+            popcount = _popcount
+            for index in range(len(current)):
+                deltas[index] = popcount(current[index] & ~previous[index])
+        else:
+            for index in range(len(current)):
+                # Counters only go back when the kernel resets them.
+                deltas[index] = max(current[index] - previous[index], 0)
+        self._current = previous
+        self._previous = current
+        if self.callback is not None:
+            self.callback(deltas)
+        return deltas
+
+    def run(self, interval=1.0, count=None):
+        """
+        Sample periodically.
+
+        :param interval:
+            Time between samples, in seconds. Samples are scheduled against
+            a monotonic clock so slow callbacks do not make them drift.
+        :param count:
+            Number of samples to take, by default run forever
+        """
+        deadline = time.monotonic()
+        taken = 0
+        while count is None or taken < count:
+            deadline += interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.sample()
+            taken += 1
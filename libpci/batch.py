@@ -0,0 +1,219 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Resolving streams of identifiers to names (``pci-lookup batch``).
+
+Each input line holds one, two or four hexadecimal identifiers (vendor,
+vendor and device, or vendor, device, subsystem vendor and subsystem
+device) separated by whitespace, commas or colons::
+
+    8086
+    8086 1572
+    8086,1572,8086,0000
+
+Blank lines and comments (starting with ``#``) are skipped, every other
+line gets one line of output, either a JSON object (JSON Lines) or
+tab-separated values. Input is consumed in chunks as it becomes available
+and the output of each chunk is written and flushed at once, so memory use
+stays bounded for streams of any length while interactive use (a
+co-process answering one line at a time) still gets an answer right away.
+"""
+
+import functools
+import json
+import re
+
+__all__ = ('Resolver', 'parse_ids', 'run_batch')
+
+
+# Size of the chunks read from the input
+CHUNK_SIZE = 64 * 1024
+
+# Lines longer than that are reported as errors without being buffered
+MAX_LINE = 4096
+
+# Size of the cache of each kind of lookup
+CACHE_SIZE = 64 * 1024
+
+_separators = re.compile(r'[\s,:]+')
+
+
+def parse_ids(line):
+    """
+    Parse a line of input.
+
+    :param line:
+        The line, as a string
+    :returns:
+        A tuple of one, two or four integers, or None for blank lines and
+        comments (starting with ``#``)
+    :raises ValueError:
+        If the line is not valid
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    fields = _separators.split(line)
+    if len(fields) not in (1, 2, 4):
+        raise ValueError("expected 1, 2 or 4 identifiers, got {}".format(
+            len(fields)))
+    ids = tuple(int(field, 16) for field in fields)
+    for value in ids:
+        if not 0 <= value <= 0xffff:
+            raise ValueError("identifier out of range: {:#x}".format(value))
+    return ids
+
+
+class Resolver(object):
+
+    """
+    Cached name lookups for tuples of identifiers.
+
+    libpci keeps the ID database in memory but each lookup still goes
+    through ctypes and decodes a new string; the caches here make repeated
+    identifiers, which dominate real inputs, almost free.
+    """
+
+    def __init__(self, pci, cache_size=CACHE_SIZE):
+        """
+        Initialize the resolver.
+
+        :param pci:
+            The :class:`libpci.LibPCI` object to look names up with
+        :param cache_size:
+            Number of names of each kind to keep
+        """
+        cache = functools.lru_cache(maxsize=cache_size)
+        self.vendor_name = cache(pci.lookup_vendor_name)
+        self.device_name = cache(pci.lookup_device_name)
+        self.subsystem_name = cache(pci.lookup_subsystem_device_name)
+
+    def resolve(self, ids):
+        """
+        Look up the names of a tuple of identifiers.
+
+        :param ids:
+            A tuple returned by :func:`parse_ids()`
+        :returns:
+            A list of names: the vendor name, then the device name and then
+            the subsystem name, as far as the identifiers go
+        """
+        names = [self.vendor_name(ids[0])]
+        if len(ids) >= 2:
+            names.append(self.device_name(ids[0], ids[1]))
+        if len(ids) == 4:
+            names.append(self.subsystem_name(*ids))
+        return names
+
+
+_ID_KEYS = ('vendor_id', 'device_id', 'subvendor_id', 'subdevice_id')
+_NAME_KEYS = ('vendor_name', 'device_name', 'subsystem_name')
+
+
+def _format_jsonl(ids, names):
+    record = {}
+    for key, value in zip(_ID_KEYS, ids):
+        record[key] = '{:04x}'.format(value)
+    record.update(zip(_NAME_KEYS, names))
+    return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def _format_tsv(ids, names):
+    return '\t'.join(
+        ['{:04x}'.format(value) for value in ids]
+        + [name.replace('\t', ' ') for name in names]) + '\n'
+
+
+_FORMATS = {
+    'jsonl': _format_jsonl,
+    'tsv': _format_tsv,
+}
+
+
+def run_batch(pci, input, output, errors, format='jsonl',
+              chunk_size=CHUNK_SIZE):
+    """
+    Resolve a stream of identifiers.
+
+    :param pci:
+        The :class:`libpci.LibPCI` object to look names up with
+    :param input:
+        Binary input stream, such as ``sys.stdin.buffer``
+    :param output:
+        Binary output stream, such as ``sys.stdout.buffer``
+    :param errors:
+        Text stream for reporting invalid lines, such as ``sys.stderr``.
+        With the ``jsonl`` format errors are also written to the output as
+        objects with the ``line``, ``input`` and ``error`` keys, so that
+        every line of input that is not skipped has a line of output.
+    :param format:
+        Either ``'jsonl'`` or ``'tsv'``
+    :param chunk_size:
+        Maximum number of bytes read from the input at once
+    :returns:
+        Number of invalid lines
+    """
+    emit = _FORMATS[format]
+    resolver = Resolver(pci)
+    # read1() returns as soon as some data is available. Streams without it
+    # block until a full chunk is read, which is fine for regular files.
+    read = getattr(input, 'read1', input.read)
+    lineno = 0
+    failed = 0
+    pending = b''
+    # Set while dropping the rest of an overly long line
+    overlong = False
+    while True:
+        chunk = read(chunk_size)
+        if chunk:
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+        else:
+            # A line cut short by the end of the input, possibly the rest
+            # of an overly long one
+            lines = [pending] if pending or overlong else []
+        out = []
+        for raw in lines:
+            lineno += 1
+            text = raw.decode('utf-8', 'replace')
+            try:
+                if overlong or len(raw) > MAX_LINE:
+                    overlong = False
+                    raise ValueError("line too long")
+                ids = parse_ids(text)
+            except ValueError as exc:
+                failed += 1
+                print("line {}: {}".format(lineno, exc), file=errors)
+                if format == 'jsonl':
+                    out.append(json.dumps({
+                        'line': lineno, 'input': text.strip()[:80],
+                        'error': str(exc)}) + '\n')
+                continue
+            if ids is not None:
+                out.append(emit(ids, resolver.resolve(ids)))
+        if len(pending) > MAX_LINE:
+            pending = b''
+            overlong = True
+        if out:
+            output.write(''.join(out).encode('utf-8'))
+            output.flush()
+        if not chunk:
+            return failed
@@ -0,0 +1,327 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Walking the capability lists found in PCI configuration space.
+
+All of the functions in this module work on an in-memory snapshot of the
+configuration space of a single device (anything that supports the buffer
+protocol, typically ``bytes`` returned by :meth:`libpci.Device.read_config()`).
+Nothing here talks to the hardware, so a single block read per device is
+enough to answer any number of capability queries.
+"""
+
+from collections import namedtuple
+import logging
+import struct
+
+from libpci._macros import PCI_CAPABILITY_LIST
+from libpci._macros import PCI_CAP_LIST_NEXT
+from libpci._macros import PCI_CB_CAPABILITY_LIST
+from libpci._macros import PCI_EXT_CAP_ID_ACS
+from libpci._macros import PCI_EXT_CAP_ID_AER
+from libpci._macros import PCI_EXT_CAP_ID_ARI
+from libpci._macros import PCI_EXT_CAP_ID_LTR
+from libpci._macros import PCI_EXT_CAP_ID_SRIOV
+from libpci._macros import PCI_HEADER_TYPE
+from libpci._macros import PCI_HEADER_TYPE_CARDBUS
+from libpci._macros import PCI_STATUS
+from libpci._macros import PCI_STATUS_CAP_LIST
+
+__all__ = (
+    'PCI_CONFIG_SPACE_SIZE',
+    'PCI_EXT_CONFIG_SPACE_SIZE',
+    'Capability',
+    'ExtCapability',
+    'ExtCapabilityIndex',
+    'find_capability',
+    'iter_capabilities',
+    'iter_ext_capabilities',
+)
+
+
+_logger = logging.getLogger("libpci.capabilities")
+
+#: Size of the configuration space of a conventional PCI device.
+PCI_CONFIG_SPACE_SIZE = 256
+#: Size of the configuration space of a PCI Express device.
+PCI_EXT_CONFIG_SPACE_SIZE = 4096
+
+# Standard capabilities live after the 64 byte header, in dword aligned
+# slots of the conventional configuration space.
+_CAP_START = 0x40
+_CAP_MAX = (PCI_CONFIG_SPACE_SIZE - _CAP_START) // 4
+# Extended capabilities always start right after the conventional space.
+_EXT_CAP_START = PCI_CONFIG_SPACE_SIZE
+# Each extended capability header takes at least one dword so there cannot
+# be more distinct capabilities than there are dwords in extended space.
+_EXT_CAP_MAX = (PCI_EXT_CONFIG_SPACE_SIZE - PCI_CONFIG_SPACE_SIZE) // 4
+
+_dword = struct.Struct("<I")
+
+
+def _value(macro_or_int):
+    return getattr(macro_or_int, 'value', macro_or_int)
+
+
+class Capability(namedtuple("Capability", "id offset")):
+
+    """
+    A single entry in the standard capability list.
+
+    :attr id:
+        Capability identifier, one of the ``PCI_CAP_ID_xxx`` constants
+    :attr offset:
+        Offset of the capability header in configuration space
+    """
+
+    __slots__ = ()
+
+
+def iter_capabilities(config):
+    """
+    Iterate over the standard capabilities in a configuration space snapshot.
+
+    :param config:
+        Snapshot of the configuration space of a single device, at least
+        the 64 byte header (capabilities beyond the end of the snapshot are
+        not visited).
+    :returns:
+        A generator of :class:`Capability` in list order.
+
+    Like :func:`iter_ext_capabilities()`, the walk stops at the first
+    malformed or repeated pointer.
+    """
+    if len(config) < _CAP_START:
+        return
+    status = config[PCI_STATUS.value] | (config[PCI_STATUS.value + 1] << 8)
+    if not status & PCI_STATUS_CAP_LIST.value:
+        return
+    if config[PCI_HEADER_TYPE.value] & 0x7f == PCI_HEADER_TYPE_CARDBUS.value:
+        offset = config[PCI_CB_CAPABILITY_LIST.value]
+    else:
+        offset = config[PCI_CAPABILITY_LIST.value]
+    end = min(len(config), PCI_CONFIG_SPACE_SIZE)
+    seen = set()
+    offset &= ~3
+    while offset and len(seen) < _CAP_MAX:
+        if offset < _CAP_START or offset + 2 > end or offset in seen:
+            _logger.debug("Bad capability pointer %#04x", offset)
+            return
+        seen.add(offset)
+        cap_id = config[offset]
+        if cap_id == 0xff:
+            return
+        yield Capability(cap_id, offset)
+        offset = config[offset + PCI_CAP_LIST_NEXT.value] & ~3
+
+
+def find_capability(config, cap_id):
+    """
+    Find the offset of a standard capability.
+
+    :param config:
+        Snapshot of the configuration space of a single device
+    :param cap_id:
+        One of the ``PCI_CAP_ID_xxx`` constants (or a plain integer)
+    :returns:
+        Offset of the first capability with that identifier or None
+    """
+    cap_id = _value(cap_id)
+    for cap in iter_capabilities(config):
+        if cap.id == cap_id:
+            return cap.offset
+
+
+class ExtCapability(namedtuple("ExtCapability", "id version offset")):
+
+    """
+    A single entry in the extended capability list.
+
+    :attr id:
+        Capability identifier, one of the ``PCI_EXT_CAP_ID_xxx`` constants
+    :attr version:
+        Capability structure version
+    :attr offset:
+        Offset of the capability header in configuration space
+    """
+
+    __slots__ = ()
+
+
+def iter_ext_capabilities(config):
+    """
+    Iterate over the extended capabilities in a configuration space snapshot.
+
+    :param config:
+        Snapshot of the configuration space of a single device. Snapshots
+        shorter than 4KiB (conventional PCI devices, or configuration space
+        read without sufficient privileges) have no extended capabilities.
+    :returns:
+        A generator of :class:`ExtCapability` in list order.
+
+    The walk stops at the end of the list, at the first malformed pointer
+    and at the first pointer that would visit an already seen header, so
+    broken or hostile hardware cannot make it loop forever.
+    """
+    if len(config) < PCI_EXT_CONFIG_SPACE_SIZE:
+        return
+    offset = _EXT_CAP_START
+    seen = set()
+    while offset and len(seen) < _EXT_CAP_MAX:
+        if offset < _EXT_CAP_START or offset & 3 or offset in seen:
+            _logger.debug("Bad extended capability pointer %#05x", offset)
+            return
+        seen.add(offset)
+        header, = _dword.unpack_from(config, offset)
+        # All zeros or all ones means there are no extended capabilities.
+        if header == 0 or header == 0xffffffff:
+            return
+        yield ExtCapability(
+            header & 0xffff, (header >> 16) & 0xf, offset)
+        offset = (header >> 20) & 0xffc
+
+
+class ExtCapabilityIndex(object):
+
+    """
+    Index of the extended capabilities of a single device.
+
+    The index is built with one walk over the capability list and then
+    answers all queries with a dictionary lookup.
+    """
+
+    __slots__ = ('_config', '_offsets')
+
+    def __init__(self, config):
+        """
+        Build an index over a configuration space snapshot.
+
+        :param config:
+            Snapshot of the configuration space of a single device.
+        """
+        self._config = config
+        offsets = {}
+        for cap in iter_ext_capabilities(config):
+            offsets.setdefault(cap.id, []).append(cap.offset)
+        self._offsets = offsets
+
+    def __repr__(self):
+        """Get a debugging representation of the index."""
+        return '<{} {}>'.format(self.__class__.__name__, ' '.join(
+            '{:#06x}@{:#05x}'.format(cap_id, offset)
+            for cap_id, offset in sorted(
+                (cap_id, offsets[0])
+                for cap_id, offsets in self._offsets.items())))
+
+    def __contains__(self, cap_id):
+        """Check if a capability is present."""
+        return _value(cap_id) in self._offsets
+
+    def __len__(self):
+        """Get the number of distinct capabilities present."""
+        return len(self._offsets)
+
+    def __iter__(self):
+        """Iterate over identifiers of capabilities present."""
+        return iter(self._offsets)
+
+    def find(self, cap_id):
+        """
+        Find the offset of an extended capability.
+
+        :param cap_id:
+            One of the ``PCI_EXT_CAP_ID_xxx`` constants (or a plain integer)
+        :returns:
+            Offset of the first capability with that identifier or None
+        """
+        offsets = self._offsets.get(_value(cap_id))
+        if offsets:
+            return offsets[0]
+
+    def find_all(self, cap_id):
+        """
+        Find all the offsets of an extended capability.
+
+        Some capabilities (notably the vendor-specific one) may be present
+        more than once.
+
+        :returns:
+            A tuple of offsets, possibly empty
+        """
+        return tuple(self._offsets.get(_value(cap_id), ()))
+
+    def read_word(self, cap_id, reg):
+        """
+        Read a 16-bit register of a capability from the snapshot.
+
+        :param cap_id:
+            Identifier of the capability
+        :param reg:
+            Offset of the register relative to the capability header, one
+            of the ``PCI_xxx`` register constants
+        :returns:
+            The register value or None if the capability is absent
+        """
+        offset = self.find(cap_id)
+        if offset is not None:
+            offset += _value(reg)
+            return self._config[offset] | (self._config[offset + 1] << 8)
+
+    def read_long(self, cap_id, reg):
+        """
+        Read a 32-bit register of a capability from the snapshot.
+
+        :param cap_id:
+            Identifier of the capability
+        :param reg:
+            Offset of the register relative to the capability header, one
+            of the ``PCI_xxx`` register constants
+        :returns:
+            The register value or None if the capability is absent
+        """
+        offset = self.find(cap_id)
+        if offset is not None:
+            return _dword.unpack_from(self._config, offset + _value(reg))[0]
+
+    @property
+    def aer(self):
+        """Offset of the Advanced Error Reporting capability or None."""
+        return self.find(PCI_EXT_CAP_ID_AER)
+
+    @property
+    def acs(self):
+        """Offset of the Access Control Services capability or None."""
+        return self.find(PCI_EXT_CAP_ID_ACS)
+
+    @property
+    def ari(self):
+        """Offset of the Alternative Routing-ID capability or None."""
+        return self.find(PCI_EXT_CAP_ID_ARI)
+
+    @property
+    def sriov(self):
+        """Offset of the Single Root I/O Virtualization capability or None."""
+        return self.find(PCI_EXT_CAP_ID_SRIOV)
+
+    @property
+    def ltr(self):
+        """Offset of the Latency Tolerance Reporting capability or None."""
+        return self.find(PCI_EXT_CAP_ID_LTR)
@@ -0,0 +1,358 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Performance diagnosis on the host (``pci-lookup bench``).
+
+:func:`run_bench()` times what a tool built on libpci does on this host
+with its hardware and its ID database:
+
+``library_load``
+    Importing :mod:`libpci.wrapper`, which loads ``libpci.so.3``, in a new
+    interpreter
+``id_database_load``
+    Parsing the ID database
+``lookup_real_cold``, ``lookup_real_warm``
+    Looking up the names of the devices present in the host, the first
+    time and again (time per lookup)
+``lookup_random_cold``, ``lookup_random_warm``
+    The same with random identifiers, most of which are not known
+``enumerate_<method>``
+    Scanning the bus with each access method that works here (the index
+    of the method in libpci is kept with the result)
+``config_sweep``
+    Reading the whole configuration space of every device
+
+Every step but the first runs in a child process, since libpci terminates
+the process when an access method does not work; a step that fails is
+reported as unavailable, with the reason. Fresh processes also make sure
+the first lookups really are cold.
+
+The results have the layout of the files written by
+``benchmarks/bench.py run``, so the results of two hosts can be compared
+with ``benchmarks/bench.py compare``.
+"""
+
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from libpci._types import pci_access_type
+from libpci.capabilities import PCI_EXT_CONFIG_SPACE_SIZE
+
+__all__ = ('RESULTS_VERSION', 'STARTUP_BUDGET', 'access_methods',
+           'format_report', 'run_bench')
+
+
+#: Version of the layout of the results
+RESULTS_VERSION = 1
+
+#: Time budget of pci-lookup commands, in seconds on top of the time it
+#: takes to start the interpreter, checked by ``benchmarks/bench.py`` and
+#: by the tests
+STARTUP_BUDGET = {
+    'startup_help': 0.05,
+    'startup_vendor': 0.10,
+}
+
+# Code run in a new interpreter to time loading the library
+_LOAD_CODE = """\
+import time
+start = time.perf_counter()
+import libpci.wrapper
+print(time.perf_counter() - start)
+"""
+
+
+def access_methods():
+    """
+    Get the access methods compiled into libpci.
+
+    :returns:
+        A list of ``(index, name)`` tuples, such as ``(1,
+        "linux-sysfs")``, without the automatic and the dump methods
+
+    All the indexes libpci knows are visited, including those of methods
+    added after :class:`libpci._types.pci_access_type` was written.
+    """
+    from libpci._functions import pci_get_method_name
+    methods = []
+    index = int(pci_access_type.PCI_ACCESS_AUTO) + 1
+    while True:
+        name = pci_get_method_name(index)
+        if name is None:
+            break
+        # Indexes of methods left out of this build have empty names.
+        if name and index != pci_access_type.PCI_ACCESS_DUMP:
+            methods.append((index, name.decode('utf-8')))
+        index += 1
+    return methods
+
+
+def _result(timings, unit='s', **extra):
+    result = {
+        'unit': unit,
+        'best': min(timings),
+        'median': statistics.median(timings),
+        'repeat': len(timings),
+    }
+    result.update(extra)
+    return result
+
+
+def _timed(fn):
+    # Returns the time it takes to call fn
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _in_child(fn):
+    # Runs fn in a child process and returns its result and None, or None
+    # and the reason of the failure. The result must be JSON-serializable.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with tempfile.TemporaryFile() as errors:
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.close(read_fd)
+                # Keep messages of libpci to report why the child died.
+                os.dup2(errors.fileno(), 2)
+                try:
+                    reply = {'result': fn()}
+                except Exception as exc:
+                    reply = {'error': str(exc) or exc.__class__.__name__}
+                with os.fdopen(write_fd, 'wb') as stream:
+                    stream.write(json.dumps(reply).encode('utf-8'))
+                status = 0
+            finally:
+                os._exit(status)
+        os.close(write_fd)
+        with os.fdopen(read_fd, 'rb') as stream:
+            data = stream.read()
+        os.waitpid(pid, 0)
+        if data:
+            reply = json.loads(data.decode('utf-8'))
+            return reply.get('result'), reply.get('error')
+        errors.seek(0)
+        lines = errors.read().decode('utf-8', 'replace').strip().splitlines()
+        return None, lines[-1] if lines else "terminated"
+
+
+def _library_load(repeat):
+    top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.environ.get('PYTHONPATH')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [top, path] if path else [top]))
+    return [float(subprocess.check_output(
+        [sys.executable, '-c', _LOAD_CODE], env=env))
+        for i in range(repeat)]
+
+
+def _sweep(params, repeat):
+    # Returns the identifiers of the devices present, the number of devices,
+    # the timings of reading their whole configuration space and the size
+    # read in each sweep.
+    from libpci.wrapper import LibPCI
+    with LibPCI(params=params) as pci:
+        devices = pci.scan_bus()
+
+        def sweep():
+            size = 0
+            for device in devices:
+                # Extended configuration space needs privileges and PCI
+                # Express, fall back to the standard header.
+                config = (device.read_config(PCI_EXT_CONFIG_SPACE_SIZE)
+                          or device.read_config())
+                size += len(config or b'')
+            return size
+        size = sweep()
+        timings = [_timed(sweep) for i in range(repeat)]
+        ids = sorted({(device.vendor_id, device.device_id)
+                      for device in devices})
+    return ids, len(devices), timings, size
+
+
+def _enumerate(method, params, repeat):
+    from libpci.wrapper import LibPCI
+    counts = []
+
+    def scan():
+        with LibPCI(method, params) as pci:
+            counts.append(len(pci.scan_bus()))
+    return [_timed(scan) for i in range(repeat)], counts[-1]
+
+
+def _lookups(params, id_file, samples):
+    # Returns the time it takes to load the ID database, and the time per
+    # lookup of each sample, the first time and the second time.
+    from libpci.wrapper import LibPCI
+    with LibPCI(params=params, id_file=id_file) as pci:
+        start = time.perf_counter()
+        if not pci.load_ids():
+            raise OSError("cannot open the PCI ID database")
+        timings = {'id_database_load': time.perf_counter() - start}
+        lookup = pci.lookup_device_name
+
+        def run(ids):
+            for vendor_id, device_id in ids:
+                lookup(vendor_id, device_id)
+        for name, ids in sorted(samples.items()):
+            timings[name + '_cold'] = _timed(lambda: run(ids)) / len(ids)
+        for name, ids in sorted(samples.items()):
+            timings[name + '_warm'] = _timed(lambda: run(ids)) / len(ids)
+    return timings
+
+
+def _environment(**extra):
+    # Shared with benchmarks/bench.py, which adds the git revision
+    import libpci
+    environment = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'node': platform.node(),
+        'cpu_count': os.cpu_count(),
+        'libpci_version': '.'.join(str(part) for part in libpci.__version__),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+    environment.update(extra)
+    return environment
+
+
+def run_bench(repeat=5, sample=1000, seed=0, params=None, id_file=None):
+    """
+    Time loading libpci, looking names up, scanning and reading devices.
+
+    :param repeat:
+        Number of repetitions of each measurement
+    :param sample:
+        Number of random identifiers to look up
+    :param seed:
+        Seed of the random identifiers
+    :param params:
+        Dictionary of libpci parameters, as taken by
+        :class:`libpci.LibPCI`, used for every step
+    :param id_file:
+        Path of the PCI ID database to use instead of the system one
+    :returns:
+        A dictionary with the ``version``, ``environment``, ``parameters``,
+        ``results`` and ``unavailable`` keys. ``results`` maps the name of
+        each measurement to a dictionary with the ``unit``, ``best``,
+        ``median`` and ``repeat`` keys (and extra information such as the
+        number of devices), ``unavailable`` maps the name of each step that
+        failed to the reason.
+    """
+    params = dict(params or {})
+    results = {}
+    unavailable = {}
+    results['library_load'] = _result(_library_load(repeat))
+    reply, error = _in_child(lambda: _sweep(params, repeat))
+    ids = []
+    if reply is None:
+        unavailable['config_sweep'] = error
+    else:
+        ids, devices, timings, size = reply
+        results['config_sweep'] = _result(
+            timings, devices=devices, bytes=size)
+    for index, method in access_methods():
+        name = 'enumerate_' + method
+        reply, error = _in_child(lambda: _enumerate(index, params, repeat))
+        if reply is None:
+            unavailable[name] = error
+        else:
+            timings, devices = reply
+            results[name] = _result(timings, devices=devices, method=index)
+    rng = random.Random(seed)
+    samples = {'lookup_random': [
+        (rng.randrange(0x10000), rng.randrange(0x10000))
+        for i in range(sample)]}
+    if ids:
+        samples['lookup_real'] = ids
+    runs = []
+    for i in range(repeat):
+        reply, error = _in_child(lambda: _lookups(params, id_file, samples))
+        if reply is None:
+            unavailable['lookup'] = error
+            break
+        runs.append(reply)
+    if runs:
+        for name in sorted(runs[0]):
+            extra = {}
+            if name != 'id_database_load':
+                extra['lookups'] = len(samples[name.rsplit('_', 1)[0]])
+            results[name] = _result([run[name] for run in runs], **extra)
+    return {
+        'version': RESULTS_VERSION,
+        'environment': _environment(id_file=id_file),
+        'parameters': {
+            'repeat': repeat,
+            'sample': sample,
+            'seed': seed,
+            'params': params,
+        },
+        'results': results,
+        'unavailable': unavailable,
+    }
+
+
+def _format_time(seconds):
+    if seconds < 1e-3:
+        return '{:.2f}us'.format(seconds * 1e6)
+    if seconds < 1:
+        return '{:.2f}ms'.format(seconds * 1e3)
+    return '{:.2f}s'.format(seconds)
+
+
+def format_report(document):
+    """
+    Format the results of :func:`run_bench()` for people.
+
+    :returns:
+        Text with a line per measurement: the name, the best and the median
+        time and notes such as the number of devices
+    """
+    env = document['environment']
+    lines = ['{} {} on {} ({} CPUs), libpci {}'.format(
+        env['implementation'], env['python'], env['platform'],
+        env['cpu_count'], env['libpci_version'])]
+    lines.append('{:28} {:>10} {:>10}'.format('', 'best', 'median'))
+    for name, result in sorted(document['results'].items()):
+        notes = ['{} {}'.format(result[key], key)
+                 for key in ('devices', 'bytes', 'lookups') if key in result]
+        if 'method' in result:
+            notes.append('method {}'.format(result['method']))
+        notes = ', '.join(notes)
+        lines.append('{:28} {:>10} {:>10}  {}'.format(
+            name, _format_time(result['best']),
+            _format_time(result['median']), notes).rstrip())
+    for name, reason in sorted(document['unavailable'].items()):
+        lines.append('{:28} unavailable: {}'.format(name, reason))
+    return '\n'.join(lines)
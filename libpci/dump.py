@@ -0,0 +1,252 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Reading and writing of ``lspci -x`` text dumps.
+
+The records produced by :func:`parse_dump()` offer the same read-only
+interface as :class:`libpci.Device` (identifiers, :meth:`read_config()`,
+:meth:`ext_capabilities()`), so code written against a live bus works
+unchanged on archived dumps. Unlike going through libpci with the ``dump``
+access method, parsing here needs no native library and no per-device
+calls across the ctypes boundary, which makes it much faster for bulk
+ingestion of dumps collected from many machines.
+
+The format is the one produced by ``lspci -x``, ``-xxx`` or ``-xxxx`` (and
+understood by the ``dump`` access method of libpci): a line with the
+address of the device, optionally followed by a description, then lines of
+hexadecimal bytes prefixed by their offset, with devices separated by empty
+lines::
+
+    0000:00:00.0 Host bridge: Intel Corporation Device 5904 (rev 02)
+    00: 86 80 04 59 06 00 90 20 02 00 00 06 00 00 00 00
+    10: 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00
+"""
+
+from collections import namedtuple
+import re
+import struct
+
+from libpci._macros import PCI_CLASS_DEVICE
+from libpci._macros import PCI_DEVICE_ID
+from libpci._macros import PCI_VENDOR_ID
+from libpci.capabilities import ExtCapabilityIndex
+from libpci.capabilities import PCI_CONFIG_SPACE_SIZE
+from libpci.capabilities import PCI_EXT_CONFIG_SPACE_SIZE
+
+__all__ = ('DumpRecord', 'parse_dump', 'format_dump', 'load_dump',
+           'iter_dumps')
+
+
+_word = struct.Struct('<H')
+
+_slot_re = re.compile(
+    r"^(?:([0-9a-fA-F]{1,8}):)?([0-9a-fA-F]{2}):([0-9a-fA-F]{2})"
+    r"\.([0-7])(?:\s+(.*))?$")
+
+
+class DumpRecord(namedtuple(
+        "DumpRecord", "domain bus dev func config description")):
+
+    """
+    A single device found in a text dump.
+
+    :attr config:
+        The configuration space, as bytes. Bytes that were not present in
+        the dump (holes between rows) are zero.
+    :attr description:
+        The text that followed the address of the device, possibly empty.
+    """
+
+    __slots__ = ()
+
+    @property
+    def slot(self):
+        """Address of the device in the ``DDDD:BB:dd.f`` notation."""
+        return '{:04x}:{:02x}:{:02x}.{:x}'.format(
+            self.domain, self.bus, self.dev, self.func)
+
+    def _word(self, macro):
+        if len(self.config) >= macro.value + 2:
+            return _word.unpack_from(self.config, macro.value)[0]
+
+    @property
+    def vendor_id(self):
+        """PCI vendor identifier, or None if not present in the dump."""
+        return self._word(PCI_VENDOR_ID)
+
+    @property
+    def device_id(self):
+        """PCI device identifier, or None if not present in the dump."""
+        return self._word(PCI_DEVICE_ID)
+
+    @property
+    def device_class(self):
+        """PCI device class, or None if not present in the dump."""
+        return self._word(PCI_CLASS_DEVICE)
+
+    def read_config(self, size=PCI_CONFIG_SPACE_SIZE, pos=0):
+        """
+        Read a block of the configuration space.
+
+        This mirrors :meth:`libpci.Device.read_config()`.
+
+        :returns:
+            The requested block, as bytes, or None if the dump does not
+            cover it.
+        """
+        if pos + size > len(self.config):
+            return None
+        return self.config[pos:pos + size]
+
+    def ext_capabilities(self):
+        """
+        Get the index of the extended capabilities of the device.
+
+        This mirrors :meth:`libpci.Device.ext_capabilities()`.
+        """
+        config = self.read_config(PCI_EXT_CONFIG_SPACE_SIZE)
+        return ExtCapabilityIndex(config or b'')
+
+
+def parse_dump(lines):
+    """
+    Parse a text dump.
+
+    :param lines:
+        An iterable of lines, typically a file opened in text mode.
+    :returns:
+        A generator of :class:`DumpRecord`, one per device.
+    :raises ValueError:
+        If a row of bytes is malformed.
+    """
+    device = None
+    rows = None
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        # Rows of data have a short hexadecimal offset followed by a colon
+        # and a space, device lines have the first colon further in.
+        sep = line.find(':')
+        is_row = 0 < sep <= 3 and line[sep + 1:sep + 2] == ' '
+        if is_row and device is not None:
+            rows.append((lineno, sep, line))
+            continue
+        match = _slot_re.match(line)
+        if match is None:
+            raise ValueError("malformed dump line {}".format(lineno))
+        if device is not None:
+            yield _make_record(device, rows)
+        device = match.groups()
+        rows = []
+    if device is not None:
+        yield _make_record(device, rows)
+
+
+# Length of a row of 16 bytes, from the colon to the end
+_FULL_ROW = len(":") + len(" 00") * 16
+
+
+def _decode_rows(rows):
+    # Fast path: rows as written by lspci, sixteen bytes each at consecutive
+    # offsets, are decoded with a single call.
+    last = len(rows) - 1
+    if all(int(line[:sep], 16) == index * 16 and (
+            len(line) - sep == _FULL_ROW or index == last)
+           for index, (lineno, sep, line) in enumerate(rows)):
+        try:
+            return bytes.fromhex(''.join(
+                line[sep + 1:] for lineno, sep, line in rows))
+        except ValueError:
+            pass
+    # Slow path: rows of any length at any offsets, with error reporting.
+    config = bytearray()
+    for lineno, sep, line in rows:
+        try:
+            offset = int(line[:sep], 16)
+            data = bytes.fromhex(line[sep + 1:])
+        except ValueError:
+            raise ValueError("malformed dump row on line {}".format(lineno))
+        end = offset + len(data)
+        if end > len(config):
+            config.extend(bytes(end - len(config)))
+        config[offset:end] = data
+    return bytes(config)
+
+
+def _make_record(device, rows):
+    domain, bus, dev, func, description = device
+    return DumpRecord(
+        int(domain or '0', 16), int(bus, 16), int(dev, 16), int(func),
+        _decode_rows(rows), description or '')
+
+
+def load_dump(path):
+    """
+    Load all the devices from a dump file.
+
+    :param path:
+        Path of a text dump
+    :returns:
+        A list of :class:`DumpRecord`
+    """
+    with open(path, 'rt', encoding='utf-8', errors='replace') as stream:
+        return list(parse_dump(stream))
+
+
+def iter_dumps(paths):
+    """
+    Iterate over the devices found in many dump files.
+
+    :param paths:
+        An iterable of paths of text dumps, for example one per machine
+    :returns:
+        A generator of ``(path, record)`` pairs. Only one file is open at
+        any time.
+    """
+    for path in paths:
+        with open(path, 'rt', encoding='utf-8', errors='replace') as stream:
+            for record in parse_dump(stream):
+                yield path, record
+
+
+def format_dump(records, stream):
+    """
+    Write a text dump.
+
+    :param records:
+        An iterable of objects with ``domain``, ``bus``, ``dev``, ``func``
+        and ``config`` attributes (and, optionally, ``description``).
+    :param stream:
+        Stream, opened in text mode, to write to.
+    """
+    for record in records:
+        line = '{:04x}:{:02x}:{:02x}.{:x}'.format(
+            record.domain, record.bus, record.dev, record.func)
+        description = getattr(record, 'description', None)
+        if description:
+            line += ' ' + description
+        stream.write(line + '\n')
+        config = bytes(record.config)
+        for offset in range(0, len(config), 16):
+            stream.write('{:02x}: {}\n'.format(offset, ' '.join(
+                '{:02x}'.format(byte) for byte in config[offset:offset + 16])))
+        stream.write('\n')
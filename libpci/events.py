@@ -0,0 +1,320 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Hotplug events of PCI devices, as reported by the kernel.
+
+The kernel broadcasts a *uevent* on a ``NETLINK_KOBJECT_UEVENT`` socket
+whenever a device is added, removed or changed and whenever a driver is
+bound to or unbound from it. :class:`UEventMonitor` listens to those, keeps
+only the ones about PCI devices and maintains a table of present devices,
+so there is no need to poll the bus.
+
+This module is Linux-specific.
+"""
+
+from collections import namedtuple
+import asyncio
+import errno
+import logging
+import socket
+
+__all__ = ('RESYNC', 'UEvent', 'UEventMonitor', 'parse_uevent')
+
+
+_logger = logging.getLogger("libpci.events")
+
+# From linux/netlink.h
+NETLINK_KOBJECT_UEVENT = 15
+# Multicast group of events sent by the kernel (udev re-broadcasts them,
+# with its own header, to group 2)
+_KERNEL_GROUP = 1
+# Uevents are limited to a few kilobytes by the kernel
+_RECV_SIZE = 8192
+_PCI_MARKER = b'\0SUBSYSTEM=pci\0'
+
+#: Action of the event handed out when the kernel dropped events because
+#: they were not read quickly enough
+RESYNC = 'resync'
+
+
+class UEvent(namedtuple("UEvent", (
+        "action devpath slot vendor_id device_id device_class driver"
+        " modalias seqnum env"))):
+
+    """
+    A single uevent about a PCI device.
+
+    :attr action:
+        One of ``add``, ``remove``, ``change``, ``bind``, ``unbind`` (or
+        any other action the kernel may send), or :data:`RESYNC`
+    :attr devpath:
+        Path of the device in sysfs, relative to ``/sys``
+    :attr slot:
+        Address of the device in the ``DDDD:BB:dd.f`` notation
+    :attr vendor_id, device_id:
+        PCI identifiers, or None when the event does not carry them
+    :attr device_class:
+        PCI device class (base class and sub-class), or None
+    :attr driver:
+        Name of the bound driver, or None
+    :attr modalias:
+        Kernel module alias of the device, or None
+    :attr seqnum:
+        Sequence number assigned by the kernel, or None
+    :attr env:
+        Dictionary with all the ``KEY=VALUE`` pairs of the event
+    """
+
+    __slots__ = ()
+
+
+def parse_uevent(data):
+    """
+    Parse a kernel uevent message.
+
+    :param data:
+        The message, as received from the netlink socket
+    :returns:
+        A :class:`UEvent` or None if the message is not about a PCI device
+        (or is not a kernel uevent at all)
+    """
+    # Cheap check before splitting anything, most events are not about PCI.
+    if _PCI_MARKER not in data:
+        return None
+    fields = data.split(b'\0')
+    if b'@' not in fields[0]:
+        # Messages re-broadcast by udev start with "libudev".
+        return None
+    env = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition(b'=')
+        if sep:
+            env[key.decode('ascii', 'replace')] = value.decode(
+                'utf-8', 'replace')
+    if env.get('SUBSYSTEM') != 'pci':
+        return None
+    vendor_id = device_id = device_class = seqnum = None
+    pci_id = env.get('PCI_ID')
+    if pci_id:
+        vendor, _, device = pci_id.partition(':')
+        vendor_id = int(vendor, 16)
+        device_id = int(device, 16)
+    if env.get('PCI_CLASS'):
+        device_class = int(env['PCI_CLASS'], 16) >> 8
+    if env.get('SEQNUM'):
+        seqnum = int(env['SEQNUM'])
+    devpath = env.get('DEVPATH', '')
+    slot = env.get('PCI_SLOT_NAME') or devpath.rpartition('/')[2]
+    return UEvent(
+        env.get('ACTION', ''), devpath, slot, vendor_id, device_id,
+        device_class, env.get('DRIVER'), env.get('MODALIAS'), seqnum, env)
+
+
+def _event_from_device(device):
+    return UEvent(
+        'add', '', device.slot, device.vendor_id, device.device_id,
+        device.device_class, getattr(device, 'driver', None),
+        getattr(device, 'module_alias', None), None, {})
+
+
+def _resync_event():
+    return UEvent(RESYNC, '', '', None, None, None, None, None, None, {})
+
+
+class UEventMonitor(object):
+
+    """
+    Listener of PCI uevents maintaining a table of present devices.
+
+    Use the monitor either as a blocking iterator or, from a coroutine, as
+    an asynchronous iterator via :meth:`stream()`; not both at once. Each
+    event is applied to :attr:`devices` before it is handed out.
+
+    When the kernel drops events because the socket buffer overflowed, an
+    event with the :data:`RESYNC` action (and no device) is handed out.
+    :attr:`devices` may be out of date from then on; rescan the bus and
+    pass the result to :meth:`resync()`.
+
+    :attr devices:
+        Dictionary mapping the address of each present device to the last
+        :class:`UEvent` seen for it (with the ``driver`` field tracking
+        bind and unbind events)
+    """
+
+    def __init__(self, sock=None, devices=None):
+        """
+        Initialize a monitor.
+
+        :param sock:
+            Socket to receive messages from. By default a netlink socket
+            subscribed to kernel uevents is created. Anything delivering
+            one message per ``recv()`` call works. Tests can use one end of
+            a ``socket.socketpair(type=socket.SOCK_SEQPACKET)``; unlike
+            datagram sockets, it reports the other end being closed.
+        :param devices:
+            Initial contents of the device table, as taken by
+            :meth:`resync()`
+        """
+        if sock is None:
+            sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            try:
+                sock.bind((0, _KERNEL_GROUP))
+            except OSError:
+                sock.close()
+                raise
+        self._sock = sock
+        self.devices = {}
+        self.resync(devices or ())
+
+    def resync(self, devices):
+        """
+        Replace the contents of the device table.
+
+        :param devices:
+            Either a dictionary like :attr:`devices`, or an iterable of
+            objects with the ``slot``, ``vendor_id``, ``device_id`` and
+            ``device_class`` attributes, such as the result of
+            :meth:`libpci.LibPCI.scan_bus()` or
+            :meth:`libpci.LibPCI.records()`. Those are stored as
+            :class:`UEvent` records with the ``add`` action.
+        """
+        if isinstance(devices, dict):
+            self.devices = dict(devices)
+        else:
+            self.devices = {device.slot: _event_from_device(device)
+                            for device in devices}
+
+    def fileno(self):
+        """Get the file descriptor of the underlying socket."""
+        return self._sock.fileno()
+
+    def close(self):
+        """Close the underlying socket."""
+        self._sock.close()
+
+    def __enter__(self):
+        """Enter a context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Exit a context manager, closing the monitor."""
+        self.close()
+
+    def _apply(self, event):
+        action = event.action
+        if action == 'remove':
+            self.devices.pop(event.slot, None)
+        elif action == 'unbind':
+            old = self.devices.get(event.slot)
+            if old is not None:
+                self.devices[event.slot] = old._replace(driver=None)
+        elif action in ('add', 'change', 'bind'):
+            old = self.devices.get(event.slot)
+            if old is not None and event.driver is None and action != 'add':
+                event = event._replace(driver=old.driver)
+            self.devices[event.slot] = event
+        return event
+
+    def feed(self, data):
+        """
+        Process one raw message.
+
+        :returns:
+            The :class:`UEvent` (after updating :attr:`devices`), or None if
+            the message was not about a PCI device.
+        """
+        event = parse_uevent(data)
+        if event is not None:
+            _logger.debug("%s %s", event.action, event.slot)
+            event = self._apply(event)
+        return event
+
+    def _overflow(self):
+        _logger.warning("Uevents were lost, the device table needs a resync")
+        return _resync_event()
+
+    def receive(self):
+        """
+        Block until the next PCI uevent arrives.
+
+        :returns:
+            The :class:`UEvent` or None once the other end of the socket is
+            closed.
+        """
+        while True:
+            try:
+                data = self._sock.recv(_RECV_SIZE)
+            except OSError as exc:
+                if exc.errno != errno.ENOBUFS:
+                    raise
+                return self._overflow()
+            if not data:
+                return None
+            event = self.feed(data)
+            if event is not None:
+                return event
+
+    def __iter__(self):
+        """Iterate over PCI uevents, blocking while waiting for them."""
+        while True:
+            event = self.receive()
+            if event is None:
+                return
+            yield event
+
+    def stream(self, loop=None):
+        """
+        Get an asynchronous iterator of PCI uevents.
+
+        :param loop:
+            The event loop to use, by default the running one
+        :returns:
+            An object to use with ``async for``. The socket is switched to
+            non-blocking mode.
+        """
+        return _UEventStream(self, loop)
+
+
+class _UEventStream(object):
+
+    def __init__(self, monitor, loop):
+        self._monitor = monitor
+        self._loop = loop
+        monitor._sock.setblocking(False)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        loop = self._loop or asyncio.get_running_loop()
+        while True:
+            try:
+                data = await loop.sock_recv(self._monitor._sock, _RECV_SIZE)
+            except OSError as exc:
+                if exc.errno != errno.ENOBUFS:
+                    raise
+                return self._monitor._overflow()
+            if not data:
+                raise StopAsyncIteration
+            event = self._monitor.feed(data)
+            if event is not None:
+                return event
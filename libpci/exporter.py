@@ -0,0 +1,275 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Exporter of PCI device metrics in the Prometheus text format.
+
+:class:`MetricsExporter` serves ``/metrics`` over HTTP (by default on the
+loopback interface only). All the work of reading devices happens on a
+background thread that periodically refreshes a :class:`MetricsCollector`;
+each refresh renders the complete response once, so a scrape only copies
+ready bytes to the socket and never touches the hardware.
+
+Exported metrics:
+
+``pci_device_info``
+    Always 1, with the identifiers of each device as labels
+``pci_link_speed_gts``, ``pci_link_max_speed_gts``
+    Negotiated and maximum transfer rate of PCI Express links
+``pci_link_width``, ``pci_link_max_width``
+    Negotiated and maximum number of lanes
+``pci_link_bandwidth_bytes``
+    Usable bandwidth of the negotiated link, per direction
+``pci_link_degraded``
+    1 when the link is up below its capabilities
+``pci_aer_correctable_errors_total``, ``pci_aer_uncorrectable_errors_total``
+    AER error counters maintained by the kernel
+``pci_power_state``
+    Current power state (0 for D0 to 3 for D3hot)
+"""
+
+import http.server
+import logging
+import threading
+
+from libpci._functions import pci_read_word
+from libpci._macros import PCI_CAP_ID_PM
+from libpci._macros import PCI_PM_CTRL
+from libpci._macros import PCI_PM_CTRL_STATE_MASK
+from libpci.aer import AerSampler
+from libpci.capabilities import find_capability
+from libpci.link import LinkMonitor
+from libpci.link import read_configs
+
+__all__ = ('DEFAULT_ADDRESS', 'MetricsCollector', 'MetricsExporter')
+
+
+_logger = logging.getLogger("libpci.exporter")
+
+#: Address the exporter listens on unless told otherwise
+DEFAULT_ADDRESS = ('127.0.0.1', 9456)
+
+_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _family(lines, name, kind, help_text, samples):
+    # samples is an iterable of (slot, value) pairs
+    lines.append('# HELP {} {}'.format(name, help_text))
+    lines.append('# TYPE {} {}'.format(name, kind))
+    for slot, value in samples:
+        lines.append('{}{{slot="{}"}} {}'.format(name, slot, value))
+
+
+class MetricsCollector(object):
+
+    """
+    Periodically refreshed, pre-rendered snapshot of device metrics.
+
+    Only :meth:`refresh()` talks to libpci; it must always be called from
+    the same thread. :attr:`payload` can be read from any thread.
+
+    :attr payload:
+        The metrics in the Prometheus text format, as bytes
+    """
+
+    def __init__(self, pci):
+        """
+        Initialize a collector.
+
+        :param pci:
+            The :class:`libpci.LibPCI` object to read devices from
+        """
+        self._pci = pci
+        self._links = None
+        self._aer = None
+        self._power = []
+        self.payload = b''
+
+    def close(self):
+        """Release resources held by the collector."""
+        if self._aer is not None:
+            self._aer.close()
+            self._aer = None
+
+    def _rebuild(self, devices):
+        # Heavier per-device setup, only done when the set of devices
+        # changes.
+        _logger.debug("Setting up monitoring of %d devices", len(devices))
+        # Read each configuration space once for links and power states.
+        configs = read_configs(devices)
+        self._links = LinkMonitor(devices, configs)
+        self.close()
+        self._aer = AerSampler(devices, 'sysfs')
+        power = []
+        for device, config in zip(devices, configs):
+            offset = find_capability(config or b'', PCI_CAP_ID_PM)
+            if offset is not None:
+                power.append((device, offset + PCI_PM_CTRL.value))
+        self._power = power
+
+    def refresh(self):
+        """Read the current state of all devices and render the payload."""
+        changes = self._pci.rescan()
+        devices = self._pci.scan_bus()
+        if changes or self._links is None:
+            self._rebuild(devices)
+        else:
+            self._links.poll()
+            self._aer.sample()
+        power = [
+            (device.slot, pci_read_word(device._dev, pos)
+             & PCI_PM_CTRL_STATE_MASK.value)
+            for device, pos in self._power]
+        self.payload = self._render(devices, power)
+
+    def _render(self, devices, power):
+        lines = []
+        lines.append('# HELP pci_device_info Identifiers of a PCI device.')
+        lines.append('# TYPE pci_device_info gauge')
+        for device in devices:
+            lines.append(
+                'pci_device_info{{slot="{}",vendor="{:04x}",device="{:04x}",'
+                'class="{:04x}"}} 1'.format(
+                    device.slot, device.vendor_id, device.device_id,
+                    device.device_class))
+        links = self._links.links
+        _family(lines, 'pci_link_speed_gts', 'gauge',
+                'Negotiated transfer rate of the link in GT/s.',
+                ((link.device.slot, link.rate or 0) for link in links))
+        _family(lines, 'pci_link_max_speed_gts', 'gauge',
+                'Maximum transfer rate of the link in GT/s.',
+                ((link.device.slot, link.max_rate or 0) for link in links))
+        _family(lines, 'pci_link_width', 'gauge',
+                'Negotiated number of lanes of the link.',
+                ((link.device.slot, link.width) for link in links))
+        _family(lines, 'pci_link_max_width', 'gauge',
+                'Maximum number of lanes of the link.',
+                ((link.device.slot, link.max_width) for link in links))
+        _family(lines, 'pci_link_bandwidth_bytes', 'gauge',
+                'Usable bandwidth of the link per direction in bytes/s.',
+                ((link.device.slot, link.bandwidth) for link in links))
+        _family(lines, 'pci_link_degraded', 'gauge',
+                'Whether the link is up below its capabilities.',
+                ((link.device.slot, int(link.degraded)) for link in links))
+        aer = self._aer
+        values = aer.values
+        _family(lines, 'pci_aer_correctable_errors_total', 'counter',
+                'Correctable errors reported by the device.',
+                ((device.slot, values[2 * index])
+                 for index, device in enumerate(aer.devices)))
+        _family(lines, 'pci_aer_uncorrectable_errors_total', 'counter',
+                'Fatal and non-fatal errors reported by the device.',
+                ((device.slot, values[2 * index + 1])
+                 for index, device in enumerate(aer.devices)))
+        _family(lines, 'pci_power_state', 'gauge',
+                'Current power state of the device (0 is D0, 3 is D3hot).',
+                power)
+        lines.append('')
+        return '\n'.join(lines).encode('utf-8')
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.partition('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        payload = self.server.collector.payload
+        self.send_response(200)
+        self.send_header('Content-Type', _CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        _logger.debug("%s " + format, self.address_string(), *args)
+
+
+class MetricsExporter(object):
+
+    """
+    HTTP server of the metrics gathered by a :class:`MetricsCollector`.
+
+    The first refresh happens in the constructor so that errors surface
+    early and the first scrape already has data.
+    """
+
+    def __init__(self, pci, address=DEFAULT_ADDRESS, interval=15.0):
+        """
+        Initialize an exporter.
+
+        :param pci:
+            The :class:`libpci.LibPCI` object to read devices from. It must
+            not be used by other threads while the exporter is running.
+        :param address:
+            A ``(host, port)`` pair to listen on
+        :param interval:
+            Time between refreshes, in seconds
+        """
+        self.collector = MetricsCollector(pci)
+        self.collector.refresh()
+        self.interval = interval
+        self._server = http.server.HTTPServer(address, _Handler)
+        self._server.collector = self.collector
+        self._stop = threading.Event()
+        self._threads = ()
+
+    @property
+    def address(self):
+        """The ``(host, port)`` pair the server listens on."""
+        return self._server.server_address
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.collector.refresh()
+            except Exception:
+                _logger.exception("Cannot refresh metrics")
+
+    def start(self):
+        """Start serving and refreshing on background threads."""
+        self._threads = (
+            threading.Thread(target=self._refresh_loop, daemon=True,
+                             name="libpci-exporter-refresh"),
+            threading.Thread(target=self._server.serve_forever, daemon=True,
+                             name="libpci-exporter-http"),
+        )
+        for thread in self._threads:
+            thread.start()
+
+    def close(self):
+        """Stop the background threads and release all resources."""
+        self._stop.set()
+        if self._threads:
+            self._server.shutdown()
+        for thread in self._threads:
+            thread.join()
+        self._threads = ()
+        self._server.server_close()
+        self.collector.close()
+
+    def __enter__(self):
+        """Enter a context manager, starting the exporter."""
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        """Exit a context manager, closing the exporter."""
+        self.close()
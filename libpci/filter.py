@@ -0,0 +1,275 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Device filters using the expressions of ``lspci -s`` and ``lspci -d``.
+
+A :class:`DeviceFilter` is compiled once into a predicate that only checks
+the fields the expressions constrain::
+
+    nics = DeviceFilter(ids='8086:', device_class='02')
+    for device in filter(nics, pci.scan_bus()):
+        ...
+
+The same filter selects rows of a :class:`~libpci.table.DeviceTable`; when
+the table has indexes (see :meth:`~libpci.table.DeviceTable.create_index()`)
+on ``vendor_id``, ``device_id``, ``device_class`` or ``bus``, only the rows
+listed by the most selective usable index are looked at.
+
+The syntax follows ``lspci``, but expressions are parsed and matched in
+Python rather than with the ``pci_filter`` functions of libpci, whose
+structure changed size between releases. The same filter works for
+devices, records read from dumps and snapshots, and table rows.
+"""
+
+from array import array
+
+__all__ = ('DeviceFilter',)
+
+
+# Shift and mask of each part of the address packed in DeviceTable.bdf
+_BDF_FIELDS = {
+    'domain': (16, 0xffff),
+    'bus': (8, 0xff),
+    'dev': (3, 0x1f),
+    'func': (0, 0x7),
+}
+
+
+def _number(text, limit, what):
+    # Empty and "*" mean any value, like in libpci.
+    if not text or text == '*':
+        return None
+    try:
+        value = int(text, 16)
+    except ValueError:
+        value = -1
+    if not 0 <= value <= limit:
+        raise ValueError("invalid {}: {!r}".format(what, text))
+    return value
+
+
+def _parse_slot(text):
+    # [[[domain]:][bus]:][dev][.[func]]
+    domain = bus = None
+    parts = text.split(':')
+    if len(parts) > 3:
+        raise ValueError("invalid slot expression: {!r}".format(text))
+    if len(parts) == 3:
+        domain = _number(parts.pop(0), 0x7fffffff, "domain number")
+    if len(parts) == 2:
+        bus = _number(parts.pop(0), 0xff, "bus number")
+    dev, dot, func = parts[0].partition('.')
+    return (domain, bus, _number(dev, 0x1f, "slot number"),
+            _number(func, 7, "function number") if dot else None)
+
+
+def _parse_ids(text):
+    # [vendor]:[device][:class]
+    parts = text.split(':')
+    if not 2 <= len(parts) <= 3:
+        raise ValueError("invalid ID expression: {!r}".format(text))
+    device_class = class_mask = None
+    if len(parts) == 3:
+        device_class, class_mask = _parse_class(parts[2])
+    return (_number(parts[0], 0xffff, "vendor ID"),
+            _number(parts[1], 0xffff, "device ID"), device_class, class_mask)
+
+
+def _parse_class(text):
+    # Two hex digits give the base class only, four the sub-class too.
+    if isinstance(text, int):
+        return text, 0xffff
+    value = _number(text, 0xffff, "device class")
+    if value is None:
+        return None, None
+    if len(text) <= 2:
+        return value << 8, 0xff00
+    return value, 0xffff
+
+
+class DeviceFilter(object):
+
+    """
+    Compiled filter of devices.
+
+    :attr domain:
+    :attr bus:
+    :attr dev:
+    :attr func:
+    :attr vendor_id:
+    :attr device_id:
+        Values to match, None matches anything
+    :attr device_class:
+    :attr class_mask:
+        The class of matching devices, after applying the mask, is equal to
+        ``device_class`` (None matches anything)
+
+    Filters are callable; calling one with a device tells whether the
+    device matches.
+    """
+
+    def __init__(self, slot=None, ids=None, device_class=None,
+                 class_mask=None):
+        """
+        Compile a filter.
+
+        :param slot:
+            Slot expression, as given to ``lspci -s``, for example
+            ``"0000:03:"``, ``"1f.3"`` or ``"*:*.0"``
+        :param ids:
+            Identifier expression, as given to ``lspci -d``, for example
+            ``"8086:"``, ``":10fb"`` or ``"8086::0200"``
+        :param device_class:
+            Class to match, either an integer (sub-class included) or a hex
+            string of two (base class only) or four digits
+        :param class_mask:
+            Mask applied to the class before comparing, to override the one
+            implied by ``device_class``
+        :raises ValueError:
+            If an expression cannot be parsed
+        """
+        self.domain, self.bus, self.dev, self.func = _parse_slot(slot or '')
+        self.vendor_id, self.device_id, cls, mask = _parse_ids(ids or ':')
+        if device_class is not None:
+            cls, mask = _parse_class(device_class)
+        if class_mask is not None:
+            mask = class_mask
+            if cls is None:
+                raise ValueError("class_mask requires a device class")
+        self.device_class = None if cls is None else cls & mask
+        self.class_mask = mask
+        self._checks = self._make_checks()
+        self._predicate = self._compile()
+
+    def __repr__(self):
+        """Get a debugging representation of the filter."""
+        fields = ('domain', 'bus', 'dev', 'func', 'vendor_id', 'device_id',
+                  'device_class', 'class_mask')
+        return '<{} {}>'.format(self.__class__.__name__, ' '.join(
+            '{}={:#x}'.format(name, getattr(self, name))
+            for name in fields if getattr(self, name) is not None) or 'any')
+
+    def __call__(self, device):
+        """Check if a device matches the filter."""
+        return self._predicate(device)
+
+    def _make_checks(self):
+        # (attribute, mask or None, value) of each constrained field
+        checks = []
+        for name in ('vendor_id', 'device_id', 'domain', 'bus', 'dev',
+                     'func'):
+            value = getattr(self, name)
+            if value is not None:
+                checks.append((name, None, value))
+        if self.device_class is not None:
+            checks.append(('device_class', self.class_mask, self.device_class))
+        return tuple(checks)
+
+    def _compile(self):
+        checks = self._checks
+        if not checks:
+            return lambda device: True
+        if len(checks) == 1:
+            name, mask, value = checks[0]
+            if mask is None:
+                return lambda device: getattr(device, name) == value
+            return lambda device: getattr(device, name) & mask == value
+
+        def predicate(device):
+            for name, mask, value in checks:
+                field = getattr(device, name)
+                if mask is not None:
+                    field &= mask
+                if field != value:
+                    return False
+            return True
+        return predicate
+
+    def filter(self, devices):
+        """
+        Get the matching devices.
+
+        :param devices:
+            Iterable of devices or records
+        :returns:
+            A list of matching devices, in order
+        """
+        return [device for device in devices if self._predicate(device)]
+
+    def select(self, table):
+        """
+        Get the matching rows of a table.
+
+        :param table:
+            :class:`~libpci.table.DeviceTable` to select from
+        :returns:
+            A new :class:`~libpci.table.DeviceTable` with the matching rows,
+            in order
+        """
+        rows = self._candidates(table)
+        if rows is None:
+            rows = range(len(table))
+        return table.take(row for row in rows if self._match_row(table, row))
+
+    def _candidates(self, table):
+        # Rows listed by the smallest usable index, or None if no index
+        # helps.
+        postings = []
+        for name, value in (('vendor_id', self.vendor_id),
+                            ('device_id', self.device_id)):
+            index = table.get_index(name)
+            if index is not None and value is not None:
+                postings.append(index.get(value, ()))
+        index = table.get_index('bus')
+        if index is not None and self.bus is not None:
+            if self.domain is not None:
+                postings.append(index.get(self.domain << 8 | self.bus, ()))
+            else:
+                postings.append(_union(
+                    rows for key, rows in index.items()
+                    if key & 0xff == self.bus))
+        index = table.get_index('device_class')
+        if index is not None and self.device_class is not None:
+            if self.class_mask == 0xffff:
+                postings.append(index.get(self.device_class, ()))
+            else:
+                postings.append(_union(
+                    rows for key, rows in index.items()
+                    if key & self.class_mask == self.device_class))
+        if postings:
+            return min(postings, key=len)
+
+    def _match_row(self, table, row):
+        for name, mask, value in self._checks:
+            if name in _BDF_FIELDS:
+                shift, mask = _BDF_FIELDS[name]
+                field = table.bdf[row] >> shift
+            else:
+                field = getattr(table, name)[row]
+            if mask is not None:
+                field &= mask
+            if field != value:
+                return False
+        return True
+
+
+def _union(postings):
+    return array('I', sorted(set().union(*postings)))
@@ -0,0 +1,577 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Synthetic PCI ID databases and sysfs trees for testing at scale.
+
+:func:`write_pci_ids()` writes a ``pci.ids`` file with made up vendors,
+devices and subsystems. :func:`write_sysfs()` writes a fake ``/sys`` with
+``bus/pci/devices`` populated the way the kernel does it, suitable for the
+``linux-sysfs`` access method with the ``sysfs.path`` parameter.
+:func:`write_modules_alias()` writes a ``modules.alias`` with patterns for
+the drivers of those devices, for :class:`libpci.modalias.ModuleAliases`::
+
+    ids = write_pci_ids('/tmp/fixture/pci.ids', seed=1)
+    functions = write_sysfs('/tmp/fixture/sys', ids, 10000, seed=1)
+    write_modules_alias('/tmp/fixture/modules.alias', functions, seed=1)
+    pci = LibPCI('linux-sysfs', {'sysfs.path': '/tmp/fixture/sys'},
+                 id_file='/tmp/fixture/pci.ids')
+
+Each PCI domain gets a host bridge and PCI Express root ports on bus zero,
+with one (possibly multi-function) endpoint below each port. Some
+endpoints are SR-IOV physical functions with their virtual functions laid
+out as the kernel would find them. Configuration space blobs carry valid
+standard (power management, MSI, PCI Express) and extended (AER, SR-IOV)
+capability chains. All the functions are deterministic for a given
+seed.
+
+The same generator can be run from the command line::
+
+    python3 -m libpci.fixtures /tmp/fixture --functions 100000
+"""
+
+from collections import namedtuple
+import argparse
+import os
+import random
+import struct
+
+from libpci._macros import PCI_BASE_ADDRESS_0
+from libpci._macros import PCI_CAPABILITY_LIST
+from libpci._macros import PCI_CAP_ID_EXP
+from libpci._macros import PCI_CAP_ID_MSI
+from libpci._macros import PCI_CAP_ID_PM
+from libpci._macros import PCI_CLASS_REVISION
+from libpci._macros import PCI_COMMAND
+from libpci._macros import PCI_EXP_FLAGS
+from libpci._macros import PCI_EXP_LNKCAP
+from libpci._macros import PCI_EXP_LNKCAP2
+from libpci._macros import PCI_EXP_LNKSTA
+from libpci._macros import PCI_EXP_TYPE_ENDPOINT
+from libpci._macros import PCI_EXP_TYPE_ROOT_PORT
+from libpci._macros import PCI_EXT_CAP_ID_AER
+from libpci._macros import PCI_EXT_CAP_ID_SRIOV
+from libpci._macros import PCI_HEADER_TYPE
+from libpci._macros import PCI_HEADER_TYPE_BRIDGE
+from libpci._macros import PCI_HEADER_TYPE_NORMAL
+from libpci._macros import PCI_INTERRUPT_PIN
+from libpci._macros import PCI_IOV_CTRL
+from libpci._macros import PCI_IOV_CTRL_VFE
+from libpci._macros import PCI_IOV_DID
+from libpci._macros import PCI_IOV_INITIALVF
+from libpci._macros import PCI_IOV_NUMVF
+from libpci._macros import PCI_IOV_OFFSET
+from libpci._macros import PCI_IOV_STRIDE
+from libpci._macros import PCI_IOV_TOTALVF
+from libpci._macros import PCI_PRIMARY_BUS
+from libpci._macros import PCI_SECONDARY_BUS
+from libpci._macros import PCI_STATUS
+from libpci._macros import PCI_STATUS_CAP_LIST
+from libpci._macros import PCI_SUBORDINATE_BUS
+from libpci._macros import PCI_SUBSYSTEM_ID
+from libpci._macros import PCI_SUBSYSTEM_VENDOR_ID
+from libpci._macros import PCI_VENDOR_ID
+from libpci.capabilities import PCI_EXT_CONFIG_SPACE_SIZE
+
+__all__ = ('IdEntry', 'FixtureFunction', 'write_modules_alias',
+           'write_pci_ids', 'write_sysfs')
+
+
+class IdEntry(namedtuple("IdEntry", "vendor_id device_id subsystems")):
+
+    """
+    A device present in a synthetic ID database.
+
+    :attr subsystems:
+        Tuple of ``(subvendor_id, subdevice_id)`` pairs listed for the
+        device
+    """
+
+    __slots__ = ()
+
+
+class FixtureFunction(namedtuple("FixtureFunction", (
+        "domain bus dev func vendor_id device_id device_class header_type"
+        " driver numa_node iommu_group physfn secondary_bus"
+        " subordinate_bus"))):
+
+    """
+    A function written to a synthetic sysfs tree, for checking results.
+
+    :attr device_class:
+        Base class and sub-class, like :attr:`libpci.Device.device_class`
+    :attr driver:
+        Name of the bound driver or None
+    :attr physfn:
+        Address of the physical function of a virtual function, or None
+    :attr secondary_bus, subordinate_bus:
+        Bus numbers behind a bridge, or None for other functions
+    """
+
+    __slots__ = ()
+
+    @property
+    def slot(self):
+        """Address of the function in the ``DDDD:BB:dd.f`` notation."""
+        return '{:04x}:{:02x}:{:02x}.{:x}'.format(
+            self.domain, self.bus, self.dev, self.func)
+
+
+# Classes of synthetic endpoints: (class, prog-if, driver of physical
+# functions, driver of virtual functions, SR-IOV capable)
+_ENDPOINT_CLASSES = (
+    (0x0108, 0x02, 'nvme', 'nvme', True),
+    (0x0200, 0x00, 'ixgbe', 'ixgbevf', True),
+    (0x0200, 0x00, 'i40e', 'iavf', True),
+    (0x0300, 0x00, 'amdgpu', None, False),
+    (0x0106, 0x01, 'ahci', None, False),
+)
+_CLASS_NAMES = (
+    ('01', 'Mass storage controller', (
+        ('06', 'SATA controller'), ('08', 'Non-Volatile memory controller'))),
+    ('02', 'Network controller', (('00', 'Ethernet controller'),)),
+    ('03', 'Display controller', (('00', 'VGA compatible controller'),)),
+    ('06', 'Bridge', (('00', 'Host bridge'), ('04', 'PCI bridge'))),
+)
+_CLASS_HOST_BRIDGE = 0x0600
+_CLASS_PCI_BRIDGE = 0x0604
+
+# Layout of the synthetic capability chains
+_CAP_PM = 0x40
+_CAP_MSI = 0x50
+_CAP_EXP = 0x70
+_EXT_CAP_AER = 0x100
+_EXT_CAP_SRIOV = 0x140
+_AER_VERSION = 2
+_SRIOV_VERSION = 1
+_PCI_EXP_VERSION = 2
+_COMMAND_MEMORY_MASTER = 0x0006
+_LINK_SPEEDS = (3, 4, 5)
+_LINK_WIDTHS = (1, 4, 8, 16)
+
+_RESOURCE_COUNT = 13
+_RESOURCE_EMPTY = "0x0000000000000000 0x0000000000000000 0x0000000000000000\n"
+_RESOURCE_MEM64 = 0x140204
+_BAR_SIZE = 0x100000
+_BAR_MEM64 = 0x4
+
+
+def write_pci_ids(path, vendors=200, devices=50, subsystems=2, seed=0):
+    """
+    Write a synthetic PCI ID database.
+
+    :param path:
+        Path of the file to write
+    :param vendors:
+        Number of vendors
+    :param devices:
+        Number of devices of each vendor
+    :param subsystems:
+        Number of subsystems listed for each device
+    :param seed:
+        Seed of the random number generator
+    :returns:
+        List of :class:`IdEntry`, one for each device in the file
+    """
+    rng = random.Random(seed)
+    vendor_ids = sorted(rng.sample(range(1, 0xffff), vendors))
+    entries = []
+    with open(path, 'wt', encoding='utf-8') as stream:
+        stream.write('# Synthetic PCI ID database, seed {}\n'.format(seed))
+        for vendor_id in vendor_ids:
+            stream.write('{:04x}  Vendor {:04x}\n'.format(
+                vendor_id, vendor_id))
+            for device_id in sorted(rng.sample(range(0xffff), devices)):
+                stream.write('\t{:04x}  Device {:04x}:{:04x}\n'.format(
+                    device_id, vendor_id, device_id))
+                subs = tuple(sorted(
+                    (rng.choice(vendor_ids), rng.randrange(0xffff))
+                    for i in range(subsystems)))
+                for subvendor_id, subdevice_id in subs:
+                    stream.write(
+                        '\t\t{:04x} {:04x}  Subsystem {:04x}:{:04x}\n'.format(
+                            subvendor_id, subdevice_id, subvendor_id,
+                            subdevice_id))
+                entries.append(IdEntry(vendor_id, device_id, subs))
+        stream.write('\n# List of known device classes\n')
+        for base, name, sub_classes in _CLASS_NAMES:
+            stream.write('C {}  {}\n'.format(base, name))
+            for sub, sub_name in sub_classes:
+                stream.write('\t{}  {}\n'.format(sub, sub_name))
+    return entries
+
+
+def _config(size, vendor_id, device_id, device_class, prog_if, header_type,
+            exp_type, link, subsystem=None, bar=None, bridge=None,
+            sriov=None, aer=True):
+    config = bytearray(size)
+    struct.pack_into('<HH', config, PCI_VENDOR_ID.value, vendor_id, device_id)
+    struct.pack_into('<H', config, PCI_COMMAND.value, _COMMAND_MEMORY_MASTER)
+    struct.pack_into('<I', config, PCI_CLASS_REVISION.value,
+                     (device_class << 16) | (prog_if << 8) | 1)
+    config[PCI_HEADER_TYPE.value] = header_type
+    if bar is not None:
+        struct.pack_into('<Q', config, PCI_BASE_ADDRESS_0.value,
+                         bar | _BAR_MEM64)
+    if subsystem is not None:
+        struct.pack_into('<H', config, PCI_SUBSYSTEM_VENDOR_ID.value,
+                         subsystem[0])
+        struct.pack_into('<H', config, PCI_SUBSYSTEM_ID.value, subsystem[1])
+    if bridge is not None:
+        config[PCI_PRIMARY_BUS.value] = bridge[0]
+        config[PCI_SECONDARY_BUS.value] = bridge[1]
+        config[PCI_SUBORDINATE_BUS.value] = bridge[2]
+    if exp_type is None:
+        return config
+    config[PCI_INTERRUPT_PIN.value] = 1
+    struct.pack_into('<H', config, PCI_STATUS.value, PCI_STATUS_CAP_LIST.value)
+    config[PCI_CAPABILITY_LIST.value] = _CAP_PM
+    config[_CAP_PM:_CAP_PM + 2] = bytes((PCI_CAP_ID_PM.value, _CAP_MSI))
+    config[_CAP_MSI:_CAP_MSI + 2] = bytes((PCI_CAP_ID_MSI.value, _CAP_EXP))
+    config[_CAP_EXP:_CAP_EXP + 2] = bytes((PCI_CAP_ID_EXP.value, 0))
+    max_speed, max_width, speed, width = link
+    struct.pack_into('<H', config, _CAP_EXP + PCI_EXP_FLAGS.value,
+                     _PCI_EXP_VERSION | (exp_type << 4))
+    struct.pack_into('<I', config, _CAP_EXP + PCI_EXP_LNKCAP.value,
+                     max_speed | (max_width << 4))
+    struct.pack_into('<H', config, _CAP_EXP + PCI_EXP_LNKSTA.value,
+                     speed | (width << 4))
+    struct.pack_into('<I', config, _CAP_EXP + PCI_EXP_LNKCAP2.value,
+                     ((1 << max_speed) - 1) << 1)
+    if size < PCI_EXT_CONFIG_SPACE_SIZE or not aer:
+        return config
+    next_cap = _EXT_CAP_SRIOV if sriov is not None else 0
+    struct.pack_into('<I', config, _EXT_CAP_AER, PCI_EXT_CAP_ID_AER.value
+                     | (_AER_VERSION << 16) | (next_cap << 20))
+    if sriov is not None:
+        total_vfs, num_vfs, offset, stride, vf_device_id = sriov
+        base = _EXT_CAP_SRIOV
+        struct.pack_into('<I', config, base, PCI_EXT_CAP_ID_SRIOV.value
+                         | (_SRIOV_VERSION << 16))
+        struct.pack_into('<H', config, base + PCI_IOV_CTRL.value,
+                         PCI_IOV_CTRL_VFE.value if num_vfs else 0)
+        struct.pack_into('<H', config, base + PCI_IOV_INITIALVF.value,
+                         total_vfs)
+        struct.pack_into('<H', config, base + PCI_IOV_TOTALVF.value,
+                         total_vfs)
+        struct.pack_into('<H', config, base + PCI_IOV_NUMVF.value, num_vfs)
+        struct.pack_into('<H', config, base + PCI_IOV_OFFSET.value, offset)
+        struct.pack_into('<H', config, base + PCI_IOV_STRIDE.value, stride)
+        struct.pack_into('<H', config, base + PCI_IOV_DID.value,
+                         vf_device_id)
+    return config
+
+
+class _Writer(object):
+
+    # Writes functions into the tree and keeps track of the ground truth.
+
+    def __init__(self, root, config_size):
+        self.devices = os.path.join(root, 'bus', 'pci', 'devices')
+        self.drivers = os.path.join(root, 'bus', 'pci', 'drivers')
+        self.groups = os.path.join(root, 'kernel', 'iommu_groups')
+        for path in (self.devices, self.drivers, self.groups):
+            os.makedirs(path, exist_ok=True)
+        self.config_size = config_size
+        self.functions = []
+        self.next_bar = 0x80000000
+        self.next_group = 0
+
+    def _link(self, target, path):
+        os.symlink(os.path.relpath(target, os.path.dirname(path)), path)
+
+    def add(self, function, config, subsystem=(0, 0), prog_if=0, bar=False):
+        path = os.path.join(self.devices, function.slot)
+        os.mkdir(path)
+        resources = [_RESOURCE_EMPTY] * _RESOURCE_COUNT
+        if bar:
+            resources[0] = '0x{:016x} 0x{:016x} 0x{:016x}\n'.format(
+                bar, bar + _BAR_SIZE - 1, _RESOURCE_MEM64)
+        attributes = (
+            ('vendor', '0x{:04x}\n'.format(function.vendor_id)),
+            ('device', '0x{:04x}\n'.format(function.device_id)),
+            ('subsystem_vendor', '0x{:04x}\n'.format(subsystem[0])),
+            ('subsystem_device', '0x{:04x}\n'.format(subsystem[1])),
+            ('class', '0x{:06x}\n'.format(
+                (function.device_class << 8) | prog_if)),
+            ('revision', '0x01\n'),
+            ('irq', '0\n'),
+            ('numa_node', '{}\n'.format(function.numa_node)),
+            ('resource', ''.join(resources)),
+            ('modalias', 'pci:v{:08X}d{:08X}sv{:08X}sd{:08X}bc{:02X}sc{:02X}'
+             'i{:02X}\n'.format(
+                 function.vendor_id, function.device_id, subsystem[0],
+                 subsystem[1], function.device_class >> 8,
+                 function.device_class & 0xff, prog_if)),
+        )
+        for name, value in attributes:
+            with open(os.path.join(path, name), 'wt') as stream:
+                stream.write(value)
+        with open(os.path.join(path, 'config'), 'wb') as stream:
+            stream.write(config)
+        if function.driver is not None:
+            driver = os.path.join(self.drivers, function.driver)
+            os.makedirs(driver, exist_ok=True)
+            self._link(driver, os.path.join(path, 'driver'))
+            self._link(path, os.path.join(driver, function.slot))
+        group = os.path.join(self.groups, str(function.iommu_group))
+        os.makedirs(os.path.join(group, 'devices'), exist_ok=True)
+        self._link(group, os.path.join(path, 'iommu_group'))
+        self._link(path, os.path.join(group, 'devices', function.slot))
+        if function.physfn is not None:
+            self._link(os.path.join(self.devices, function.physfn),
+                       os.path.join(path, 'physfn'))
+        self.functions.append(function)
+
+    def group(self):
+        self.next_group += 1
+        return self.next_group - 1
+
+    def bar(self):
+        self.next_bar += _BAR_SIZE
+        return self.next_bar - _BAR_SIZE
+
+
+def write_sysfs(root, ids, functions=256, seed=0, numa_nodes=2,
+                sriov_ratio=0.2, vfs_per_pf=8, degraded_ratio=0.05,
+                config_size=PCI_EXT_CONFIG_SPACE_SIZE):
+    """
+    Write a synthetic sysfs tree.
+
+    :param root:
+        Directory to use as the root of sysfs (the ``sysfs.path``
+        parameter of libpci)
+    :param ids:
+        List of :class:`IdEntry` returned by :func:`write_pci_ids()`;
+        identifiers of all functions are picked from it
+    :param functions:
+        Total number of functions to write, bridges included
+    :param seed:
+        Seed of the random number generator
+    :param numa_nodes:
+        Number of NUMA nodes the root ports are spread over
+    :param sriov_ratio:
+        Fraction of SR-IOV capable endpoints that have virtual functions
+    :param vfs_per_pf:
+        Number of virtual functions of each such physical function
+    :param degraded_ratio:
+        Fraction of links that trained below their capabilities
+    :param config_size:
+        Size of each configuration space blob. Use 256 to save space;
+        extended capabilities (AER, SR-IOV) need 4096.
+    :returns:
+        List of :class:`FixtureFunction` in the order they were written
+    """
+    rng = random.Random(seed)
+    writer = _Writer(root, config_size)
+    remaining = functions
+    domain = 0
+    while remaining > 0:
+        remaining = _write_domain(
+            writer, rng, ids, domain, remaining, numa_nodes, sriov_ratio,
+            vfs_per_pf, degraded_ratio)
+        domain += 1
+    return writer.functions
+
+
+def write_modules_alias(path, functions, patterns=5000, seed=0):
+    """
+    Write a synthetic ``modules.alias``.
+
+    :param path:
+        Path of the file to write
+    :param functions:
+        List of :class:`FixtureFunction` returned by :func:`write_sysfs()`.
+        Each function bound to a driver gets a pattern naming its vendor and
+        device for that driver, and storage drivers also get a pattern
+        matching their class, like ``nvme`` and ``ahci`` do.
+    :param patterns:
+        Number of other patterns, for made up modules and devices
+    :param seed:
+        Seed of the random number generator
+    :returns:
+        Number of patterns written
+    """
+    rng = random.Random(seed)
+    lines = []
+    seen = set()
+    for function in functions:
+        key = (function.vendor_id, function.device_id, function.driver)
+        if function.driver is not None and key not in seen:
+            seen.add(key)
+            lines.append('alias pci:v{:08X}d{:08X}sv*sd*bc*sc*i* {}\n'.format(
+                *key))
+    for device_class, prog_if, driver, vf_driver, sriov in _ENDPOINT_CLASSES:
+        if prog_if:
+            lines.append(
+                'alias pci:v*d*sv*sd*bc{:02X}sc{:02X}i{:02X}* {}\n'.format(
+                    device_class >> 8, device_class & 0xff, prog_if, driver))
+    for index in range(patterns):
+        device = '*' if rng.random() < 0.1 else '{:08X}'.format(
+            rng.randrange(0x10000))
+        lines.append('alias pci:v{:08X}d{}sv*sd*bc*sc*i* module{}\n'.format(
+            rng.randrange(0x10000), device, index // 10))
+    rng.shuffle(lines)
+    with open(path, 'wt', encoding='utf-8') as stream:
+        stream.write('# Aliases extracted from modules themselves.\n')
+        stream.writelines(lines)
+    return len(lines)
+
+
+def _pick_link(rng, degraded_ratio):
+    max_speed = rng.choice(_LINK_SPEEDS)
+    max_width = rng.choice(_LINK_WIDTHS)
+    if rng.random() < degraded_ratio:
+        return max_speed, max_width, 1, max(1, max_width // 4)
+    return max_speed, max_width, max_speed, max_width
+
+
+def _write_domain(writer, rng, ids, domain, remaining, numa_nodes,
+                  sriov_ratio, vfs_per_pf, degraded_ratio):
+    size = writer.config_size
+    host = rng.choice(ids)
+    writer.add(FixtureFunction(
+        domain, 0, 0, 0, host.vendor_id, host.device_id, _CLASS_HOST_BRIDGE,
+        PCI_HEADER_TYPE_NORMAL.value, None, 0, writer.group(), None, None,
+        None), _config(size, host.vendor_id, host.device_id,
+                       _CLASS_HOST_BRIDGE, 0, PCI_HEADER_TYPE_NORMAL.value,
+                       None, None))
+    remaining -= 1
+    next_bus = 1
+    # Root ports take the remaining device numbers of bus zero.
+    for port_devfn in range(8, 256):
+        if remaining <= 0 or next_bus > 0xff:
+            break
+        numa_node = (port_devfn - 8) % numa_nodes
+        entry = rng.choice(ids)
+        cls, prog_if, pf_driver, vf_driver, sriov_capable = rng.choice(
+            _ENDPOINT_CLASSES)
+        # Plan the functions below the port: physical functions first,
+        # then the virtual functions of each of them (ARI style).
+        budget = remaining - 1
+        nr_pfs = min(rng.choice((1, 1, 1, 2, 4)), budget)
+        vfs = []
+        for pf in range(nr_pfs):
+            count = 0
+            if sriov_capable and rng.random() < sriov_ratio:
+                count = min(vfs_per_pf, budget - nr_pfs - sum(vfs))
+            vfs.append(max(count, 0))
+        secondary = next_bus
+        last_rid = (secondary << 8) + nr_pfs + sum(vfs) - 1
+        subordinate = max(secondary, last_rid >> 8)
+        if subordinate > 0xff:
+            break
+        port_link = _pick_link(rng, 0)
+        writer.add(FixtureFunction(
+            domain, 0, port_devfn >> 3, port_devfn & 7, entry.vendor_id,
+            entry.device_id, _CLASS_PCI_BRIDGE, PCI_HEADER_TYPE_BRIDGE.value,
+            'pcieport', numa_node, writer.group(), None, secondary,
+            subordinate), _config(
+                size, entry.vendor_id, entry.device_id, _CLASS_PCI_BRIDGE, 0,
+                PCI_HEADER_TYPE_BRIDGE.value, PCI_EXP_TYPE_ROOT_PORT.value,
+                port_link, bridge=(0, secondary, subordinate)))
+        remaining -= 1
+        link = _pick_link(rng, degraded_ratio)
+        subsystem = rng.choice(entry.subsystems or ((0, 0),))
+        header_type = PCI_HEADER_TYPE_NORMAL.value
+        if nr_pfs > 1:
+            header_type |= 0x80
+        vf_rid = (secondary << 8) + nr_pfs
+        vf_device_id = (entry.device_id + 1) & 0xffff
+        for pf in range(nr_pfs):
+            driver = pf_driver if rng.random() < 0.9 else None
+            pf_slot = '{:04x}:{:02x}:00.{:x}'.format(domain, secondary, pf)
+            sriov = None
+            if sriov_capable:
+                # First VF offset is relative to the routing ID of the PF.
+                pf_rid = (secondary << 8) + pf
+                sriov = (max(vfs[pf], vfs_per_pf), vfs[pf],
+                         vf_rid - pf_rid if vfs[pf] else 0, 1, vf_device_id)
+            bar = writer.bar()
+            writer.add(FixtureFunction(
+                domain, secondary, 0, pf, entry.vendor_id, entry.device_id,
+                cls, header_type & 0x7f, driver, numa_node, writer.group(),
+                None, None, None), _config(
+                    size, entry.vendor_id, entry.device_id, cls, prog_if,
+                    header_type, PCI_EXP_TYPE_ENDPOINT.value, link,
+                    subsystem=subsystem, bar=bar, sriov=sriov),
+                subsystem=subsystem, prog_if=prog_if, bar=bar)
+            remaining -= 1
+            pf_path = os.path.join(writer.devices, pf_slot)
+            if sriov is not None:
+                with open(os.path.join(pf_path, 'sriov_totalvfs'), 'wt') as f:
+                    f.write('{}\n'.format(sriov[0]))
+                with open(os.path.join(pf_path, 'sriov_numvfs'), 'wt') as f:
+                    f.write('{}\n'.format(vfs[pf]))
+            for index in range(vfs[pf]):
+                bus, devfn = divmod(vf_rid, 256)
+                if vf_driver is not None and rng.random() < 0.3:
+                    driver = 'vfio-pci'
+                else:
+                    driver = vf_driver
+                vf = FixtureFunction(
+                    domain, bus, devfn >> 3, devfn & 7, entry.vendor_id,
+                    vf_device_id, cls, PCI_HEADER_TYPE_NORMAL.value, driver,
+                    numa_node, writer.group(), pf_slot, None, None)
+                writer.add(vf, _config(
+                    size, entry.vendor_id, vf_device_id, cls, prog_if,
+                    PCI_HEADER_TYPE_NORMAL.value,
+                    PCI_EXP_TYPE_ENDPOINT.value, link, subsystem=subsystem),
+                    subsystem=subsystem, prog_if=prog_if)
+                os.symlink(os.path.join('..', vf.slot),
+                           os.path.join(pf_path, 'virtfn{}'.format(index)))
+                vf_rid += 1
+                remaining -= 1
+        next_bus = subordinate + 1
+    return remaining
+
+
+def main(argv=None):
+    """Generate a fixture from the command line."""
+    parser = argparse.ArgumentParser(
+        prog='python3 -m libpci.fixtures',
+        description="Write a synthetic pci.ids, sysfs tree and"
+                    " modules.alias")
+    parser.add_argument('directory', help="directory to write into")
+    parser.add_argument('--functions', type=int, default=256)
+    parser.add_argument('--vendors', type=int, default=200)
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--numa-nodes', type=int, default=2)
+    parser.add_argument('--sriov-ratio', type=float, default=0.2)
+    parser.add_argument('--vfs-per-pf', type=int, default=8)
+    parser.add_argument('--config-size', type=int, choices=(256, 4096),
+                        default=4096)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    os.makedirs(args.directory, exist_ok=True)
+    ids = write_pci_ids(os.path.join(args.directory, 'pci.ids'),
+                        args.vendors, args.devices, seed=args.seed)
+    written = write_sysfs(
+        os.path.join(args.directory, 'sys'), ids, args.functions,
+        seed=args.seed, numa_nodes=args.numa_nodes,
+        sriov_ratio=args.sriov_ratio, vfs_per_pf=args.vfs_per_pf,
+        config_size=args.config_size)
+    write_modules_alias(os.path.join(args.directory, 'modules.alias'),
+                        written, seed=args.seed)
+    print("Wrote {} functions to {}".format(len(written), args.directory))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Queryable inventory of devices with secondary indexes.
+
+:class:`Inventory` keeps a hash index for each of the attributes listed in
+:data:`INDEXED_ATTRIBUTES`. A query names any number of them and is
+answered by intersecting the sets of matching devices, smallest first,
+without looking at any other device::
+
+    inventory = Inventory(pci)
+    inventory.query(device_class=0x0108, numa_node=1, driver='vfio-pci')
+
+The driver, NUMA node and IOMMU group come from sysfs and are None with
+other access methods. :meth:`Inventory.refresh()` rescans the bus and
+updates the indexes with the devices that changed only.
+"""
+
+import logging
+import os
+
+from libpci._types import pci_access_type
+
+__all__ = ('INDEXED_ATTRIBUTES', 'Inventory')
+
+
+_logger = logging.getLogger("libpci.inventory")
+
+#: Attributes that can be used in queries
+INDEXED_ATTRIBUTES = ('vendor_id', 'device_id', 'device_class', 'driver',
+                      'numa_node', 'iommu_group')
+
+
+def _link_name(path):
+    try:
+        return os.path.basename(os.readlink(path))
+    except OSError:
+        return None
+
+
+def _read_int(path):
+    try:
+        with open(path, 'rb') as stream:
+            return int(stream.read())
+    except (OSError, ValueError):
+        return None
+
+
+class Inventory(object):
+
+    """
+    Devices of a :class:`libpci.LibPCI` object, indexed for queries.
+
+    The inventory is not thread-safe; queries may run concurrently with
+    each other but not with :meth:`refresh()`.
+    """
+
+    def __init__(self, pci):
+        """
+        Build the inventory.
+
+        :param pci:
+            The :class:`libpci.LibPCI` object to take devices from. The bus
+            is scanned if it was not scanned yet.
+        """
+        self._pci = pci
+        self._sysfs = None
+        if pci.method == pci_access_type.PCI_ACCESS_SYS_BUS_PCI:
+            self._sysfs = os.path.join(
+                pci.get_param("sysfs.path") or "/sys", "bus", "pci",
+                "devices")
+        # address -> device
+        self._devices = {}
+        # address -> attribute values, in the order of INDEXED_ATTRIBUTES
+        self._values = {}
+        # attribute -> value -> set of addresses
+        self._indexes = {name: {} for name in INDEXED_ATTRIBUTES}
+        for device in pci.scan_bus():
+            self.add(device)
+
+    def __repr__(self):
+        """Get a debugging representation of the inventory."""
+        return '<{} {} devices>'.format(
+            self.__class__.__name__, len(self._devices))
+
+    def __len__(self):
+        """Get the number of devices."""
+        return len(self._devices)
+
+    def __iter__(self):
+        """Iterate over all the devices, in order of address."""
+        devices = self._devices
+        return (devices[key] for key in sorted(devices))
+
+    def _key(self, device):
+        return (device.domain, device.bus, device.dev, device.func)
+
+    def _read_values(self, device):
+        driver = numa_node = iommu_group = None
+        if self._sysfs is not None:
+            path = os.path.join(self._sysfs, device.slot)
+            driver = _link_name(os.path.join(path, 'driver'))
+            numa_node = _read_int(os.path.join(path, 'numa_node'))
+            iommu_group = _link_name(os.path.join(path, 'iommu_group'))
+            if iommu_group is not None:
+                iommu_group = int(iommu_group)
+        return (device.vendor_id, device.device_id, device.device_class,
+                driver, numa_node, iommu_group)
+
+    def add(self, device):
+        """
+        Add a device, replacing any device at the same address.
+
+        :param device:
+            The :class:`libpci.Device` to add
+        """
+        key = self._key(device)
+        if key in self._devices:
+            self.remove(device)
+        values = self._read_values(device)
+        self._devices[key] = device
+        self._values[key] = values
+        for name, value in zip(INDEXED_ATTRIBUTES, values):
+            self._indexes[name].setdefault(value, set()).add(key)
+
+    def remove(self, device):
+        """
+        Remove a device.
+
+        :param device:
+            The device to remove, or any device at the same address
+        :raises KeyError:
+            If there is no device at that address
+        """
+        key = self._key(device)
+        del self._devices[key]
+        values = self._values.pop(key)
+        for name, value in zip(INDEXED_ATTRIBUTES, values):
+            postings = self._indexes[name]
+            keys = postings[value]
+            keys.discard(key)
+            if not keys:
+                del postings[value]
+
+    def reload(self, device):
+        """
+        Read the attributes of a device again.
+
+        Binding a device to another driver does not change anything
+        :meth:`libpci.LibPCI.rescan()` looks at; call this to pick up such
+        changes for a single device.
+        """
+        self.add(self._devices[self._key(device)])
+
+    def update(self, changes):
+        """
+        Apply the result of :meth:`libpci.LibPCI.rescan()`.
+
+        :param changes:
+            :class:`libpci.ChangeSet` with added, removed and changed devices
+        """
+        for device in changes.removed:
+            self.remove(device)
+        for device in changes.changed + changes.added:
+            self.add(device)
+
+    def refresh(self):
+        """
+        Rescan the bus and update the inventory.
+
+        :returns:
+            The :class:`libpci.ChangeSet` returned by the rescan
+        """
+        changes = self._pci.rescan()
+        if changes:
+            _logger.debug("Updating inventory: %d added, %d removed,"
+                          " %d changed", len(changes.added),
+                          len(changes.removed), len(changes.changed))
+            self.update(changes)
+        return changes
+
+    def attributes(self, device):
+        """
+        Get the indexed attributes of a device.
+
+        :returns:
+            A dictionary with a value for each of
+            :data:`INDEXED_ATTRIBUTES`
+        """
+        return dict(zip(INDEXED_ATTRIBUTES, self._values[self._key(device)]))
+
+    def values(self, name):
+        """
+        Get the distinct values of an attribute.
+
+        :returns:
+            A dictionary mapping each value to the number of devices
+        """
+        return {value: len(keys)
+                for value, keys in self._indexes[name].items()}
+
+    def _matching(self, criteria):
+        for name in criteria:
+            if name not in self._indexes:
+                raise ValueError("{!r} is not indexed".format(name))
+        postings = []
+        for name, value in criteria.items():
+            index = self._indexes[name]
+            if isinstance(value, (set, frozenset, list, tuple)):
+                keys = set()
+                for item in value:
+                    keys.update(index.get(item, ()))
+            else:
+                keys = index.get(value)
+                if keys is None:
+                    return set()
+            postings.append(keys)
+        if not postings:
+            return set(self._devices)
+        postings.sort(key=len)
+        result = set(postings[0])
+        for keys in postings[1:]:
+            if not result:
+                break
+            result &= keys
+        return result
+
+    def query(self, **criteria):
+        """
+        Find devices matching all the given criteria.
+
+        :param criteria:
+            Attributes from :data:`INDEXED_ATTRIBUTES` mapped to a value, or
+            to a set of values any of which matches
+        :returns:
+            A list of devices, in order of address
+        :raises ValueError:
+            If an attribute is not indexed
+        """
+        devices = self._devices
+        return [devices[key] for key in sorted(self._matching(criteria))]
+
+    def count(self, **criteria):
+        """
+        Count devices matching all the given criteria.
+
+        This takes the same arguments as :meth:`query()`.
+        """
+        return len(self._matching(criteria))
@@ -0,0 +1,313 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Monitoring of PCI Express link speed and width.
+
+A link that trained below its capabilities (a Gen4 x16 device running at
+Gen1 x4, say) keeps working, just a lot slower. :class:`LinkMonitor` finds
+such links across all devices and can keep watching them cheaply: after
+the initial pass it only re-reads the 16-bit link status register of each
+device.
+"""
+
+from array import array
+from collections import namedtuple
+import logging
+import time
+
+from libpci._functions import pci_read_word
+from libpci._macros import PCI_CAP_ID_EXP
+from libpci._macros import PCI_EXP_FLAGS
+from libpci._macros import PCI_EXP_FLAGS_TYPE
+from libpci._macros import PCI_EXP_FLAGS_VERS
+from libpci._macros import PCI_EXP_LNKCAP
+from libpci._macros import PCI_EXP_LNKCAP2
+from libpci._macros import PCI_EXP_LNKCAP_SPEED
+from libpci._macros import PCI_EXP_LNKCAP_WIDTH
+from libpci._macros import PCI_EXP_LNKSTA
+from libpci._macros import PCI_EXP_LNKSTA_SPEED
+from libpci._macros import PCI_EXP_LNKSTA_WIDTH
+from libpci._macros import PCI_EXP_TYPE_ROOT_EC
+from libpci._macros import PCI_EXP_TYPE_ROOT_INT_EP
+from libpci.capabilities import PCI_CONFIG_SPACE_SIZE
+from libpci.capabilities import find_capability
+
+__all__ = ('LinkMonitor', 'LinkState', 'decode_link', 'read_configs')
+
+
+_logger = logging.getLogger("libpci.link")
+
+# Transfer rate, in GT/s, of each link speed code
+_SPEEDS = {1: 2.5, 2: 5.0, 3: 8.0, 4: 16.0, 5: 32.0, 6: 64.0}
+# Fraction of the raw rate left after line encoding: 8b/10b up to Gen2,
+# 128b/130b up to Gen5 and FLIT mode (242 of 256 bytes carry TLPs) in Gen6
+_ENCODING = {1: 8 / 10, 2: 8 / 10, 3: 128 / 130, 4: 128 / 130,
+             5: 128 / 130, 6: 242 / 256}
+# Functions of these types are integrated into the root complex and have
+# no link of their own
+_NO_LINK = (PCI_EXP_TYPE_ROOT_INT_EP.value, PCI_EXP_TYPE_ROOT_EC.value)
+_WIDTH_SHIFT = 4
+# The supported link speeds vector of LNKCAP2 starts at bit 1 (2.5GT/s)
+_LNKCAP2_SPEEDS = 0xfe
+
+
+def _word(config, offset):
+    return config[offset] | (config[offset + 1] << 8)
+
+
+def _long(config, offset):
+    return _word(config, offset) | (_word(config, offset + 2) << 16)
+
+
+def _bandwidth(speed, width):
+    # Usable bytes per second in each direction
+    if speed not in _SPEEDS:
+        return 0
+    return int(_SPEEDS[speed] * 1e9 * _ENCODING[speed] * width / 8)
+
+
+class LinkState(namedtuple("LinkState", (
+        "device max_speed max_width speed width"))):
+
+    """
+    Capabilities and negotiated parameters of a single link.
+
+    Speeds are link speed codes (1 for 2.5GT/s, 2 for 5GT/s, 3 for 8GT/s
+    and so on), widths are numbers of lanes. A negotiated width of zero
+    means the link is down (for example a port with nothing plugged in).
+
+    :attr device:
+        The :class:`libpci.Device` (or record with the same interface)
+    """
+
+    __slots__ = ()
+
+    @property
+    def max_rate(self):
+        """Highest supported transfer rate in GT/s, or None if unknown."""
+        return _SPEEDS.get(self.max_speed)
+
+    @property
+    def rate(self):
+        """Negotiated transfer rate in GT/s, or None if unknown."""
+        return _SPEEDS.get(self.speed)
+
+    @property
+    def active(self):
+        """Flag determining if the link is up."""
+        return self.width != 0
+
+    @property
+    def degraded(self):
+        """
+        Flag determining if the link is up but slower or narrower than the
+        device supports.
+
+        Note that the other end of the link may be the limiting factor and
+        that some devices lower the link speed on purpose when idle.
+        """
+        return self.active and (
+            self.speed < self.max_speed or self.width < self.max_width)
+
+    @property
+    def max_bandwidth(self):
+        """Usable bandwidth, in bytes per second, at full speed and width."""
+        return _bandwidth(self.max_speed, self.max_width)
+
+    @property
+    def bandwidth(self):
+        """Usable bandwidth, in bytes per second, of the negotiated link."""
+        return _bandwidth(self.speed, self.width)
+
+
+def _lnksta_fields(lnksta):
+    return (lnksta & PCI_EXP_LNKSTA_SPEED.value,
+            (lnksta & PCI_EXP_LNKSTA_WIDTH.value) >> _WIDTH_SHIFT)
+
+
+def _decode(config):
+    # Returns the LNKSTA offset and the link capabilities, or None.
+    offset = find_capability(config, PCI_CAP_ID_EXP)
+    if offset is None or offset + PCI_EXP_LNKSTA.value + 2 > len(config):
+        return None
+    flags = _word(config, offset + PCI_EXP_FLAGS.value)
+    if (flags & PCI_EXP_FLAGS_TYPE.value) >> 4 in _NO_LINK:
+        return None
+    lnkcap = _long(config, offset + PCI_EXP_LNKCAP.value)
+    max_speed = lnkcap & PCI_EXP_LNKCAP_SPEED.value
+    max_width = (lnkcap & PCI_EXP_LNKCAP_WIDTH.value) >> _WIDTH_SHIFT
+    # Since version 2 of the capability the vector of supported speeds in
+    # LNKCAP2 takes precedence, its highest bit is the maximum speed.
+    lnkcap2_pos = offset + PCI_EXP_LNKCAP2.value
+    if ((flags & PCI_EXP_FLAGS_VERS.value) >= 2
+            and lnkcap2_pos + 4 <= len(config)):
+        speeds = _long(config, lnkcap2_pos) & _LNKCAP2_SPEEDS
+        if speeds:
+            max_speed = speeds.bit_length() - 1
+    return offset + PCI_EXP_LNKSTA.value, max_speed, max_width
+
+
+def decode_link(device, config):
+    """
+    Decode the link of a device from a configuration space snapshot.
+
+    :param device:
+        Object stored in the ``device`` field of the result
+    :param config:
+        Snapshot of the (conventional) configuration space of the device
+    :returns:
+        A :class:`LinkState` or None if the device has no PCI Express link.
+    """
+    decoded = _decode(config)
+    if decoded is not None:
+        pos, max_speed, max_width = decoded
+        return LinkState(device, max_speed, max_width,
+                         *_lnksta_fields(_word(config, pos)))
+
+
+def read_configs(devices):
+    """
+    Read the standard configuration space of devices.
+
+    :param devices:
+        An iterable of :class:`libpci.Device`
+    :returns:
+        A list with the configuration space of each device, falling back to
+        the first 64 bytes for unprivileged users, or None where neither
+        can be read
+    """
+    configs = []
+    for device in devices:
+        config = device.read_config(PCI_CONFIG_SPACE_SIZE)
+        if config is None:
+            config = device.read_config(64)
+        configs.append(config)
+    return configs
+
+
+class LinkMonitor(object):
+
+    """
+    Monitor of the links of many devices.
+
+    The monitor is set up with a single configuration space read per
+    device. From then on :meth:`poll()` reads one word per device.
+
+    :attr links:
+        List of :class:`LinkState`, one per device with a PCI Express link,
+        updated by :meth:`poll()`
+    """
+
+    def __init__(self, devices, configs=None):
+        """
+        Initialize a monitor.
+
+        :param devices:
+            An iterable of :class:`libpci.Device`, typically the result of
+            :meth:`libpci.LibPCI.scan_bus()`. Devices without a PCI Express
+            link are ignored.
+        :param configs:
+            Configuration spaces of the devices, in the same order, for
+            callers that already read them (as returned by
+            :func:`read_configs()`). By default they are read here.
+        """
+        devices = list(devices)
+        if configs is None:
+            configs = read_configs(devices)
+        links = []
+        positions = array('i')
+        status = array('H')
+        for device, config in zip(devices, configs):
+            if config is None:
+                continue
+            decoded = _decode(config)
+            if decoded is None:
+                continue
+            pos, max_speed, max_width = decoded
+            lnksta = _word(config, pos)
+            links.append(LinkState(device, max_speed, max_width,
+                                   *_lnksta_fields(lnksta)))
+            positions.append(pos)
+            status.append(lnksta)
+        self.links = links
+        self._positions = positions
+        self._status = status
+        self._owners = tuple({
+            id(link.device._pci): link.device._pci for link in links
+        }.values())
+        _logger.debug("Monitoring %d links", len(links))
+
+    def degraded(self):
+        """Get the list of links that are up but degraded."""
+        return [link for link in self.links if link.degraded]
+
+    def poll(self):
+        """
+        Re-read the link status of all devices.
+
+        :returns:
+            List of :class:`LinkState` that changed since the previous poll
+            (usually empty).
+        """
+        for pci in self._owners:
+            if pci.closed:
+                raise ValueError("attempt to use closed LibPCI object")
+        read = pci_read_word
+        links = self.links
+        positions = self._positions
+        status = self._status
+        changed = []
+        for index in range(len(links)):
+            # Devices are not captured as pointers since rescan() rebinds
+            # them; removed devices keep their last state.
+            dev = links[index].device._dev
+            if dev is None:
+                continue
+            lnksta = read(dev, positions[index])
+            if lnksta != status[index]:
+                status[index] = lnksta
+                speed, width = _lnksta_fields(lnksta)
+                link = links[index] = links[index]._replace(
+                    speed=speed, width=width)
+                changed.append(link)
+        return changed
+
+    def watch(self, callback, interval=1.0, count=None):
+        """
+        Poll periodically.
+
+        :param callback:
+            Callable invoked with each :class:`LinkState` that changed
+        :param interval:
+            Time between polls, in seconds
+        :param count:
+            Number of polls, by default watch forever
+        """
+        deadline = time.monotonic()
+        polled = 0
+        while count is None or polled < count:
+            deadline += interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            for link in self.poll():
+                callback(link)
+            polled += 1
@@ -0,0 +1,425 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Resident name lookup service over a UNIX domain socket.
+
+:class:`LookupServer` (``pci-lookup serve``) keeps a :class:`libpci.LibPCI`
+object with the ID database loaded and answers lookups from many clients,
+so short-lived tools pay for a socket round trip instead of loading
+libpci and the database. :class:`LookupClient` has the same lookup methods
+as :class:`libpci.LibPCI`, and :func:`connect()` falls back to an
+in-process :class:`libpci.LibPCI` when the server is not running.
+
+Protocol: every message is a 4-byte big-endian length followed by that
+many bytes. A request holds one, two or four hexadecimal identifiers
+separated by spaces and asks for the vendor, device or subsystem device
+name respectively. A response starts with ``+`` followed by the UTF-8
+name, or with ``-`` followed by an error message. Clients may send several
+requests before reading responses (pipelining); responses come back in the
+order of requests. The server stops reading from a client while responses
+are waiting to be read, so clients must read responses before requests in
+flight fill the socket buffers.
+"""
+
+import errno
+import logging
+import os
+import selectors
+import socket
+import stat
+import struct
+import threading
+
+from libpci.batch import Resolver
+from libpci.batch import parse_ids
+
+__all__ = ('LookupClient', 'LookupServer', 'connect', 'default_path')
+
+
+_logger = logging.getLogger("libpci.lookupd")
+
+_length = struct.Struct('>I')
+
+# Largest message accepted, anything longer is a protocol error
+MAX_MESSAGE = 4096
+
+_BUFFER_SIZE = 64 * 1024
+
+# Requests sent by the client before reading their responses, small enough
+# for the requests to fit in the socket buffers
+_WINDOW = 256
+
+
+def _private_dir(path):
+    # Creates a directory only the current user can use, or checks that
+    # the existing one is such a directory, so that no other user can
+    # put a socket of their own in it.
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid()
+            or info.st_mode & 0o077):
+        raise OSError(errno.EPERM, "not a private directory", path)
+    return path
+
+
+def default_path():
+    """
+    Get the path of the socket used when none is given.
+
+    :returns:
+        The value of the ``PCI_LOOKUP_SOCKET`` environment variable, or
+        ``pci-lookup.sock`` in ``$XDG_RUNTIME_DIR``, or in a per-user
+        directory in ``/tmp`` which is created with mode 0700
+    :raises OSError:
+        If the directory in ``/tmp`` exists but belongs to another user or
+        can be used by other users
+    """
+    path = os.getenv('PCI_LOOKUP_SOCKET')
+    if path:
+        return path
+    runtime_dir = os.getenv('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'pci-lookup.sock')
+    return os.path.join(
+        _private_dir('/tmp/pci-lookup-{}'.format(os.getuid())),
+        'pci-lookup.sock')
+
+
+def _frame(payload):
+    return _length.pack(len(payload)) + payload
+
+
+class _Connection(object):
+
+    __slots__ = ('sock', 'inbox', 'outbox')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbox = bytearray()
+        self.outbox = bytearray()
+
+
+class LookupServer(object):
+
+    """
+    Server answering lookups on a UNIX domain socket.
+
+    All clients are served by a single thread. Requests that arrive
+    together are answered together with a single write.
+    """
+
+    def __init__(self, pci, path=None):
+        """
+        Initialize the server and start listening.
+
+        :param pci:
+            The :class:`libpci.LibPCI` object to look names up with. Its ID
+            database is loaded right away.
+        :param path:
+            Path of the socket, :func:`default_path()` by default. A stale
+            socket left by a server that is gone is replaced.
+        :raises OSError:
+            If the socket cannot be created, for example when another server
+            is already listening on it
+        """
+        self.path = path or default_path()
+        pci.load_ids()
+        self._resolver = Resolver(pci)
+        self._selector = selectors.DefaultSelector()
+        self._stop = False
+        self._idle = threading.Event()
+        self._idle.set()
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._bind()
+            self._listener.listen(128)
+            self._listener.setblocking(False)
+        except OSError:
+            self._listener.close()
+            raise
+        self._selector.register(self._listener, selectors.EVENT_READ)
+
+    def _bind(self):
+        try:
+            self._listener.bind(self.path)
+        except OSError as exc:
+            if exc.errno != errno.EADDRINUSE:
+                raise
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                _logger.info("Removing stale socket %s", self.path)
+                os.unlink(self.path)
+                self._listener.bind(self.path)
+            else:
+                raise OSError(errno.EADDRINUSE,
+                              "server already running", self.path)
+            finally:
+                probe.close()
+
+    def serve_forever(self, poll_interval=0.5):
+        """
+        Serve clients until :meth:`close()` is called.
+
+        :param poll_interval:
+            Maximum time, in seconds, before noticing a call to
+            :meth:`close()` from another thread
+        """
+        _logger.info("Serving lookups on %s", self.path)
+        self._idle.clear()
+        try:
+            while not self._stop:
+                for key, events in self._selector.select(poll_interval):
+                    if key.data is None:
+                        self._accept()
+                    elif events & selectors.EVENT_READ:
+                        self._read(key.data)
+                    else:
+                        self._write(key.data)
+        finally:
+            self._idle.set()
+
+    def _accept(self):
+        try:
+            sock, address = self._listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        sock.setblocking(False)
+        self._selector.register(
+            sock, selectors.EVENT_READ, _Connection(sock))
+
+    def _drop(self, conn):
+        self._selector.unregister(conn.sock)
+        conn.sock.close()
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(_BUFFER_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(conn)
+            return
+        inbox = conn.inbox
+        inbox += data
+        offset = 0
+        while len(inbox) - offset >= _length.size:
+            size = _length.unpack_from(inbox, offset)[0]
+            if size > MAX_MESSAGE:
+                _logger.warning("Dropping client sending %d byte message",
+                                size)
+                self._drop(conn)
+                return
+            end = offset + _length.size + size
+            if len(inbox) < end:
+                break
+            request = bytes(inbox[offset + _length.size:end])
+            conn.outbox += _frame(self._answer(request))
+            offset = end
+        del inbox[:offset]
+        self._write(conn)
+
+    def _answer(self, request):
+        try:
+            ids = parse_ids(request.decode('ascii'))
+            if ids is None:
+                raise ValueError("empty request")
+            resolver = self._resolver
+            if len(ids) == 1:
+                name = resolver.vendor_name(*ids)
+            elif len(ids) == 2:
+                name = resolver.device_name(*ids)
+            else:
+                name = resolver.subsystem_name(*ids)
+            return b'+' + name.encode('utf-8')
+        except (ValueError, UnicodeDecodeError) as exc:
+            return b'-' + str(exc).encode('utf-8')
+
+    def _write(self, conn):
+        if conn.outbox:
+            try:
+                sent = conn.sock.send(conn.outbox)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError:
+                self._drop(conn)
+                return
+            del conn.outbox[:sent]
+        # Only wait for the socket to become writable while there is a
+        # backlog, and stop reading from clients that do not read answers.
+        events = (selectors.EVENT_WRITE if conn.outbox
+                  else selectors.EVENT_READ)
+        if self._selector.get_key(conn.sock).events != events:
+            self._selector.modify(conn.sock, events, conn)
+
+    def close(self):
+        """Stop serving, disconnect all clients and remove the socket."""
+        self._stop = True
+        # Wait for serve_forever() running on another thread to notice.
+        self._idle.wait()
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        self._selector.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        """Enter a context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Exit a context manager, closing the server."""
+        self.close()
+
+
+class LookupClient(object):
+
+    """
+    Client of a :class:`LookupServer`.
+
+    The lookup methods mirror those of :class:`libpci.LibPCI`.
+    """
+
+    def __init__(self, path=None, timeout=5.0):
+        """
+        Connect to a server.
+
+        :param path:
+            Path of the socket, :func:`default_path()` by default
+        :param timeout:
+            Timeout of socket operations, in seconds
+        :raises OSError:
+            If the server cannot be reached
+        """
+        self.path = path or default_path()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        try:
+            self._sock.connect(self.path)
+        except OSError:
+            self._sock.close()
+            raise
+        self._stream = self._sock.makefile('rb')
+
+    def close(self):
+        """Disconnect from the server."""
+        self._stream.close()
+        self._sock.close()
+
+    def __enter__(self):
+        """Enter a context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Exit a context manager, closing the connection."""
+        self.close()
+
+    def _receive(self):
+        header = self._stream.read(_length.size)
+        if len(header) < _length.size:
+            raise ConnectionError("lookup server closed the connection")
+        size = _length.unpack(header)[0]
+        payload = self._stream.read(size)
+        if len(payload) < size or not payload:
+            raise ConnectionError("lookup server closed the connection")
+        if payload[:1] != b'+':
+            raise ValueError(payload[1:].decode('utf-8', 'replace'))
+        return payload[1:].decode('utf-8')
+
+    def lookup_many(self, requests):
+        """
+        Look up many names with few round trips.
+
+        :param requests:
+            Iterable of tuples of one, two or four identifiers
+        :returns:
+            A list of names, in the order of requests
+        :raises ValueError:
+            If the server rejects a request
+
+        Requests are sent in windows of a few hundred, reading the answers
+        to each window before sending the next one.
+        """
+        frames = [
+            _frame(' '.join('{:x}'.format(value) for value in ids).encode(
+                'ascii'))
+            for ids in requests]
+        # Read all the answers even if one of them is an error, so that the
+        # connection stays usable.
+        names = []
+        error = None
+        for start in range(0, len(frames), _WINDOW):
+            window = frames[start:start + _WINDOW]
+            self._sock.sendall(b''.join(window))
+            for frame in window:
+                try:
+                    names.append(self._receive())
+                except ValueError as exc:
+                    error = error or exc
+                    names.append(None)
+        if error is not None:
+            raise error
+        return names
+
+    def lookup_vendor_name(self, vendor_id):
+        """Look up the name of a vendor."""
+        return self.lookup_many([(vendor_id,)])[0]
+
+    def lookup_device_name(self, vendor_id, device_id):
+        """Look up the name of a device."""
+        return self.lookup_many([(vendor_id, device_id)])[0]
+
+    def lookup_subsystem_device_name(
+            self, vendor_id, device_id, subvendor_id, subdevice_id):
+        """Look up the name of a subsystem device."""
+        return self.lookup_many(
+            [(vendor_id, device_id, subvendor_id, subdevice_id)])[0]
+
+
+def connect(path=None, fallback=None):
+    """
+    Connect to the lookup server, or fall back to looking up in-process.
+
+    :param path:
+        Path of the socket, :func:`default_path()` by default
+    :param fallback:
+        Callable returning the object to use when the server cannot be
+        reached, by default :class:`libpci.LibPCI`
+    :returns:
+        A :class:`LookupClient` or the result of ``fallback()``. Both
+        provide ``lookup_vendor_name()``, ``lookup_device_name()`` and
+        ``lookup_subsystem_device_name()``.
+    """
+    try:
+        return LookupClient(path)
+    except OSError as exc:
+        _logger.debug("Cannot reach lookup server: %s", exc)
+    if fallback is None:
+        from libpci.wrapper import LibPCI as fallback
+    return fallback()
@@ -0,0 +1,276 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Kernel modules of devices, found through ``modules.alias``.
+
+``depmod`` writes a glob pattern to ``modules.alias`` for each entry of
+the PCI device tables of each module::
+
+    alias pci:v00008086d00001572sv*sd*bc*sc*i* i40e
+    alias pci:v*d*sv*sd*bc01sc08i02* nvme
+
+A module can drive a device when the modalias of the device (see
+:attr:`libpci.Device.module_alias`) matches one of its patterns. There are
+thousands of patterns, so :class:`ModuleAliases` splits each one into the
+fields of a PCI modalias when the file is read: patterns are grouped by
+vendor and device when those are literal, and wildcards in the other
+fields are compiled once. A device is then only checked against the
+patterns naming its vendor and device and the few naming neither::
+
+    aliases = ModuleAliases()
+    for device, modules in zip(devices, aliases.resolve(devices)):
+        ...
+"""
+
+import fnmatch
+import logging
+import os
+import re
+
+from libpci._macros import PCI_CLASS_DEVICE
+from libpci._macros import PCI_CLASS_PROG
+from libpci._macros import PCI_DEVICE_ID
+from libpci._macros import PCI_HEADER_TYPE
+from libpci._macros import PCI_HEADER_TYPE_NORMAL
+from libpci._macros import PCI_SUBSYSTEM_ID
+from libpci._macros import PCI_SUBSYSTEM_VENDOR_ID
+from libpci._macros import PCI_VENDOR_ID
+
+__all__ = ('ModuleAliases', 'default_path', 'modalias',
+           'modalias_from_config')
+
+
+_logger = logging.getLogger("libpci.modalias")
+
+# Fields of a PCI modalias: vendor, device, subsystem vendor, subsystem
+# device, base class, sub-class and programming interface. Hex digits are
+# upper case, so the field names cannot be confused with values.
+_FIELDS = re.compile(
+    r'pci:v([^a-z]*)d([^a-z]*)sv([^a-z]*)sd([^a-z]*)bc([^a-z]*)sc([^a-z]*)'
+    r'i([^a-z]*)$')
+
+_VENDOR = 0
+_DEVICE = 1
+
+
+def default_path():
+    """
+    Get the path of ``modules.alias`` of the running kernel.
+
+    :returns:
+        ``/lib/modules/<release>/modules.alias``
+    """
+    return os.path.join('/lib/modules', os.uname().release, 'modules.alias')
+
+
+def modalias_from_config(config):
+    """
+    Compute the modalias of a device from its configuration space.
+
+    :param config:
+        The first 64 bytes (or more) of the configuration space
+    :returns:
+        The modalias, as the kernel formats it, for example
+        ``pci:v00008086d00001572sv00008086sd00000000bc02sc00i00``
+    """
+    def word(pos):
+        return config[pos] | config[pos + 1] << 8
+    subvendor_id = subdevice_id = 0
+    if config[PCI_HEADER_TYPE.value] & 0x7f == PCI_HEADER_TYPE_NORMAL.value:
+        subvendor_id = word(PCI_SUBSYSTEM_VENDOR_ID.value)
+        subdevice_id = word(PCI_SUBSYSTEM_ID.value)
+    return 'pci:v{:08X}d{:08X}sv{:08X}sd{:08X}bc{:02X}sc{:02X}i{:02X}'.format(
+        word(PCI_VENDOR_ID.value), word(PCI_DEVICE_ID.value), subvendor_id,
+        subdevice_id, config[PCI_CLASS_DEVICE.value + 1],
+        config[PCI_CLASS_DEVICE.value], config[PCI_CLASS_PROG.value])
+
+
+def modalias(device):
+    """
+    Get the modalias of a device.
+
+    :param device:
+        A modalias string, or an object with a ``module_alias`` (such as
+        :class:`libpci.Device` and :class:`libpci.PciDevice`) or a
+        ``modalias`` attribute (such as :class:`libpci.events.UEvent`)
+    :returns:
+        The modalias or None if it is not known. The modalias of a
+        :class:`libpci.Device` whose access method does not provide one is
+        computed from its configuration space.
+    """
+    if isinstance(device, str):
+        return device
+    alias = getattr(device, 'module_alias', None)
+    if alias is None:
+        alias = getattr(device, 'modalias', None)
+    if alias is None and hasattr(device, 'read_config'):
+        config = device.read_config()
+        if config is not None:
+            alias = modalias_from_config(config)
+    return alias
+
+
+def _literal(value):
+    return not any(char in value for char in '*?[')
+
+
+def _compile(value):
+    # Returns a predicate matching a field, or None if it matches anything
+    if value == '*':
+        return None
+    if _literal(value):
+        return value.__eq__
+    return re.compile(fnmatch.translate(value)).match
+
+
+class ModuleAliases(object):
+
+    """
+    PCI patterns of ``modules.alias``, indexed for matching many devices.
+
+    Modules are returned in the order of their first matching pattern in
+    the file, which is the order ``modprobe`` tries them in.
+    """
+
+    def __init__(self, path=None):
+        """
+        Read ``modules.alias``.
+
+        :param path:
+            Path of the file, :func:`default_path()` by default
+        :raises OSError:
+            If the file cannot be read
+        """
+        self.path = path or default_path()
+        # (vendor, device) -> patterns
+        self._exact = {}
+        # vendor -> patterns with any device
+        self._vendor = {}
+        # Patterns with any vendor, or with wildcards in vendor or device
+        self._other = []
+        # Patterns that do not have the fields of a PCI modalias
+        self._generic = []
+        # modalias -> modules
+        self._cache = {}
+        self._count = 0
+        with open(self.path, 'rt', encoding='utf-8',
+                  errors='replace') as stream:
+            for line in stream:
+                parts = line.split()
+                if (len(parts) == 3 and parts[0] == 'alias'
+                        and parts[1].startswith('pci:')):
+                    self.add(parts[1], parts[2])
+        _logger.debug("Read %d PCI patterns from %s", self._count, self.path)
+
+    def __repr__(self):
+        """Get a debugging representation of the aliases."""
+        return '<{} {} patterns>'.format(self.__class__.__name__, self._count)
+
+    def __len__(self):
+        """Get the number of patterns."""
+        return self._count
+
+    def add(self, pattern, module):
+        """
+        Add a pattern.
+
+        :param pattern:
+            Glob pattern, like those of ``modules.alias``
+        :param module:
+            Name of the module
+        """
+        order = self._count
+        self._count += 1
+        self._cache.clear()
+        match = _FIELDS.match(pattern)
+        if match is None:
+            self._generic.append((order, module, _compile(pattern)))
+            return
+        fields = match.groups()
+        vendor, device = fields[_VENDOR], fields[_DEVICE]
+        literal_vendor = _literal(vendor)
+        literal_device = _literal(device)
+        if literal_vendor and literal_device:
+            first, bucket = 2, self._exact.setdefault((vendor, device), [])
+        elif literal_vendor and device == '*':
+            first, bucket = 2, self._vendor.setdefault(vendor, [])
+        else:
+            first, bucket = 0, self._other
+        checks = tuple(
+            (index, test) for index, test in (
+                (index, _compile(value))
+                for index, value in enumerate(fields) if index >= first)
+            if test is not None)
+        bucket.append((order, module, checks))
+
+    def modules(self, alias):
+        """
+        Find the modules that can drive a device.
+
+        :param alias:
+            Modalias of the device
+        :returns:
+            A tuple of module names, possibly empty
+        """
+        modules = self._cache.get(alias)
+        if modules is None:
+            modules = self._cache[alias] = self._match(alias)
+        return modules
+
+    def _match(self, alias):
+        matched = []
+        match = _FIELDS.match(alias)
+        if match is not None:
+            fields = match.groups()
+            vendor = fields[_VENDOR]
+            for bucket in (self._exact.get((vendor, fields[_DEVICE]), ()),
+                           self._vendor.get(vendor, ()), self._other):
+                for order, module, checks in bucket:
+                    for index, test in checks:
+                        if not test(fields[index]):
+                            break
+                    else:
+                        matched.append((order, module))
+        for order, module, test in self._generic:
+            if test is None or test(alias):
+                matched.append((order, module))
+        matched.sort()
+        modules = []
+        for order, module in matched:
+            if module not in modules:
+                modules.append(module)
+        return tuple(modules)
+
+    def resolve(self, devices):
+        """
+        Find the modules of many devices.
+
+        :param devices:
+            Iterable of devices, records or modalias strings, as taken by
+            :func:`modalias()`
+        :returns:
+            A list with a tuple of module names for each device, in order.
+            Devices with the same modalias (such as virtual functions of
+            the same kind) are only matched once.
+        """
+        modules = self.modules
+        return [modules(alias) if alias else ()
+                for alias in map(modalias, devices)]
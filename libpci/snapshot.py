@@ -0,0 +1,383 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compact binary snapshots of the PCI state of a whole machine.
+
+A snapshot file is laid out as follows (all integers are little-endian):
+
+``header``
+    16 bytes: magic ``PCISNAP\\0``, format version (u16), flags (u16),
+    four bytes of padding.
+``configuration blobs``
+    Configuration space of each device, concatenated, in the order the
+    devices were added.
+``device table``
+    One 32 byte entry per device: domain (u16), bus (u8), devfn (u8),
+    vendor (u16), device (u16), class (u16), revision (u8), header type
+    (u8), offset of the configuration blob (u64), size of the blob (u32),
+    string table references for the module alias and physical slot (u32
+    each, ``0xffffffff`` meaning absent).
+``string table``
+    Zero-terminated UTF-8 strings, each distinct string stored once.
+``footer``
+    40 bytes: offset of the device table (u64), number of devices (u64),
+    offset and size of the string table (u64 each), magic.
+
+Since all the offsets live in the footer, the writer never seeks and can
+write to pipes and sockets. The reader maps the file into memory and hands
+out zero-copy views of the configuration blobs.
+"""
+
+from collections import namedtuple
+import mmap
+import struct
+
+from libpci._macros import PCI_CLASS_DEVICE
+from libpci._macros import PCI_DEVICE_ID
+from libpci._macros import PCI_HEADER_TYPE
+from libpci._macros import PCI_REVISION_ID
+from libpci._macros import PCI_VENDOR_ID
+from libpci.capabilities import PCI_CONFIG_SPACE_SIZE
+from libpci.dump import format_dump
+from libpci.dump import parse_dump
+
+__all__ = (
+    'SNAPSHOT_VERSION',
+    'SnapshotEntry',
+    'SnapshotReader',
+    'SnapshotWriter',
+    'dump_to_snapshot',
+    'snapshot_to_dump',
+    'write_snapshot',
+)
+
+
+#: Version of the snapshot format written by :class:`SnapshotWriter`
+SNAPSHOT_VERSION = 1
+
+_MAGIC = b'PCISNAP\0'
+_NO_STRING = 0xffffffff
+_header = struct.Struct('<8sHH4x')
+_entry = struct.Struct('<HBBHHHBBQIII')
+_footer = struct.Struct('<QQQQ8s')
+_word = struct.Struct('<H')
+
+
+class SnapshotEntry(namedtuple("SnapshotEntry", (
+        "domain bus dev func vendor_id device_id device_class revision"
+        " header_type config module_alias phy_slot"))):
+
+    """
+    A single device stored in a snapshot.
+
+    :attr config:
+        The configuration space of the device. When read back by
+        :class:`SnapshotReader` this is a read-only ``memoryview`` into the
+        mapped file.
+    """
+
+    __slots__ = ()
+
+    @property
+    def slot(self):
+        """Address of the device in the ``DDDD:BB:dd.f`` notation."""
+        return '{:04x}:{:02x}:{:02x}.{:x}'.format(
+            self.domain, self.bus, self.dev, self.func)
+
+
+class SnapshotWriter(object):
+
+    """
+    Streaming writer of snapshots.
+
+    Configuration blobs are written out as soon as devices are added, only
+    the (small) device table and string table are kept in memory until the
+    writer is closed.
+    """
+
+    def __init__(self, stream):
+        """
+        Initialize a writer.
+
+        :param stream:
+            Binary stream to write to. It does not have to be seekable.
+        """
+        self._stream = stream
+        self._table = bytearray()
+        self._count = 0
+        self._strings = {}
+        self._string_data = bytearray()
+        self._pos = 0
+        self._write(_header.pack(_MAGIC, SNAPSHOT_VERSION, 0))
+
+    def __enter__(self):
+        """Enter a context manager."""
+        return self
+
+    def __exit__(self, exc_type, *args):
+        """
+        Exit a context manager, finishing the snapshot.
+
+        If the block raised an exception the footer is not written, so the
+        partial snapshot is rejected by :class:`SnapshotReader` instead of
+        passing for a complete one.
+        """
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def abort(self):
+        """Stop writing without finishing the snapshot."""
+        if self._stream is not None:
+            self._stream.flush()
+            self._stream = None
+
+    def _write(self, data):
+        self._stream.write(data)
+        self._pos += len(data)
+
+    def _intern(self, text):
+        if text is None:
+            return _NO_STRING
+        ref = self._strings.get(text)
+        if ref is None:
+            ref = self._strings[text] = len(self._string_data)
+            self._string_data += text.encode("utf-8") + b'\0'
+        return ref
+
+    def add(self, domain, bus, dev, func, config,
+            module_alias=None, phy_slot=None):
+        """
+        Add a device to the snapshot.
+
+        :param domain, bus, dev, func:
+            Address of the device
+        :param config:
+            Configuration space of the device (bytes-like). The identifiers
+            stored in the device table are decoded from it.
+        :param module_alias:
+            Optional kernel module alias of the device
+        :param phy_slot:
+            Optional name of the physical slot of the device
+        """
+        if self._stream is None:
+            raise ValueError("attempt to use closed SnapshotWriter object")
+        config = bytes(config)
+        if len(config) >= PCI_HEADER_TYPE.value + 1:
+            vendor_id, = _word.unpack_from(config, PCI_VENDOR_ID.value)
+            device_id, = _word.unpack_from(config, PCI_DEVICE_ID.value)
+            device_class, = _word.unpack_from(config, PCI_CLASS_DEVICE.value)
+            revision = config[PCI_REVISION_ID.value]
+            header_type = config[PCI_HEADER_TYPE.value]
+        else:
+            vendor_id = device_id = 0xffff
+            device_class = revision = header_type = 0
+        self._table += _entry.pack(
+            domain, bus, (dev << 3) | func, vendor_id, device_id,
+            device_class, revision, header_type, self._pos, len(config),
+            self._intern(module_alias), self._intern(phy_slot))
+        self._count += 1
+        self._write(config)
+
+    def add_device(self, device, size=PCI_CONFIG_SPACE_SIZE):
+        """
+        Add a :class:`libpci.Device` to the snapshot.
+
+        :param device:
+            The device to add
+        :param size:
+            Number of bytes of configuration space to store. If that much
+            cannot be read (typically without sufficient privileges) only
+            the standard 64 byte header is stored.
+        """
+        config = device.read_config(size) or device.read_config(64) or b''
+        self.add(device.domain, device.bus, device.dev, device.func, config,
+                 device.module_alias, device.phy_slot)
+
+    def close(self):
+        """Write the device table, string table and footer."""
+        if self._stream is None:
+            return
+        table_offset = self._pos
+        self._write(self._table)
+        strings_offset = self._pos
+        self._write(self._string_data)
+        self._write(_footer.pack(
+            table_offset, self._count, strings_offset,
+            len(self._string_data), _MAGIC))
+        self._stream.flush()
+        self._stream = None
+
+
+class SnapshotReader(object):
+
+    """
+    Reader of snapshots based on a memory mapping of the file.
+
+    Entries are decoded on access. Their ``config`` attribute is a
+    ``memoryview`` of the mapped file so nothing is copied until the caller
+    asks for it. All such views must be released before the reader can be
+    closed.
+    """
+
+    def __init__(self, path):
+        """
+        Open a snapshot file.
+
+        :param path:
+            Path of the snapshot
+        :raises ValueError:
+            If the file is not a snapshot or has an unsupported version.
+        """
+        with open(path, 'rb') as stream:
+            self._mmap = mmap.mmap(
+                stream.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        try:
+            self._parse()
+        except Exception:
+            self.close()
+            raise
+
+    def _parse(self):
+        view = self._view
+        if len(view) < _header.size + _footer.size:
+            raise ValueError("truncated snapshot")
+        magic, version, flags = _header.unpack_from(view, 0)
+        if magic != _MAGIC:
+            raise ValueError("not a snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(
+                "unsupported snapshot version {}".format(version))
+        (self._table_offset, self._count, strings_offset, strings_size,
+         magic) = _footer.unpack_from(view, len(view) - _footer.size)
+        if magic != _MAGIC:
+            raise ValueError("truncated snapshot")
+        self._strings_offset = strings_offset
+        self._strings_end = strings_offset + strings_size
+
+    def __enter__(self):
+        """Enter a context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Exit a context manager, closing the reader."""
+        self.close()
+
+    def __len__(self):
+        """Get the number of devices in the snapshot."""
+        return self._count
+
+    def __getitem__(self, index):
+        """Get a :class:`SnapshotEntry` by position."""
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        (domain, bus, devfn, vendor_id, device_id, device_class, revision,
+         header_type, offset, size, alias_ref, slot_ref) = _entry.unpack_from(
+            self._view, self._table_offset + index * _entry.size)
+        return SnapshotEntry(
+            domain, bus, devfn >> 3, devfn & 7, vendor_id, device_id,
+            device_class, revision, header_type,
+            self._view[offset:offset + size],
+            self._string(alias_ref), self._string(slot_ref))
+
+    def __iter__(self):
+        """Iterate over all the entries."""
+        for index in range(self._count):
+            yield self[index]
+
+    def _string(self, ref):
+        if ref == _NO_STRING:
+            return None
+        start = self._strings_offset + ref
+        end = self._mmap.find(b'\0', start, self._strings_end)
+        return bytes(self._view[start:end]).decode("utf-8")
+
+    def close(self):
+        """
+        Unmap the snapshot.
+
+        :raises BufferError:
+            If views of configuration blobs are still referenced.
+        """
+        if self._mmap is None:
+            return
+        self._view.release()
+        self._mmap.close()
+        self._mmap = None
+
+
+def write_snapshot(stream, devices, size=PCI_CONFIG_SPACE_SIZE):
+    """
+    Write a snapshot of a sequence of devices.
+
+    :param stream:
+        Binary stream to write the snapshot to
+    :param devices:
+        An iterable of :class:`libpci.Device`, typically the result of
+        :meth:`libpci.LibPCI.scan_bus()`. Devices are read and written out
+        one at a time.
+    :param size:
+        Number of bytes of configuration space to store for each device
+    :returns:
+        Number of devices written
+    """
+    count = 0
+    with SnapshotWriter(stream) as writer:
+        for device in devices:
+            writer.add_device(device, size)
+            count += 1
+    return count
+
+
+def dump_to_snapshot(lines, stream):
+    """
+    Convert a text dump (see :mod:`libpci.dump`) to a snapshot.
+
+    :param lines:
+        An iterable of lines of the text dump
+    :param stream:
+        Binary stream to write the snapshot to
+    :returns:
+        Number of devices converted
+    """
+    count = 0
+    with SnapshotWriter(stream) as writer:
+        for record in parse_dump(lines):
+            writer.add(record.domain, record.bus, record.dev, record.func,
+                       record.config)
+            count += 1
+    return count
+
+
+def snapshot_to_dump(reader, stream):
+    """
+    Convert a snapshot to a text dump (see :mod:`libpci.dump`).
+
+    :param reader:
+        A :class:`SnapshotReader`
+    :param stream:
+        Text stream to write the dump to
+    """
+    format_dump(reader, stream)
@@ -0,0 +1,195 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+SR-IOV virtual functions computed from the capability of their parent.
+
+The address of every virtual function follows from three registers of the
+SR-IOV capability of the physical function: the number of enabled virtual
+functions, the routing ID offset of the first one and the stride between
+them. :meth:`libpci.Device.virtual_functions()` uses that to list virtual
+functions without scanning any bus, which matters on hosts with hundreds
+of them per physical function.
+"""
+
+from collections import namedtuple
+from collections.abc import Sequence
+import ctypes
+
+from libpci._functions import pci_free_dev
+from libpci._functions import pci_get_dev
+from libpci._functions import pci_read_block
+from libpci._macros import PCI_EXT_CAP_ID_SRIOV
+from libpci._macros import PCI_IOV_CTRL
+from libpci._macros import PCI_IOV_CTRL_VFE
+from libpci._macros import PCI_IOV_DID
+from libpci._macros import PCI_IOV_NUMVF
+from libpci._macros import PCI_IOV_OFFSET
+from libpci._macros import PCI_IOV_STRIDE
+from libpci._macros import PCI_IOV_TOTALVF
+from libpci.capabilities import PCI_CONFIG_SPACE_SIZE
+
+__all__ = ('SriovState', 'VirtualFunction', 'VirtualFunctions',
+           'read_sriov')
+
+
+class SriovState(namedtuple("SriovState", (
+        "enabled total_vfs num_vfs offset stride vf_device_id"))):
+
+    """
+    Registers of the SR-IOV capability of a physical function.
+
+    :attr enabled:
+        True if the VF Enable bit is set
+    :attr total_vfs:
+        Number of virtual functions the device supports
+    :attr num_vfs:
+        Number of virtual functions configured
+    :attr offset:
+        Routing ID offset of the first virtual function
+    :attr stride:
+        Routing ID distance between consecutive virtual functions
+    :attr vf_device_id:
+        PCI device identifier of the virtual functions
+    """
+
+    __slots__ = ()
+
+
+def read_sriov(ext_capabilities):
+    """
+    Read the SR-IOV capability of a device.
+
+    :param ext_capabilities:
+        :class:`~libpci.capabilities.ExtCapabilityIndex` of the device
+    :returns:
+        :class:`SriovState` or None if the device has no SR-IOV capability
+    """
+    if PCI_EXT_CAP_ID_SRIOV not in ext_capabilities:
+        return None
+
+    def read(reg):
+        return ext_capabilities.read_word(PCI_EXT_CAP_ID_SRIOV, reg)
+    return SriovState(
+        bool(read(PCI_IOV_CTRL) & PCI_IOV_CTRL_VFE.value),
+        read(PCI_IOV_TOTALVF), read(PCI_IOV_NUMVF), read(PCI_IOV_OFFSET),
+        read(PCI_IOV_STRIDE), read(PCI_IOV_DID))
+
+
+class VirtualFunction(namedtuple("VirtualFunction", (
+        "physfn index domain bus dev func vendor_id device_id"))):
+
+    """
+    A single SR-IOV virtual function.
+
+    :attr physfn:
+        The :class:`libpci.Device` of the physical function
+    :attr index:
+        Zero-based number of the virtual function
+    """
+
+    __slots__ = ()
+
+    @property
+    def slot(self):
+        """Address of the device in the ``DDDD:BB:dd.f`` notation."""
+        return '{:04x}:{:02x}:{:02x}.{:x}'.format(
+            self.domain, self.bus, self.dev, self.func)
+
+    def read_config(self, size=PCI_CONFIG_SPACE_SIZE, pos=0):
+        """
+        Read a block of the configuration space.
+
+        This mirrors :meth:`libpci.Device.read_config()`. The virtual
+        function is looked up by address with the :class:`libpci.LibPCI`
+        object of the physical function, the bus is not scanned.
+
+        :returns:
+            The configuration space block, as bytes, or None if it could not
+            be read
+        """
+        self.physfn._check()
+        dev = pci_get_dev(self.physfn._pci._access, self.domain, self.bus,
+                          self.dev, self.func)
+        try:
+            buf = (ctypes.c_uint8 * size)()
+            if pci_read_block(dev, pos, buf, size):
+                return bytes(buf)
+        finally:
+            pci_free_dev(dev)
+
+
+class VirtualFunctions(Sequence):
+
+    """
+    Sequence of the virtual functions of a physical function.
+
+    Items are computed on access; nothing is read from the virtual
+    functions themselves.
+    """
+
+    def __init__(self, physfn, state):
+        """
+        Initialize the sequence.
+
+        :param physfn:
+            The :class:`libpci.Device` of the physical function
+        :param state:
+            :class:`SriovState` of the physical function, or None
+        """
+        self.physfn = physfn
+        self.state = state
+        count = 0
+        if state is not None and state.enabled and state.num_vfs:
+            first = ((physfn.bus << 8) | (physfn.dev << 3) | physfn.func
+                     ) + state.offset
+            count = state.num_vfs
+            if state.stride:
+                # Routing IDs past the last bus do not exist.
+                count = min(count, (0xffff - first) // state.stride + 1)
+            elif count > 1:
+                count = 1
+            if first > 0xffff:
+                count = 0
+            self._first = first
+        self._count = count
+
+    def __repr__(self):
+        """Get a debugging representation of the sequence."""
+        return '<{} of {} ({})>'.format(
+            self.__class__.__name__, self.physfn.slot, self._count)
+
+    def __len__(self):
+        """Get the number of virtual functions."""
+        return self._count
+
+    def __getitem__(self, index):
+        """Get a single virtual function (slices give a list)."""
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("virtual function index out of range")
+        rid = self._first + index * self.state.stride
+        return VirtualFunction(
+            self.physfn, index, self.physfn.domain, rid >> 8,
+            (rid >> 3) & 0x1f, rid & 0x7, self.physfn.vendor_id,
+            self.state.vf_device_id)
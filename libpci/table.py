@@ -0,0 +1,398 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Column-oriented table of devices for very large numbers of functions.
+
+:class:`DeviceTable` keeps the result of a bus scan in a handful of
+:class:`array.array` columns instead of one Python object per device, so
+tens of thousands of functions (think SR-IOV virtual functions) cost a few
+dozen bytes each and add nothing for the garbage collector to track.
+
+Each column supports the buffer protocol, so it can be viewed without
+copying by NumPy (``numpy.frombuffer(table.vendor_id, 'u2')``) to compute
+selections, which are then applied with :meth:`DeviceTable.compress()`.
+"""
+
+from array import array
+import itertools
+
+from libpci._functions import pci_fill_info
+from libpci._macros import PCI_FILL_BASES
+from libpci._macros import PCI_FILL_CLASS
+from libpci._macros import PCI_FILL_IDENT
+from libpci._macros import PCI_FILL_IRQ
+from libpci._macros import PCI_FILL_SIZES
+
+__all__ = ('DeviceTable', 'DeviceRow', 'pack_bdf', 'unpack_bdf')
+
+
+_FILL = (PCI_FILL_IDENT.value | PCI_FILL_CLASS.value | PCI_FILL_IRQ.value
+         | PCI_FILL_BASES.value | PCI_FILL_SIZES.value)
+
+# Number of regions (BARs) of each device
+_REGIONS = 6
+
+# Name and array type code of each column
+_COLUMNS = (
+    ('bdf', 'I'),
+    ('vendor_id', 'H'),
+    ('device_id', 'H'),
+    ('device_class', 'H'),
+    ('irq', 'i'),
+    ('base_addr', 'Q'),
+    ('size', 'Q'),
+)
+
+# Columns holding _REGIONS values per device
+_WIDE_COLUMNS = frozenset(('base_addr', 'size'))
+
+
+def pack_bdf(domain, bus, dev, func):
+    """
+    Pack the address of a device into a single integer.
+
+    :returns:
+        ``domain << 16 | bus << 8 | dev << 3 | func``, the value stored in
+        :attr:`DeviceTable.bdf`. Sorting by it sorts by address.
+    """
+    return domain << 16 | bus << 8 | dev << 3 | func
+
+
+def unpack_bdf(bdf):
+    """
+    Unpack the result of :func:`pack_bdf()`.
+
+    :returns:
+        A ``(domain, bus, dev, func)`` tuple
+    """
+    return bdf >> 16, (bdf >> 8) & 0xff, (bdf >> 3) & 0x1f, bdf & 0x7
+
+
+class DeviceRow(object):
+
+    """
+    View of a single row of a :class:`DeviceTable`.
+
+    Values are read from the columns when accessed; a row does not copy
+    anything.
+    """
+
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        """
+        Initialize a row view.
+
+        :param table:
+            The :class:`DeviceTable` to look into
+        :param index:
+            Index of the row
+        """
+        self._table = table
+        self._index = index
+
+    def __repr__(self):
+        """Get a debugging representation of the row."""
+        return '<{} {} {:04x}:{:04x}>'.format(
+            self.__class__.__name__, self.slot, self.vendor_id,
+            self.device_id)
+
+    @property
+    def domain(self):
+        """PCI domain number."""
+        return self._table.bdf[self._index] >> 16
+
+    @property
+    def bus(self):
+        """PCI bus number."""
+        return (self._table.bdf[self._index] >> 8) & 0xff
+
+    @property
+    def dev(self):
+        """PCI device number."""
+        return (self._table.bdf[self._index] >> 3) & 0x1f
+
+    @property
+    def func(self):
+        """PCI function number."""
+        return self._table.bdf[self._index] & 0x7
+
+    @property
+    def slot(self):
+        """Address of the device in the ``DDDD:BB:dd.f`` notation."""
+        return '{:04x}:{:02x}:{:02x}.{:x}'.format(
+            *unpack_bdf(self._table.bdf[self._index]))
+
+    @property
+    def vendor_id(self):
+        """PCI vendor identifier."""
+        return self._table.vendor_id[self._index]
+
+    @property
+    def device_id(self):
+        """PCI device identifier."""
+        return self._table.device_id[self._index]
+
+    @property
+    def device_class(self):
+        """PCI device class (base class and sub-class)."""
+        return self._table.device_class[self._index]
+
+    @property
+    def irq(self):
+        """Interrupt line."""
+        return self._table.irq[self._index]
+
+    @property
+    def base_addr(self):
+        """Tuple of the six base addresses."""
+        start = self._index * _REGIONS
+        return tuple(self._table.base_addr[start:start + _REGIONS])
+
+    @property
+    def size(self):
+        """Tuple of the sizes of the six regions."""
+        start = self._index * _REGIONS
+        return tuple(self._table.size[start:start + _REGIONS])
+
+
+class DeviceTable(object):
+
+    """
+    Devices stored column by column.
+
+    :attr bdf:
+        Addresses of the devices, packed with :func:`pack_bdf()` (``I``)
+    :attr vendor_id:
+    :attr device_id:
+    :attr device_class:
+        Identifiers of the devices (``H``)
+    :attr irq:
+        Interrupt lines (``i``)
+    :attr base_addr:
+    :attr size:
+        Base addresses and sizes of the regions, six consecutive values per
+        device (``Q``)
+
+    Tables are not changed once built; :meth:`compress()`, :meth:`take()`,
+    :meth:`where()` and :meth:`sort()` return new tables. Hash indexes
+    created with :meth:`create_index()` therefore never go stale.
+    """
+
+    def __init__(self):
+        """Initialize an empty table."""
+        for name, typecode in _COLUMNS:
+            setattr(self, name, array(typecode))
+        self._indexes = {}
+
+    @classmethod
+    def from_pci(cls, pci):
+        """
+        Build a table of all the devices found by libpci.
+
+        :param pci:
+            The :class:`libpci.LibPCI` object to scan with. The bus is
+            scanned if it was not scanned yet.
+        :returns:
+            A new :class:`DeviceTable`, in the order libpci found the
+            devices
+        :raises ValueError:
+            If the :class:`libpci.LibPCI` object is closed
+
+        The table is filled straight from the list of devices kept by
+        libpci, no :class:`libpci.Device` objects are created.
+        """
+        table = cls()
+        bdf = table.bdf.append
+        vendor_id = table.vendor_id.append
+        device_id = table.device_id.append
+        device_class = table.device_class.append
+        irq = table.irq.append
+        base_addr = table.base_addr.extend
+        size = table.size.extend
+        for dev in pci._scan():
+            pci_fill_info(dev, _FILL)
+            contents = dev.contents
+            bdf(contents.domain << 16 | contents.bus << 8
+                | contents.dev << 3 | contents.func)
+            vendor_id(contents.vendor_id)
+            device_id(contents.device_id)
+            device_class(contents.device_class)
+            irq(contents.irq)
+            base_addr(contents.base_addr)
+            size(contents.size)
+        return table
+
+    def __len__(self):
+        """Get the number of devices."""
+        return len(self.bdf)
+
+    def __getitem__(self, index):
+        """
+        Get a view of a single row.
+
+        :param index:
+            Index of the row, negative values count from the end
+        :returns:
+            :class:`DeviceRow`
+        """
+        count = len(self.bdf)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("device table index out of range")
+        return DeviceRow(self, index)
+
+    def __iter__(self):
+        """Iterate over views of all the rows."""
+        return (DeviceRow(self, index) for index in range(len(self.bdf)))
+
+    def index(self, domain, bus, dev, func):
+        """
+        Find the row of a device.
+
+        :returns:
+            Index of the row of the device with the given address
+        :raises ValueError:
+            If there is no such device
+        """
+        return self.bdf.index(pack_bdf(domain, bus, dev, func))
+
+    def create_index(self, name):
+        """
+        Create a hash index of a column.
+
+        :param name:
+            Name of a single-valued column or ``'bus'``, which indexes the
+            domain and bus part of the address (``bdf >> 8``)
+        :returns:
+            The index, a dictionary mapping each value to an ``array('I')``
+            of the rows holding it, in order
+        """
+        index = self._indexes.get(name)
+        if index is None:
+            if name == 'bus':
+                values = (bdf >> 8 for bdf in self.bdf)
+            else:
+                values = self._column(name)
+            index = {}
+            for row, value in enumerate(values):
+                rows = index.get(value)
+                if rows is None:
+                    rows = index[value] = array('I')
+                rows.append(row)
+            self._indexes[name] = index
+        return index
+
+    def get_index(self, name):
+        """
+        Get an index made by :meth:`create_index()`.
+
+        :returns:
+            The index or None if the column is not indexed
+        """
+        return self._indexes.get(name)
+
+    def take(self, indices):
+        """
+        Get a table of the selected rows.
+
+        :param indices:
+            Iterable of row indices, in the desired order
+        :returns:
+            A new :class:`DeviceTable`
+        """
+        indices = list(indices)
+        table = self.__class__()
+        for name, typecode in _COLUMNS:
+            source = getattr(self, name)
+            target = getattr(table, name)
+            if name in _WIDE_COLUMNS:
+                for index in indices:
+                    start = index * _REGIONS
+                    target.extend(source[start:start + _REGIONS])
+            else:
+                target.extend(source[index] for index in indices)
+        return table
+
+    def compress(self, selectors):
+        """
+        Get a table of the rows selected by a mask.
+
+        :param selectors:
+            Iterable of truth values, one per row, for example a boolean
+            NumPy array computed from the columns
+        :returns:
+            A new :class:`DeviceTable`
+        """
+        return self.take(itertools.compress(range(len(self.bdf)), selectors))
+
+    def where(self, **criteria):
+        """
+        Get a table of the rows matching all the given criteria.
+
+        :param criteria:
+            Column names mapped to a value or to a set of values, for example
+            ``where(vendor_id=0x8086, device_class={0x0200, 0x0280})``. Only
+            single-valued columns can be used.
+        :returns:
+            A new :class:`DeviceTable`
+        """
+        mask = None
+        for name, value in criteria.items():
+            column = self._column(name)
+            if isinstance(value, int):
+                selected = [item == value for item in column]
+            else:
+                value = frozenset(value)
+                selected = [item in value for item in column]
+            if mask is None:
+                mask = selected
+            else:
+                mask = [a and b for a, b in zip(mask, selected)]
+        if mask is None:
+            return self.take(range(len(self.bdf)))
+        return self.compress(mask)
+
+    def sort(self, *columns, reverse=False):
+        """
+        Get a table with the rows sorted by the given columns.
+
+        :param columns:
+            Names of single-valued columns, the first one is the primary key
+        :param reverse:
+            If True, sort in descending order
+        :returns:
+            A new :class:`DeviceTable`. The sort is stable.
+        """
+        keys = [self._column(name) for name in columns]
+        if len(keys) == 1:
+            key = keys[0].__getitem__
+        else:
+            def key(index):
+                return tuple(column[index] for column in keys)
+        return self.take(sorted(
+            range(len(self.bdf)), key=key, reverse=reverse))
+
+    def _column(self, name):
+        if name in _WIDE_COLUMNS or name not in dict(_COLUMNS):
+            raise ValueError("cannot select or sort by {!r}".format(name))
+        return getattr(self, name)
@@ -0,0 +1,586 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for libpci."""
+
+import asyncio
+import errno
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from libpci._macros import PCI_CAP_ID_EXP
+from libpci._macros import PCI_CAP_ID_MSI
+from libpci._macros import PCI_CAP_ID_PM
+from libpci._macros import PCI_EXT_CAP_ID_AER
+from libpci._macros import PCI_EXT_CAP_ID_SRIOV
+from libpci.batch import MAX_LINE
+from libpci.batch import run_batch
+from libpci.capabilities import PCI_EXT_CONFIG_SPACE_SIZE
+from libpci.capabilities import iter_capabilities
+from libpci.capabilities import iter_ext_capabilities
+from libpci.diagnostics import STARTUP_BUDGET
+from libpci.events import RESYNC
+from libpci.events import UEventMonitor
+from libpci.events import parse_uevent
+from libpci.filter import DeviceFilter
+from libpci.fixtures import write_modules_alias
+from libpci.fixtures import write_pci_ids
+from libpci.fixtures import write_sysfs
+from libpci.inventory import Inventory
+from libpci.lookupd import LookupClient
+from libpci.lookupd import LookupServer
+from libpci.lookupd import _private_dir
+from libpci.lookupd import default_path
+from libpci.modalias import ModuleAliases
+from libpci.topology import Topology
+
+
+class FakePCI(object):
+
+    """Stand-in for :class:`libpci.LibPCI` with made-up names."""
+
+    def load_ids(self):
+        return True
+
+    def lookup_vendor_name(self, vendor_id):
+        return 'Vendor {:04x}'.format(vendor_id)
+
+    def lookup_device_name(self, vendor_id, device_id):
+        return 'Device {:04x}:{:04x}'.format(vendor_id, device_id)
+
+    def lookup_subsystem_device_name(
+            self, vendor_id, device_id, subvendor_id, subdevice_id):
+        return 'Subsystem {:04x}:{:04x}'.format(subvendor_id, subdevice_id)
+
+
+class LookupServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'pci-lookup.sock')
+        self.server = LookupServer(FakePCI(), self.path)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,))
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.close()
+        self.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def test_lookups(self):
+        with LookupClient(self.path) as client:
+            self.assertEqual(client.lookup_vendor_name(0x8086),
+                             'Vendor 8086')
+            self.assertEqual(client.lookup_device_name(0x8086, 0x1572),
+                             'Device 8086:1572')
+            self.assertEqual(
+                client.lookup_subsystem_device_name(
+                    0x8086, 0x1572, 0x17aa, 0x0001),
+                'Subsystem 17aa:0001')
+
+    def test_lookup_many_larger_than_socket_buffers(self):
+        # Far more requests and answers than the socket buffers hold
+        requests = [(index % 0x10000, index // 0x10000 + 1)
+                    for index in range(50000)]
+        with LookupClient(self.path, timeout=30) as client:
+            names = client.lookup_many(requests)
+            self.assertEqual(len(names), len(requests))
+            self.assertEqual(names[0], 'Device 0000:0001')
+            self.assertEqual(names[-1], 'Device c34f:0001')
+            # The connection is still in step afterwards.
+            self.assertEqual(client.lookup_vendor_name(1), 'Vendor 0001')
+
+    def test_error_keeps_connection_usable(self):
+        with LookupClient(self.path) as client:
+            with self.assertRaises(ValueError):
+                client.lookup_many([(1,), (1, 2, 3), (2,)])
+            self.assertEqual(client.lookup_vendor_name(2), 'Vendor 0002')
+
+
+class DefaultPathTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        environ = {key: value for key, value in os.environ.items()
+                   if key not in ('PCI_LOOKUP_SOCKET', 'XDG_RUNTIME_DIR')}
+        patcher = mock.patch.dict(os.environ, environ, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_environment(self):
+        os.environ['XDG_RUNTIME_DIR'] = self.tmpdir
+        self.assertEqual(default_path(),
+                         os.path.join(self.tmpdir, 'pci-lookup.sock'))
+        os.environ['PCI_LOOKUP_SOCKET'] = '/run/pci-lookup.sock'
+        self.assertEqual(default_path(), '/run/pci-lookup.sock')
+
+    def test_private_directory(self):
+        path = os.path.join(self.tmpdir, 'private')
+        self.assertEqual(_private_dir(path), path)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+        self.assertEqual(_private_dir(path), path)
+        # Directories other users can get into are refused.
+        os.chmod(path, 0o755)
+        with self.assertRaises(OSError):
+            _private_dir(path)
+        os.rmdir(path)
+        os.symlink(self.tmpdir, path)
+        with self.assertRaises(OSError):
+            _private_dir(path)
+
+
+class RunBatchTests(unittest.TestCase):
+
+    def run_batch(self, data, chunk_size=1024):
+        output = io.BytesIO()
+        errors = io.StringIO()
+        failed = run_batch(FakePCI(), io.BytesIO(data), output, errors,
+                           chunk_size=chunk_size)
+        return failed, [json.loads(line) for line in
+                        output.getvalue().decode('utf-8').splitlines()]
+
+    def test_lines(self):
+        failed, results = self.run_batch(b'8086\n8086 1572\n\nxyz\n1 2')
+        self.assertEqual(failed, 1)
+        self.assertEqual(results[0]['vendor_name'], 'Vendor 8086')
+        self.assertEqual(results[1]['device_name'], 'Device 8086:1572')
+        self.assertEqual(results[2]['line'], 4)
+        self.assertEqual(results[3]['device_name'], 'Device 0001:0002')
+
+    def test_overlong_line(self):
+        overlong = b'1' * (MAX_LINE * 3)
+        failed, results = self.run_batch(b'8086\n' + overlong + b'\n1\n')
+        self.assertEqual(failed, 1)
+        self.assertEqual([result.get('error') for result in results],
+                         [None, 'line too long', None])
+
+    def test_overlong_line_at_eof(self):
+        # Read at once, so the whole line is dropped before EOF is seen
+        overlong = b'1' * (MAX_LINE * 3)
+        failed, results = self.run_batch(b'8086\n' + overlong,
+                                         chunk_size=MAX_LINE * 4)
+        self.assertEqual(failed, 1)
+        self.assertEqual(results[-1]['line'], 2)
+        self.assertEqual(results[-1]['error'], 'line too long')
+
+
+def _uevent(action, slot='0000:03:00.0', seqnum=1, driver=None,
+            pci_id='8086:1572'):
+    # A message the way the kernel sends it on the netlink socket
+    devpath = '/devices/pci0000:00/0000:00:01.0/' + slot
+    fields = [
+        '{}@{}'.format(action, devpath),
+        'ACTION=' + action,
+        'DEVPATH=' + devpath,
+        'SUBSYSTEM=pci',
+    ]
+    if driver is not None:
+        fields.append('DRIVER=' + driver)
+    fields.extend([
+        'PCI_CLASS=20000',
+        'PCI_ID=' + pci_id.upper(),
+        'PCI_SUBSYS_ID=8086:0000',
+        'PCI_SLOT_NAME=' + slot,
+        'MODALIAS=pci:v00008086d00001572sv00008086sd00000000bc02sc00i00',
+        'SEQNUM={}'.format(seqnum),
+    ])
+    return '\0'.join(fields).encode('utf-8') + b'\0'
+
+
+class _Device(object):
+
+    # What UEventMonitor.resync() needs from a device
+
+    def __init__(self, slot, vendor_id, device_id, device_class,
+                 driver=None):
+        self.slot = slot
+        self.vendor_id = vendor_id
+        self.device_id = device_id
+        self.device_class = device_class
+        self.driver = driver
+
+
+class ParseUEventTests(unittest.TestCase):
+
+    def test_pci_event(self):
+        event = parse_uevent(_uevent('bind', seqnum=42, driver='i40e'))
+        self.assertEqual(event.action, 'bind')
+        self.assertEqual(event.devpath,
+                         '/devices/pci0000:00/0000:00:01.0/0000:03:00.0')
+        self.assertEqual(event.slot, '0000:03:00.0')
+        self.assertEqual((event.vendor_id, event.device_id),
+                         (0x8086, 0x1572))
+        self.assertEqual(event.device_class, 0x0200)
+        self.assertEqual(event.driver, 'i40e')
+        self.assertEqual(event.seqnum, 42)
+        self.assertEqual(event.env['PCI_SUBSYS_ID'], '8086:0000')
+
+    def test_other_subsystem(self):
+        self.assertIsNone(parse_uevent(
+            b'add@/devices/virtual/net/tap0\0ACTION=add\0'
+            b'SUBSYSTEM=net\0SEQNUM=7\0'))
+
+    def test_udev_message(self):
+        self.assertIsNone(parse_uevent(
+            b'libudev\0\xfe\xed\xca\xfe\0ACTION=add\0SUBSYSTEM=pci\0'))
+
+
+class UEventMonitorTests(unittest.TestCase):
+
+    def setUp(self):
+        # Unlike datagram socket pairs, these report the peer going away.
+        self.sock, self.peer = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.monitor = UEventMonitor(self.sock, devices=[
+            _Device('0000:00:00.0', 0x8086, 0x2020, 0x0600),
+            _Device('0000:03:00.0', 0x8086, 0x1572, 0x0200, 'i40e'),
+        ])
+
+    def tearDown(self):
+        self.monitor.close()
+        self.peer.close()
+
+    def send(self, *messages):
+        for message in messages:
+            self.peer.send(message)
+
+    def test_initial_table(self):
+        self.assertEqual(sorted(self.monitor.devices),
+                         ['0000:00:00.0', '0000:03:00.0'])
+        self.assertEqual(self.monitor.devices['0000:03:00.0'].driver, 'i40e')
+
+    def test_table_follows_events(self):
+        devices = self.monitor.devices
+        self.send(_uevent('unbind', seqnum=1))
+        self.assertEqual(self.monitor.receive().action, 'unbind')
+        self.assertIsNone(devices['0000:03:00.0'].driver)
+        self.send(_uevent('bind', seqnum=2, driver='vfio-pci'))
+        self.assertEqual(self.monitor.receive().driver, 'vfio-pci')
+        self.assertEqual(devices['0000:03:00.0'].driver, 'vfio-pci')
+        # Change events do not carry the driver, the table keeps it.
+        self.send(_uevent('change', seqnum=3))
+        event = self.monitor.receive()
+        self.assertEqual(event.action, 'change')
+        self.assertEqual(event.driver, 'vfio-pci')
+        self.assertEqual(devices['0000:03:00.0'].seqnum, 3)
+        self.send(_uevent('remove', seqnum=4))
+        self.assertEqual(self.monitor.receive().action, 'remove')
+        self.assertNotIn('0000:03:00.0', devices)
+        self.send(_uevent('add', slot='0000:04:00.0', seqnum=5,
+                          pci_id='15b3:1017'))
+        event = self.monitor.receive()
+        self.assertEqual(event.action, 'add')
+        self.assertEqual(devices['0000:04:00.0'].vendor_id, 0x15b3)
+        self.assertIsNone(devices['0000:04:00.0'].driver)
+        self.assertEqual(sorted(devices), ['0000:00:00.0', '0000:04:00.0'])
+
+    def test_other_events_are_skipped(self):
+        self.send(b'add@/devices/virtual/net/tap0\0ACTION=add\0'
+                  b'SUBSYSTEM=net\0SEQNUM=1\0',
+                  _uevent('remove', seqnum=2))
+        event = self.monitor.receive()
+        self.assertEqual((event.action, event.seqnum), ('remove', 2))
+
+    def test_eof(self):
+        self.send(_uevent('remove', seqnum=1),
+                  _uevent('add', slot='0000:05:00.0', seqnum=2))
+        self.peer.close()
+        events = list(self.monitor)
+        self.assertEqual([event.seqnum for event in events], [1, 2])
+        self.assertIsNone(self.monitor.receive())
+        self.assertEqual(sorted(self.monitor.devices),
+                         ['0000:00:00.0', '0000:05:00.0'])
+
+    def test_lost_events(self):
+        class OverflowingSocket(object):
+            def recv(self, size):
+                raise OSError(errno.ENOBUFS, os.strerror(errno.ENOBUFS))
+
+            def close(self):
+                pass
+        monitor = UEventMonitor(OverflowingSocket())
+        with self.assertLogs('libpci.events', 'WARNING'):
+            self.assertEqual(monitor.receive().action, RESYNC)
+        monitor.resync([_Device('0000:06:00.0', 0x1af4, 0x1000, 0x0200)])
+        self.assertEqual(list(monitor.devices), ['0000:06:00.0'])
+
+    def test_stream(self):
+        self.send(_uevent('unbind', seqnum=1),
+                  _uevent('remove', seqnum=2))
+        self.peer.close()
+
+        async def collect():
+            return [event async for event in self.monitor.stream()]
+        events = asyncio.run(collect())
+        self.assertEqual([event.action for event in events],
+                         ['unbind', 'remove'])
+        self.assertEqual(list(self.monitor.devices), ['0000:00:00.0'])
+
+
+def _open_libpci(*args, **kwargs):
+    # Tests below need libpci.so.3 itself
+    try:
+        from libpci.wrapper import LibPCI
+    except OSError as exc:
+        raise unittest.SkipTest("cannot load libpci: {}".format(exc))
+    return LibPCI(*args, **kwargs)
+
+
+class FixtureTests(unittest.TestCase):
+
+    """Tests against a synthetic sysfs tree from :mod:`libpci.fixtures`."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        try:
+            ids = write_pci_ids(os.path.join(cls.tmpdir, 'pci.ids'),
+                                vendors=20, devices=5, seed=1)
+            sysfs = os.path.join(cls.tmpdir, 'sys')
+            cls.functions = write_sysfs(sysfs, ids, 200, seed=1,
+                                        sriov_ratio=0.5, vfs_per_pf=4)
+            cls.modules_alias = os.path.join(cls.tmpdir, 'modules.alias')
+            write_modules_alias(cls.modules_alias, cls.functions,
+                                patterns=500, seed=1)
+            cls.pci = _open_libpci('linux-sysfs', {'sysfs.path': sysfs})
+        except BaseException:
+            shutil.rmtree(cls.tmpdir)
+            raise
+        cls.devices = cls.pci.scan_bus()
+        cls.by_slot = {device.slot: device for device in cls.devices}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pci.close()
+        shutil.rmtree(cls.tmpdir)
+
+    def slots(self, items):
+        return sorted(item.slot for item in items)
+
+    def test_scan(self):
+        self.assertEqual(sorted(self.by_slot), self.slots(self.functions))
+        for function in self.functions:
+            device = self.by_slot[function.slot]
+            self.assertEqual(
+                (device.vendor_id, device.device_id, device.device_class),
+                (function.vendor_id, function.device_id,
+                 function.device_class))
+
+    def test_capabilities(self):
+        endpoints = 0
+        for function in self.functions:
+            if function.secondary_bus is None and function.bus == 0:
+                continue
+            config = self.by_slot[function.slot].read_config(
+                PCI_EXT_CONFIG_SPACE_SIZE)
+            self.assertEqual(
+                [cap.id for cap in iter_capabilities(config)],
+                [PCI_CAP_ID_PM.value, PCI_CAP_ID_MSI.value,
+                 PCI_CAP_ID_EXP.value])
+            if function.secondary_bus is None:
+                endpoints += 1
+                self.assertEqual(
+                    [cap.id for cap in iter_ext_capabilities(config)][:1],
+                    [PCI_EXT_CAP_ID_AER.value])
+                index = self.by_slot[function.slot].ext_capabilities()
+                self.assertIsNotNone(index.aer)
+        self.assertGreater(endpoints, 0)
+
+    def test_virtual_functions(self):
+        expected = {}
+        for function in self.functions:
+            if function.physfn is not None:
+                expected.setdefault(function.physfn, []).append(function)
+        self.assertTrue(expected, "the fixture has no virtual functions")
+        for device in self.devices:
+            vfs = device.virtual_functions()
+            self.assertEqual(self.slots(vfs),
+                             self.slots(expected.get(device.slot, ())))
+            for vf in vfs:
+                self.assertEqual(vf.device_id,
+                                 self.by_slot[vf.slot].device_id)
+        pf = self.by_slot[sorted(expected)[0]]
+        self.assertIn(PCI_EXT_CAP_ID_SRIOV, pf.ext_capabilities())
+
+    def test_topology(self):
+        topology = Topology(self.devices)
+        bridges = {(function.domain, function.secondary_bus): function
+                   for function in self.functions
+                   if function.secondary_bus is not None}
+        for function in self.functions:
+            device = self.by_slot[function.slot]
+            parent = topology.parent(device)
+            if function.bus == 0:
+                self.assertIsNone(parent)
+                self.assertEqual(topology.path(device), (device,))
+            else:
+                port = bridges[function.domain, function.bus]
+                self.assertEqual(parent.slot, port.slot)
+                self.assertEqual(topology.root(device).slot, port.slot)
+                self.assertIn(device, topology.children(parent))
+        self.assertEqual(
+            self.slots(topology.roots()),
+            self.slots(f for f in self.functions if f.bus == 0))
+
+    def test_filter(self):
+        vendor_id = self.functions[-1].vendor_id
+        tests = (
+            (DeviceFilter(ids='{:04x}:'.format(vendor_id)),
+             lambda f: f.vendor_id == vendor_id),
+            (DeviceFilter(slot='00:'), lambda f: f.bus == 0),
+            (DeviceFilter(slot='*.1'), lambda f: f.func == 1),
+            (DeviceFilter(device_class='02'),
+             lambda f: f.device_class >> 8 == 0x02),
+            (DeviceFilter(ids='::0604'),
+             lambda f: f.device_class == 0x0604),
+        )
+        # Imported here since it loads libpci when imported.
+        from libpci.table import DeviceTable
+        table = DeviceTable.from_pci(self.pci)
+        table.create_index('vendor_id')
+        table.create_index('bus')
+        for device_filter, expected in tests:
+            slots = self.slots(f for f in self.functions if expected(f))
+            self.assertTrue(slots, device_filter)
+            self.assertEqual(self.slots(device_filter.filter(self.devices)),
+                             slots, device_filter)
+            self.assertEqual(self.slots(device_filter.select(table)), slots,
+                             device_filter)
+
+    def test_inventory(self):
+        inventory = Inventory(self.pci)
+        self.assertEqual(len(inventory), len(self.functions))
+        for name in ('driver', 'numa_node', 'iommu_group'):
+            for value in {getattr(f, name) for f in self.functions}:
+                self.assertEqual(
+                    self.slots(inventory.query(**{name: value})),
+                    self.slots(f for f in self.functions
+                               if getattr(f, name) == value))
+        self.assertEqual(
+            inventory.count(driver={'nvme', 'ahci'}, numa_node=1),
+            sum(1 for f in self.functions
+                if f.driver in ('nvme', 'ahci') and f.numa_node == 1))
+        with self.assertRaises(ValueError):
+            inventory.query(colour='blue')
+        with self.assertRaises(ValueError):
+            inventory.query(driver='no-such-driver', colour='blue')
+
+    def test_modalias(self):
+        aliases = ModuleAliases(self.modules_alias)
+        modules = dict(zip((device.slot for device in self.devices),
+                           aliases.resolve(self.devices)))
+        for function in self.functions:
+            if function.driver is not None:
+                self.assertIn(function.driver, modules[function.slot])
+        self.assertEqual(aliases.modules('pci:v0000FFFFd0000FFFFsv00000000'
+                                         'sd00000000bcFFsc00i00'), ())
+
+
+# Top of the source tree, with the pci-lookup script
+_TOP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs pci-lookup and prints the libpci modules it imported
+_IMPORTS_CODE = """\
+import runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+print(' '.join(sorted(name for name in sys.modules
+                      if name.startswith('libpci'))), file=sys.stderr)
+"""
+
+
+class StartupTests(unittest.TestCase):
+
+    """Start-up time and imports of the ``pci-lookup`` script."""
+
+    repeat = 3
+
+    @classmethod
+    def setUpClass(cls):
+        cls.script = os.path.join(_TOP, 'pci-lookup')
+        if not os.path.exists(cls.script):
+            raise unittest.SkipTest("pci-lookup is not in the source tree")
+        path = os.environ.get('PYTHONPATH')
+        cls.env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            [_TOP, path] if path else [_TOP]))
+        cls.baseline = min(cls.spawn('-c', 'pass')
+                           for i in range(cls.repeat))
+
+    @classmethod
+    def spawn(cls, *argv):
+        # Returns the time it takes to run Python with the given arguments
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable] + list(argv), env=cls.env,
+                              stdout=subprocess.DEVNULL)
+        return time.perf_counter() - start
+
+    def check_budget(self, name, *argv):
+        elapsed = min(self.spawn(self.script, *argv)
+                      for i in range(self.repeat)) - self.baseline
+        self.assertLessEqual(
+            elapsed, STARTUP_BUDGET[name],
+            "pci-lookup {} took {:.0f}ms more than the interpreter".format(
+                ' '.join(argv), elapsed * 1e3))
+
+    def imported(self, *argv):
+        result = subprocess.run(
+            [sys.executable, '-c', _IMPORTS_CODE, self.script] + list(argv),
+            env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            universal_newlines=True, check=True)
+        return result.stderr.splitlines()[-1].split()
+
+    def test_help_imports(self):
+        imported = self.imported('--help')
+        self.assertNotIn('libpci._functions', imported)
+        self.assertNotIn('libpci.wrapper', imported)
+
+    def test_help_budget(self):
+        self.check_budget('startup_help', '--help')
+
+    def test_vendor_budget(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        id_file = os.path.join(tmpdir, 'pci.ids')
+        vendor_id = write_pci_ids(id_file, seed=1)[0].vendor_id
+        argv = ('--id-file', id_file, 'vendor', '{:04x}'.format(vendor_id))
+        if subprocess.call([sys.executable, self.script] + list(argv),
+                           env=self.env, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL):
+            self.skipTest("pci-lookup cannot load libpci")
+        self.check_budget('startup_vendor', *argv)
+
+
+if __name__ == '__main__':
+    unittest.main()
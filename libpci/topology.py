@@ -0,0 +1,336 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tree of bridges and the devices behind them.
+
+:class:`Topology` reads the header of each device once and indexes the
+bus ranges claimed by bridges (their secondary and subordinate bus
+numbers). The parent of a device is then the bridge whose secondary bus is
+the bus of the device, found with a single dictionary lookup::
+
+    topology = Topology(pci.scan_bus())
+    root_port = topology.path(gpu)[0]
+    behind_switch = list(topology.subtree(switch_port))
+
+Devices are identified by address, so any object with ``domain``, ``bus``,
+``dev`` and ``func`` attributes and a ``read_config()`` method works,
+including records read from dumps and snapshots. :meth:`Topology.update()`
+applies the result of :meth:`libpci.LibPCI.rescan()` without rebuilding
+the index.
+"""
+
+from collections import namedtuple
+import logging
+
+from libpci._macros import PCI_CB_CARD_BUS
+from libpci._macros import PCI_CB_SUBORDINATE_BUS
+from libpci._macros import PCI_HEADER_TYPE
+from libpci._macros import PCI_HEADER_TYPE_BRIDGE
+from libpci._macros import PCI_HEADER_TYPE_CARDBUS
+from libpci._macros import PCI_SECONDARY_BUS
+from libpci._macros import PCI_SUBORDINATE_BUS
+
+__all__ = ('BusRange', 'Topology')
+
+
+_logger = logging.getLogger("libpci.topology")
+
+# Size of the standard header, which holds all the registers needed here
+_HEADER_SIZE = 64
+# Bits of the header type register that select the layout
+_HEADER_LAYOUT_MASK = 0x7f
+
+
+class BusRange(namedtuple("BusRange", "domain secondary subordinate")):
+
+    """
+    Buses forwarded by a bridge.
+
+    :attr secondary:
+        Number of the bus directly below the bridge
+    :attr subordinate:
+        Number of the highest bus anywhere below the bridge
+    """
+
+    __slots__ = ()
+
+    def __contains__(self, device):
+        """Check if a device is anywhere below the bridge."""
+        return (device.domain == self.domain
+                and self.secondary <= device.bus <= self.subordinate)
+
+
+def _key(device):
+    return (device.domain, device.bus, device.dev, device.func)
+
+
+def _format(key):
+    return '{:04x}:{:02x}:{:02x}.{:x}'.format(*key)
+
+
+def _bus_range(device):
+    config = device.read_config(_HEADER_SIZE)
+    if not config:
+        return None
+    layout = config[PCI_HEADER_TYPE.value] & _HEADER_LAYOUT_MASK
+    if layout == PCI_HEADER_TYPE_BRIDGE.value:
+        secondary = config[PCI_SECONDARY_BUS.value]
+        subordinate = config[PCI_SUBORDINATE_BUS.value]
+    elif layout == PCI_HEADER_TYPE_CARDBUS.value:
+        secondary = config[PCI_CB_CARD_BUS.value]
+        subordinate = config[PCI_CB_SUBORDINATE_BUS.value]
+    else:
+        return None
+    # Bridges not configured by the firmware or the kernel forward nothing.
+    if secondary == 0 or secondary <= device.bus or subordinate < secondary:
+        return None
+    return BusRange(device.domain, secondary, subordinate)
+
+
+class Topology(object):
+
+    """
+    Index of the tree formed by bridges and devices.
+
+    All queries take and return device objects. Finding the parent is a
+    dictionary lookup; paths from the root are computed once per device and
+    cached until the next change.
+    """
+
+    def __init__(self, devices=()):
+        """
+        Build the index.
+
+        :param devices:
+            Iterable of devices, typically the result of
+            :meth:`libpci.LibPCI.scan_bus()`. The first 64 bytes of the
+            configuration space of each device are read once.
+        """
+        # address -> device
+        self._devices = {}
+        # address -> BusRange, for bridges only
+        self._ranges = {}
+        # (domain, secondary bus) -> address of the bridge
+        self._bridges = {}
+        # (domain, bus) -> {address: None}, an insertion ordered set
+        self._buses = {}
+        # address -> tuple of addresses from the root
+        self._paths = {}
+        for device in devices:
+            self.add(device)
+
+    def __repr__(self):
+        """Get a debugging representation of the index."""
+        return '<{} {} devices, {} bridges>'.format(
+            self.__class__.__name__, len(self._devices), len(self._ranges))
+
+    def __len__(self):
+        """Get the number of devices."""
+        return len(self._devices)
+
+    def __contains__(self, device):
+        """Check if a device (or a device at the same address) is known."""
+        return _key(device) in self._devices
+
+    def __iter__(self):
+        """Iterate over all the devices."""
+        return iter(self._devices.values())
+
+    def add(self, device):
+        """
+        Add a device, replacing any device at the same address.
+
+        :param device:
+            The device to add
+        """
+        key = _key(device)
+        if key in self._devices:
+            self.remove(device)
+        self._devices[key] = device
+        self._buses.setdefault(key[:2], {})[key] = None
+        bus_range = _bus_range(device)
+        if bus_range is not None:
+            bridge_key = (bus_range.domain, bus_range.secondary)
+            if bridge_key in self._bridges:
+                _logger.warning(
+                    "Bridges %s and %s claim the same bus, ignoring the"
+                    " latter", _format(self._bridges[bridge_key]),
+                    _format(key))
+            else:
+                self._ranges[key] = bus_range
+                self._bridges[bridge_key] = key
+        self._paths.clear()
+
+    def remove(self, device):
+        """
+        Remove a device.
+
+        :param device:
+            The device to remove, or any device at the same address
+        :raises KeyError:
+            If there is no device at that address
+
+        Devices behind a removed bridge stay in the index without a parent
+        until a bridge claiming their bus is added.
+        """
+        key = _key(device)
+        del self._devices[key]
+        bus = self._buses[key[:2]]
+        del bus[key]
+        if not bus:
+            del self._buses[key[:2]]
+        bus_range = self._ranges.pop(key, None)
+        if bus_range is not None:
+            del self._bridges[(bus_range.domain, bus_range.secondary)]
+        self._paths.clear()
+
+    def update(self, changes):
+        """
+        Apply the result of :meth:`libpci.LibPCI.rescan()`.
+
+        :param changes:
+            :class:`libpci.ChangeSet` with added, removed and changed devices
+        """
+        for device in changes.removed:
+            self.remove(device)
+        for device in changes.changed:
+            self.add(device)
+        for device in changes.added:
+            self.add(device)
+
+    def bus_range(self, device):
+        """
+        Get the buses forwarded by a bridge.
+
+        :returns:
+            :class:`BusRange` or None if the device is not a bridge
+        """
+        return self._ranges.get(_key(device))
+
+    def is_bridge(self, device):
+        """Check if a device is a bridge with buses behind it."""
+        return _key(device) in self._ranges
+
+    def parent(self, device):
+        """
+        Get the bridge directly above a device.
+
+        :returns:
+            The bridge or None for devices on a root bus (or behind a bridge
+            that is not known)
+        """
+        parent_key = self._bridges.get(_key(device)[:2])
+        if parent_key is not None:
+            return self._devices[parent_key]
+
+    def path(self, device):
+        """
+        Get the chain of bridges from the root down to a device.
+
+        :returns:
+            A tuple of devices that starts with the top-most known bridge
+            (for PCI Express, the root port) and ends with the device itself
+        """
+        devices = self._devices
+        return tuple(devices[key] for key in self._path(_key(device)))
+
+    def _path(self, key):
+        path = self._paths.get(key)
+        if path is not None:
+            return path
+        # Walk up until a device with a known path or a root, then fill in
+        # the cache on the way back down.
+        chain = [key]
+        seen = {key}
+        prefix = ()
+        while True:
+            parent_key = self._bridges.get(chain[-1][:2])
+            if parent_key is None:
+                break
+            if parent_key in seen:
+                _logger.warning("Loop of bridges at %s", _format(parent_key))
+                break
+            cached = self._paths.get(parent_key)
+            if cached is not None:
+                prefix = cached
+                break
+            chain.append(parent_key)
+            seen.add(parent_key)
+        for key in reversed(chain):
+            prefix += (key,)
+            self._paths[key] = prefix
+        return prefix
+
+    def root(self, device):
+        """
+        Get the top-most known device above a device.
+
+        :returns:
+            The first element of :meth:`path()`, the device itself for
+            devices on a root bus
+        """
+        return self._devices[self._path(_key(device))[0]]
+
+    def children(self, device):
+        """
+        Get the devices directly below a bridge.
+
+        :returns:
+            A tuple of devices on the secondary bus of the bridge, empty for
+            devices other than bridges
+        """
+        bus_range = self._ranges.get(_key(device))
+        if bus_range is None:
+            return ()
+        return tuple(
+            self._devices[key] for key in self._buses.get(
+                (bus_range.domain, bus_range.secondary), ()))
+
+    def subtree(self, device):
+        """
+        Iterate over all the devices below a bridge.
+
+        :returns:
+            An iterator yielding the device itself and then everything below
+            it, depth first
+        """
+        stack = [device]
+        seen = set()
+        while stack:
+            device = stack.pop()
+            key = _key(device)
+            if key in seen:
+                continue
+            seen.add(key)
+            yield device
+            stack.extend(reversed(self.children(device)))
+
+    def roots(self):
+        """
+        Get the devices without a known parent.
+
+        :returns:
+            A list of devices, typically host bridges, root ports and
+            integrated endpoints
+        """
+        bridges = self._bridges
+        return [device for key, device in self._devices.items()
+                if key[:2] not in bridges]
@@ -0,0 +1,119 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Hook for tracing individual operations.
+
+Name lookups, bus scans and configuration space reads of :class:`LibPCI`
+and :class:`Device` report a :class:`Span` to the tracer installed with
+:func:`set_tracer()`, which can forward it to any tracing system. With no
+tracer installed (the default) each operation only checks that
+:data:`tracer` is None.
+
+Attributes of spans, when applicable to the operation:
+
+``vendor_id``, ``device_id``, ``subvendor_id``, ``subdevice_id``
+    Identifiers passed to a lookup
+``flags``
+    Lookup flags passed to libpci
+``slot``
+    Address of the device whose configuration space was read
+``pos``, ``size``
+    Offset and size of a configuration space read
+``added``, ``removed``, ``changed``
+    Number of devices in each part of the result of a rescan
+``result_size``
+    Length of the name found, number of devices found or number of bytes
+    read (zero if the read failed)
+"""
+
+from collections import namedtuple
+import logging
+import time
+
+__all__ = ('Span', 'set_tracer', 'tracer')
+
+
+_logger = logging.getLogger("libpci.tracing")
+
+#: The installed tracer, a callable taking a :class:`Span`, or None
+tracer = None
+
+clock = time.perf_counter
+
+
+class Span(namedtuple("Span", "operation start duration attributes")):
+
+    """
+    A single completed operation.
+
+    :attr operation:
+        Name of the method that performed the operation, for example
+        ``'lookup_vendor_name'`` or ``'read_config'``
+    :attr start:
+        Wall clock time when the operation started, in seconds since the
+        epoch
+    :attr duration:
+        Duration of the operation in seconds, measured with a monotonic
+        high-resolution clock
+    :attr attributes:
+        Dictionary with details of the operation
+    """
+
+    __slots__ = ()
+
+
+def set_tracer(new_tracer):
+    """
+    Install a tracer.
+
+    :param new_tracer:
+        A callable invoked with a :class:`Span` after each traced operation
+        or None to disable tracing. It runs synchronously on the thread that
+        performed the operation; exceptions it raises are logged and
+        otherwise ignored.
+    :returns:
+        The previously installed tracer, or None
+    """
+    global tracer
+    old_tracer = tracer
+    tracer = new_tracer
+    return old_tracer
+
+
+def emit(active_tracer, operation, start, **attributes):
+    """
+    Report a completed operation to a tracer.
+
+    :param active_tracer:
+        The tracer that was installed when the operation started
+    :param operation:
+        Name of the operation
+    :param start:
+        Value of :func:`clock()` when the operation started
+    :param attributes:
+        Details of the operation
+    """
+    duration = clock() - start
+    span = Span(operation, time.time() - duration, duration, attributes)
+    try:
+        active_tracer(span)
+    except Exception:
+        _logger.exception("Tracer failed on %s", operation)
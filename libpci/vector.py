@@ -0,0 +1,228 @@
+# encoding: utf-8
+#
+# Copyright 2015 Canonical Ltd.
+#
+# Written by:
+#   Zygmunt Krynicki <zygmunt.krynicki@canonical.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Vectorized decoding of the configuration space of many devices at once.
+
+This module requires NumPy, which is an optional dependency of libpci
+(install the ``vector`` extra). It operates on a two-dimensional ``uint8``
+array with one configuration space snapshot (256 or 4096 bytes) per row and
+decodes the standard header of all rows at once, without a Python-level
+loop over devices.
+"""
+
+import numpy
+
+from libpci._macros import PCI_BASE_ADDRESS_0
+from libpci._macros import PCI_BASE_ADDRESS_MEM_TYPE_64
+from libpci._macros import PCI_BASE_ADDRESS_MEM_TYPE_MASK
+from libpci._macros import PCI_BASE_ADDRESS_SPACE_IO
+from libpci._macros import PCI_CLASS_DEVICE
+from libpci._macros import PCI_CLASS_PROG
+from libpci._macros import PCI_COMMAND
+from libpci._macros import PCI_COMMAND_DISABLE_INTx
+from libpci._macros import PCI_COMMAND_IO
+from libpci._macros import PCI_COMMAND_MASTER
+from libpci._macros import PCI_COMMAND_MEMORY
+from libpci._macros import PCI_DEVICE_ID
+from libpci._macros import PCI_HEADER_TYPE
+from libpci._macros import PCI_HEADER_TYPE_BRIDGE
+from libpci._macros import PCI_HEADER_TYPE_CARDBUS
+from libpci._macros import PCI_HEADER_TYPE_NORMAL
+from libpci._macros import PCI_INTERRUPT_LINE
+from libpci._macros import PCI_INTERRUPT_PIN
+from libpci._macros import PCI_PRIMARY_BUS
+from libpci._macros import PCI_REVISION_ID
+from libpci._macros import PCI_SECONDARY_BUS
+from libpci._macros import PCI_STATUS
+from libpci._macros import PCI_STATUS_CAP_LIST
+from libpci._macros import PCI_SUBORDINATE_BUS
+from libpci._macros import PCI_SUBSYSTEM_ID
+from libpci._macros import PCI_SUBSYSTEM_VENDOR_ID
+from libpci._macros import PCI_VENDOR_ID
+
+__all__ = ('HEADER_DTYPE', 'decode_headers', 'stack_configs')
+
+
+# Size of the standard header shared by all header types
+_HEADER_SIZE = 64
+# Bit of the header type register that marks multi-function devices
+_HEADER_TYPE_MULTIFUNCTION = 0x80
+# Number of BARs implemented by each of the header types
+_BAR_COUNT = {
+    PCI_HEADER_TYPE_NORMAL.value: 6,
+    PCI_HEADER_TYPE_BRIDGE.value: 2,
+    PCI_HEADER_TYPE_CARDBUS.value: 1,
+}
+
+# Layout of the raw header, used to view each row of the input in place
+_RAW_FIELDS = (
+    ('vendor_id', '<u2', PCI_VENDOR_ID),
+    ('device_id', '<u2', PCI_DEVICE_ID),
+    ('command', '<u2', PCI_COMMAND),
+    ('status', '<u2', PCI_STATUS),
+    ('revision', 'u1', PCI_REVISION_ID),
+    ('prog_if', 'u1', PCI_CLASS_PROG),
+    ('device_class', '<u2', PCI_CLASS_DEVICE),
+    ('header_type', 'u1', PCI_HEADER_TYPE),
+    ('bars', ('<u4', (6,)), PCI_BASE_ADDRESS_0),
+    ('primary_bus', 'u1', PCI_PRIMARY_BUS),
+    ('secondary_bus', 'u1', PCI_SECONDARY_BUS),
+    ('subordinate_bus', 'u1', PCI_SUBORDINATE_BUS),
+    ('subsystem_vendor_id', '<u2', PCI_SUBSYSTEM_VENDOR_ID),
+    ('subsystem_id', '<u2', PCI_SUBSYSTEM_ID),
+    ('irq_line', 'u1', PCI_INTERRUPT_LINE),
+    ('irq_pin', 'u1', PCI_INTERRUPT_PIN),
+)
+
+#: Structured type of the array returned by :func:`decode_headers()`
+HEADER_DTYPE = numpy.dtype([
+    ('present', '?'),
+    ('vendor_id', '<u2'),
+    ('device_id', '<u2'),
+    ('command', '<u2'),
+    ('status', '<u2'),
+    ('revision', 'u1'),
+    ('prog_if', 'u1'),
+    ('device_class', '<u2'),
+    ('header_type', 'u1'),
+    ('multifunction', '?'),
+    ('io_enabled', '?'),
+    ('memory_enabled', '?'),
+    ('bus_master', '?'),
+    ('intx_disabled', '?'),
+    ('cap_list', '?'),
+    ('subsystem_vendor_id', '<u2'),
+    ('subsystem_id', '<u2'),
+    ('irq_line', 'u1'),
+    ('irq_pin', 'u1'),
+    ('primary_bus', 'u1'),
+    ('secondary_bus', 'u1'),
+    ('subordinate_bus', 'u1'),
+    ('bars', '<u8', (6,)),
+    ('bar_io', '?', (6,)),
+    ('bar_64', '?', (6,)),
+])
+
+
+def _raw_dtype(row_size):
+    names, formats, offsets = zip(*_RAW_FIELDS)
+    return numpy.dtype({
+        'names': names,
+        'formats': formats,
+        'offsets': [macro.value for macro in offsets],
+        'itemsize': row_size,
+    })
+
+
+def stack_configs(configs, size=256):
+    """
+    Stack configuration space snapshots into a single array.
+
+    :param configs:
+        An iterable of bytes-like snapshots. Shorter snapshots are padded
+        with 0xff (the value read from absent registers), longer ones are
+        truncated.
+    :param size:
+        Number of bytes of each snapshot to keep, typically 256 or 4096.
+    :returns:
+        A ``uint8`` array of shape ``(N, size)``.
+    """
+    configs = list(configs)
+    array = numpy.full((len(configs), size), 0xff, dtype=numpy.uint8)
+    for row, config in zip(array, configs):
+        config = numpy.frombuffer(config, dtype=numpy.uint8)[:size]
+        row[:len(config)] = config
+    return array
+
+
+def decode_headers(configs):
+    """
+    Decode the standard header of many configuration space snapshots.
+
+    :param configs:
+        A ``uint8`` array of shape ``(N, 256)`` or ``(N, 4096)`` (any row
+        size of at least 64 bytes works), one snapshot per row.
+    :returns:
+        A one-dimensional array of :data:`HEADER_DTYPE` with N elements.
+
+    Fields that are not defined for a given header type (subsystem
+    identifiers of bridges, bus numbers of endpoints, BARs that the header
+    type does not implement) are set to zero. BAR values are decoded
+    addresses; the upper half of a 64-bit BAR is folded into the lower half
+    and its own slot is set to zero.
+    """
+    configs = numpy.ascontiguousarray(configs, dtype=numpy.uint8)
+    if configs.ndim != 2 or configs.shape[1] < _HEADER_SIZE:
+        raise ValueError(
+            "expected an array of shape (N, 256) or (N, 4096), got {}".format(
+                configs.shape))
+    raw = configs.view(_raw_dtype(configs.shape[1])).reshape(-1)
+    out = numpy.zeros(len(raw), dtype=HEADER_DTYPE)
+    for name in ('vendor_id', 'device_id', 'command', 'status', 'revision',
+                 'prog_if', 'device_class', 'irq_line', 'irq_pin'):
+        out[name] = raw[name]
+    out['present'] = raw['vendor_id'] != 0xffff
+    header_type = raw['header_type'] & (_HEADER_TYPE_MULTIFUNCTION - 1)
+    out['header_type'] = header_type
+    out['multifunction'] = (
+        raw['header_type'] & _HEADER_TYPE_MULTIFUNCTION) != 0
+    command = raw['command']
+    out['io_enabled'] = (command & PCI_COMMAND_IO.value) != 0
+    out['memory_enabled'] = (command & PCI_COMMAND_MEMORY.value) != 0
+    out['bus_master'] = (command & PCI_COMMAND_MASTER.value) != 0
+    out['intx_disabled'] = (command & PCI_COMMAND_DISABLE_INTx.value) != 0
+    out['cap_list'] = (raw['status'] & PCI_STATUS_CAP_LIST.value) != 0
+    normal = header_type == PCI_HEADER_TYPE_NORMAL.value
+    out['subsystem_vendor_id'] = numpy.where(
+        normal, raw['subsystem_vendor_id'], 0)
+    out['subsystem_id'] = numpy.where(normal, raw['subsystem_id'], 0)
+    bridge = header_type == PCI_HEADER_TYPE_BRIDGE.value
+    for name in ('primary_bus', 'secondary_bus', 'subordinate_bus'):
+        out[name] = numpy.where(bridge, raw[name], 0)
+    _decode_bars(raw['bars'], header_type, out)
+    return out
+
+
+def _decode_bars(bars, header_type, out):
+    # The loop runs over the six BAR slots, each step is vectorized over
+    # all devices. A 64-bit BAR consumes the following slot so whether a
+    # slot is an upper half depends on the decoding of the previous one.
+    bars = bars.astype(numpy.uint64)
+    bar_count = numpy.zeros(len(header_type), dtype=numpy.uint8)
+    for value, count in _BAR_COUNT.items():
+        bar_count[header_type == value] = count
+    upper_half = numpy.zeros(len(header_type), dtype=bool)
+    for i in range(6):
+        low = bars[:, i]
+        valid = (i < bar_count) & ~upper_half
+        io = valid & ((low & PCI_BASE_ADDRESS_SPACE_IO.value) != 0)
+        is_64 = valid & ~io & (i + 1 < bar_count) & (
+            (low & PCI_BASE_ADDRESS_MEM_TYPE_MASK.value)
+            == PCI_BASE_ADDRESS_MEM_TYPE_64.value)
+        high = bars[:, i + 1] if i < 5 else numpy.zeros_like(low)
+        address = numpy.where(
+            io, low & ~numpy.uint64(0x3), low & ~numpy.uint64(0xf))
+        address = numpy.where(
+            is_64, address | (high << numpy.uint64(32)), address)
+        out['bars'][:, i] = numpy.where(valid, address, 0)
+        out['bar_io'][:, i] = io
+        out['bar_64'][:, i] = is_64
+        upper_half = is_64
@@ -20,23 +20,62 @@
 
 """Pythonic wrapper to some of libpci functions."""
 
+from collections import namedtuple
 import ctypes
 import logging
+import os
+import sys
+import threading
+import weakref
 
 from libpci._functions import pci_alloc
 from libpci._functions import pci_cleanup
+from libpci._functions import pci_fill_info
+from libpci._functions import pci_free_dev
+from libpci._functions import pci_get_method_name
+from libpci._functions import pci_get_param
 from libpci._functions import pci_init
+from libpci._functions import pci_load_name_list
 from libpci._functions import pci_lookup_name1
 from libpci._functions import pci_lookup_name2
+from libpci._functions import pci_lookup_method
 from libpci._functions import pci_lookup_name4
+from libpci._functions import pci_read_block
+from libpci._functions import pci_read_byte
+from libpci._functions import pci_scan_bus
+from libpci._functions import pci_set_name_list_path
+from libpci._functions import pci_set_param
+from libpci._macros import PCI_FILL_BASES
+from libpci._macros import PCI_FILL_CLASS
+from libpci._macros import PCI_FILL_IDENT
+from libpci._macros import PCI_FILL_IRQ
+from libpci._macros import PCI_FILL_MODULE_ALIAS
+from libpci._macros import PCI_FILL_PHYS_SLOT
+from libpci._macros import PCI_FILL_ROM_BASE
+from libpci._macros import PCI_FILL_SIZES
+from libpci._macros import PCI_REVISION_ID
+from libpci._types import pci_access_type
 from libpci._types import pci_lookup_mode
+from libpci.capabilities import ExtCapabilityIndex
+from libpci.capabilities import PCI_CONFIG_SPACE_SIZE
+from libpci.capabilities import PCI_EXT_CONFIG_SPACE_SIZE
+from libpci.sriov import VirtualFunctions
+from libpci.sriov import read_sriov
+from libpci import tracing
 
 
-__all__ = ('LibPCI',)
+__all__ = ('LibPCI', 'Device', 'ChangeSet', 'PciDevice', 'shared')
 
 
 _logger = logging.getLogger("libpci")
 
+# Open LibPCI objects, to reset per-process state in children after fork()
+_instances = weakref.WeakSet()
+
+_shared = None
+_shared_args = None
+_shared_lock = threading.Lock()
+
 
 class flag_property(object):
 
@@ -69,6 +108,33 @@ def _err_closed():
     raise ValueError("attempt to use closed LibPCI object")
 
 
+def _copy_pointer(pointer):
+    return ctypes.cast(pointer, type(pointer))
+
+
+def _resolve_method(method):
+    # Returns the index of the method. libpci adds methods over time, so
+    # indexes beyond pci_access_type are valid too.
+    if method is None:
+        return int(pci_access_type.PCI_ACCESS_AUTO)
+    if isinstance(method, str):
+        index = pci_lookup_method(method.encode("utf-8"))
+        if index < 0:
+            raise ValueError("unknown access method: {}".format(method))
+        return index
+    index = int(method)
+    if index < 0 or pci_get_method_name(index) is None:
+        raise ValueError("unknown access method: {}".format(method))
+    return index
+
+
+def _method_type(index):
+    try:
+        return pci_access_type(index)
+    except ValueError:
+        return index
+
+
 class LibPCI(object):
 
     """
@@ -81,14 +147,100 @@ class LibPCI(object):
         Not all APIs are supported yet.
     """
 
-    def __init__(self):
-        """Initialize the wrapper."""
-        _logger.debug("Allocating pci_access")
-        self._access = pci_alloc()
+    def __init__(self, method=None, params=None, id_file=None):
+        """
+        Initialize the wrapper.
+
+        :param method:
+            Access method to use, either a :class:`pci_access_type` value,
+            the index of a method or the name of the method as understood
+            by ``lspci -A`` (for example ``"linux-sysfs"``, ``"dump"`` or
+            ``"ecam"``). By default libpci picks the first method that
+            works.
+        :param params:
+            Dictionary of libpci parameters (as listed by ``lspci -O help``)
+            to set before initialization, for example ``{"dump.name":
+            "lspci.txt"}`` or ``{"sysfs.path": "/sys"}``.
+        :param id_file:
+            Path of the PCI ID database (``pci.ids``) to use instead of the
+            system one.
+        :raises ValueError:
+            If the method or one of the parameters is not known to libpci
+        :raises OSError:
+            If the dump method is selected and the dump file cannot be opened
+
+        .. note::
+            libpci terminates the process when an access method fails to
+            initialize, so the dump file is checked up front.
+        """
+        self._access = None
+        # Access the names are looked up with. In a forked child this is
+        # the access inherited from the parent, which keeps sharing the
+        # parsed PCI ID database.
+        self._names = None
         self._flags = 0
-        _logger.debug("Got pci_access: %r", self._access)
+        self._scanned = False
+        self._devices = None
+        method = _resolve_method(method)
+        params = dict(params or {})
+        if method == pci_access_type.PCI_ACCESS_DUMP:
+            if not params.get("dump.name"):
+                raise ValueError("the dump method requires dump.name")
+            open(params["dump.name"], 'rb').close()
+        self._method = method
+        self._params = params
+        # libpci keeps a pointer to the string, not a copy.
+        self._id_file = None
+        if id_file is not None:
+            self._id_file = os.fsencode(id_file)
+        self._access = self._names = self._open()
+        _instances.add(self)
+
+    def _open(self):
+        # Allocate and initialize a pci_access with the arguments given to
+        # __init__().
+        _logger.debug("Allocating pci_access")
+        access = pci_alloc()
+        _logger.debug("Got pci_access: %r", access)
+        access.contents.method = self._method
+        for name, value in sorted(self._params.items()):
+            _logger.debug("Setting parameter %s=%s", name, value)
+            if pci_set_param(access, name.encode("utf-8"),
+                             str(value).encode("utf-8")) != 0:
+                pci_cleanup(access)
+                raise ValueError("unknown libpci parameter: {}".format(name))
+        if self._id_file is not None:
+            pci_set_name_list_path(access, self._id_file, 0)
         _logger.debug("Initializing pci_access")
-        pci_init(self._access)
+        pci_init(access)
+        return access
+
+    @property
+    def method(self):
+        """
+        Access method used by libpci.
+
+        This is a :class:`pci_access_type` value, or the index of the method
+        for methods added to libpci after that enumeration was written.
+        """
+        if self.closed:
+            _err_closed()
+        return _method_type(self._access.contents.method)
+
+    def get_param(self, name):
+        """
+        Get the value of a libpci parameter.
+
+        :param name:
+            Name of the parameter, for example ``"sysfs.path"``
+        :returns:
+            The value of the parameter or None if it is not known
+        """
+        if self.closed:
+            _err_closed()
+        value = pci_get_param(self._access, name.encode("utf-8"))
+        if value is not None:
+            return value.decode("utf-8")
 
     @property
     def closed(self):
@@ -97,10 +249,17 @@ class LibPCI(object):
 
     def close(self):
         """Release libpci resources."""
-        if self._access is not None:
+        # Forget the pointer first so that nothing can free it twice.
+        access, self._access = self._access, None
+        names, self._names = self._names, None
+        self._devices = None
+        self._scanned = False
+        if access is not None:
+            _instances.discard(self)
             _logger.debug("Cleaning up")
-            pci_cleanup(self._access)
-        self._access = None
+            pci_cleanup(access)
+            if names is not None and names is not access:
+                pci_cleanup(names)
 
     def __enter__(self):
         """
@@ -125,7 +284,63 @@ class LibPCI(object):
 
     def __del__(self):
         """Release wrapper resources."""
-        self.close()
+        # _access is missing if __init__() failed early.
+        if getattr(self, '_access', None) is not None:
+            self.close()
+
+    def load_ids(self):
+        """
+        Load the PCI ID database now rather than on the first lookup.
+
+        :returns:
+            True if the database is loaded, False if it cannot be opened
+        :raises ValueError:
+            If :meth:`closed()` is True
+
+        Loading the database up front in a process that later forks lets
+        all the children share the parsed database instead of each parsing
+        it on its own. Nothing happens if the database is already loaded.
+        """
+        if self.closed:
+            _err_closed()
+        if not self._names.contents.id_hash:
+            _logger.debug("Loading the PCI ID database")
+            return bool(pci_load_name_list(self._names))
+        return True
+
+    def _after_fork(self):
+        # The child inherits the descriptors libpci keeps open, which share
+        # their file offset with the parent. Leave the inherited access
+        # alone (its private state is not part of the ABI) and give the
+        # child an access of its own, keeping the inherited one only to
+        # look names up. Devices are moved to a new scan by address.
+        if self._access.contents.method == pci_access_type.PCI_ACCESS_DUMP:
+            # The devices were read from a file, nothing is kept open.
+            return
+        if self._names is not self._access:
+            pci_cleanup(self._access)
+        self._access = self._open()
+        old_devices = self._devices
+        self._devices = None
+        if not self._scanned:
+            return
+        self._scanned = False
+        if old_devices is None:
+            return
+        old_devices = {device._key: device for device in old_devices}
+        devices = []
+        devices_dir = self._devices_dir()
+        for dev in self._scan():
+            key = (dev.contents.domain, dev.contents.bus, dev.contents.dev,
+                   dev.contents.func)
+            device = old_devices.pop(key, None)
+            if device is None:
+                device = Device(self, dev, self._fingerprint(dev, devices_dir))
+            device._dev = dev
+            devices.append(device)
+        for device in old_devices.values():
+            device._dev = None
+        self._devices = devices
 
     @flag_property(pci_lookup_mode.PCI_LOOKUP_NUMERIC, '_flags')
     def flag_numeric(self):
@@ -171,12 +386,20 @@ class LibPCI(object):
             in case the name cannot be found in the local database. Refer to
             the documentation of each of the ``flag_`` properties.
         """
+        tracer = tracing.tracer
+        if tracer is not None:
+            start = tracing.clock()
         buf = ctypes.create_string_buffer(1024)
         _logger.debug("Performing the lookup on vendor %#06x", vendor_id)
         flags = self._flags | pci_lookup_mode.PCI_LOOKUP_VENDOR
-        pci_lookup_name1(self._access, buf, ctypes.sizeof(buf), flags,
+        pci_lookup_name1(self._names, buf, ctypes.sizeof(buf), flags,
                          vendor_id)
-        return buf.value.decode("utf-8")
+        name = buf.value.decode("utf-8")
+        if tracer is not None:
+            tracing.emit(tracer, "lookup_vendor_name", start,
+                         vendor_id=vendor_id, flags=int(flags),
+                         result_size=len(name))
+        return name
 
     def lookup_device_name(self, vendor_id, device_id):
         """
@@ -198,13 +421,21 @@ class LibPCI(object):
             in case the name cannot be found in the local database. Refer to
             the documentation of each of the ``flag_`` properties.
         """
+        tracer = tracing.tracer
+        if tracer is not None:
+            start = tracing.clock()
         buf = ctypes.create_string_buffer(1024)
         _logger.debug("Performing the lookup on vendor:device %#06x:%#06x",
                       vendor_id, device_id)
         flags = self._flags | pci_lookup_mode.PCI_LOOKUP_DEVICE
-        pci_lookup_name2(self._access, buf, ctypes.sizeof(buf), flags,
+        pci_lookup_name2(self._names, buf, ctypes.sizeof(buf), flags,
                          vendor_id, device_id)
-        return buf.value.decode("utf-8")
+        name = buf.value.decode("utf-8")
+        if tracer is not None:
+            tracing.emit(tracer, "lookup_device_name", start,
+                         vendor_id=vendor_id, device_id=device_id,
+                         flags=int(flags), result_size=len(name))
+        return name
 
     def lookup_subsystem_device_name(
             self, vendor_id, device_id, subvendor_id, subdevice_id):
@@ -235,12 +466,531 @@ class LibPCI(object):
             in case the name cannot be found in the local database. Refer to
             the documentation of each of the ``flag_`` properties.
         """
+        tracer = tracing.tracer
+        if tracer is not None:
+            start = tracing.clock()
         buf = ctypes.create_string_buffer(1024)
         _logger.debug("Performing the lookup on vendor:device "
                       "subvendor:subdevice %#06x:%#06x %#06x:%#06x",
                       vendor_id, device_id, subvendor_id, subdevice_id)
-        flags = self._flags | pci_lookup_mode.PCI_LOOKUP_SUBSYSTEM
-        flags = self._flags | pci_lookup_mode.PCI_LOOKUP_DEVICE
-        pci_lookup_name4(self._access, buf, ctypes.sizeof(buf), flags,
+        flags = (self._flags | pci_lookup_mode.PCI_LOOKUP_SUBSYSTEM
+                 | pci_lookup_mode.PCI_LOOKUP_DEVICE)
+        pci_lookup_name4(self._names, buf, ctypes.sizeof(buf), flags,
                          vendor_id, device_id, subvendor_id, subdevice_id)
-        return buf.value.decode("utf-8")
+        name = buf.value.decode("utf-8")
+        if tracer is not None:
+            tracing.emit(tracer, "lookup_subsystem_device_name", start,
+                         vendor_id=vendor_id, device_id=device_id,
+                         subvendor_id=subvendor_id, subdevice_id=subdevice_id,
+                         flags=int(flags), result_size=len(name))
+        return name
+
+    def scan_bus(self):
+        """
+        Scan the bus and get the list of devices.
+
+        :returns:
+            A list of :class:`Device` objects, in the order libpci found them.
+        :raises ValueError:
+            If :meth:`closed()` is True
+
+        The bus is only scanned once, subsequent calls return the same list.
+        Use :meth:`rescan()` to pick up changes.
+        """
+        if self.closed:
+            _err_closed()
+        if self._devices is None:
+            tracer = tracing.tracer
+            if tracer is not None:
+                start = tracing.clock()
+            devices_dir = self._devices_dir()
+            self._devices = [
+                Device(self, dev, self._fingerprint(dev, devices_dir))
+                for dev in self._scan()]
+            _logger.debug("Found %d devices", len(self._devices))
+            if tracer is not None:
+                tracing.emit(tracer, "scan_bus", start,
+                             result_size=len(self._devices))
+        return self._devices
+
+    def rescan(self):
+        """
+        Scan the bus again and find out what has changed.
+
+        :returns:
+            A :class:`ChangeSet` describing the difference between the
+            previous scan and this one.
+        :raises ValueError:
+            If :meth:`closed()` is True
+
+        Devices are matched by address and by a cheap fingerprint: vendor,
+        device, class and, with the sysfs access method, the identity of
+        the sysfs directory, which changes when a device is removed and
+        added back. Other access methods read the revision instead.
+        Devices that did not change keep their :class:`Device` object so
+        anything derived from them stays valid and only added and changed
+        devices need to be looked at again.
+        Objects of removed and changed devices are detached and cannot be
+        used anymore.
+
+        With the dump access method the devices come from a file read once
+        by libpci, so nothing changes and nothing is rescanned.
+        """
+        if self.closed:
+            _err_closed()
+        if not self._scanned:
+            return ChangeSet(tuple(self.scan_bus()), (), ())
+        if self._access.contents.method == pci_access_type.PCI_ACCESS_DUMP:
+            _logger.debug("Not rescanning a dump")
+            return ChangeSet((), (), ())
+        # The bus may have been scanned without creating Device objects,
+        # create them for the previous scan to compare against.
+        old_devices = {device._key: device for device in self.scan_bus()}
+        tracer = tracing.tracer
+        if tracer is not None:
+            start = tracing.clock()
+        old_head = _copy_pointer(self._access.contents.devices)
+        self._access.contents.devices = None
+        _logger.debug("Rescanning the bus")
+        pci_scan_bus(self._access)
+        devices = []
+        added = []
+        changed = []
+        devices_dir = self._devices_dir()
+        for dev in self._iter_pci_devs():
+            fingerprint = self._fingerprint(dev, devices_dir)
+            key = (dev.contents.domain, dev.contents.bus, dev.contents.dev,
+                   dev.contents.func)
+            old = old_devices.pop(key, None)
+            if old is not None and old._fingerprint == fingerprint:
+                old._dev = dev
+                devices.append(old)
+                continue
+            device = Device(self, dev, fingerprint)
+            if old is None:
+                added.append(device)
+            else:
+                old._dev = None
+                changed.append(device)
+            devices.append(device)
+        removed = tuple(old_devices.values())
+        for device in removed:
+            device._dev = None
+        # Release the old list, libpci also drops any file descriptor it
+        # had cached for one of those devices.
+        while old_head:
+            next_dev = _copy_pointer(old_head.contents.next)
+            pci_free_dev(old_head)
+            old_head = next_dev
+        self._devices = devices
+        _logger.debug("Rescan found %d added, %d removed, %d changed devices",
+                      len(added), len(removed), len(changed))
+        if tracer is not None:
+            tracing.emit(tracer, "rescan", start, added=len(added),
+                         removed=len(removed), changed=len(changed),
+                         result_size=len(devices))
+        return ChangeSet(tuple(added), removed, tuple(changed))
+
+    def records(self, names=False):
+        """
+        Get immutable records of all the devices.
+
+        :param names:
+            If True, look up the vendor and device names as well
+        :returns:
+            A list of :class:`PciDevice` objects, in the order libpci found
+            the devices.
+        :raises ValueError:
+            If :meth:`closed()` is True
+
+        Records stay valid after the :class:`LibPCI` object is closed and
+        take much less memory than :class:`Device` objects, which makes
+        them suitable for keeping large inventories.
+        """
+        names_cache = {} if names else None
+        return [_make_record(self, device._dev, names_cache)
+                for device in self.scan_bus()]
+
+    def _scan(self):
+        # Scan the bus unless it was done already and iterate over the
+        # devices libpci found. This is shared by scan_bus() and by code
+        # that reads the list of devices directly.
+        if self.closed:
+            _err_closed()
+        if not self._scanned:
+            _logger.debug("Scanning the bus")
+            pci_scan_bus(self._access)
+            self._scanned = True
+        return self._iter_pci_devs()
+
+    def _iter_pci_devs(self):
+        # Pointers read from structure fields alias the memory of the
+        # structure, copy them so that they survive changes to the list.
+        dev = _copy_pointer(self._access.contents.devices)
+        while dev:
+            yield dev
+            dev = _copy_pointer(dev.contents.next)
+
+    def _devices_dir(self):
+        # Directory of the devices in sysfs, or None with other methods
+        method = self._access.contents.method
+        if method == pci_access_type.PCI_ACCESS_SYS_BUS_PCI:
+            return os.path.join(
+                self.get_param("sysfs.path") or "/sys", "bus", "pci",
+                "devices")
+
+    def _fingerprint(self, dev, devices_dir):
+        contents = dev.contents
+        identity = None
+        if devices_dir is not None:
+            path = os.path.join(
+                devices_dir, "{:04x}:{:02x}:{:02x}.{:x}".format(
+                    contents.domain, contents.bus, contents.dev,
+                    contents.func))
+            try:
+                identity = os.stat(path).st_ino
+            except OSError:
+                pass
+        if identity is None:
+            # Without a sysfs directory, read the configuration space.
+            revision = pci_read_byte(dev, PCI_REVISION_ID.value)
+        else:
+            # The revision cannot change without the directory changing.
+            revision = None
+        return (contents.vendor_id, contents.device_id, contents.device_class,
+                revision, identity)
+
+
+def shared(method=None, params=None, id_file=None):
+    """
+    Get the :class:`LibPCI` object shared by the whole process.
+
+    :param method:
+    :param params:
+    :param id_file:
+        Arguments of :class:`LibPCI`, only used by the call that creates
+        the object
+    :returns:
+        The shared :class:`LibPCI` object, with the PCI ID database
+        already loaded
+    :raises ValueError:
+        If the shared object exists and was created with other arguments
+
+    Pre-fork servers should call this before forking workers, which then
+    inherit the loaded database copy-on-write. On systems with
+    :func:`os.register_at_fork()` each child gets an access of its own to
+    the devices, so the parent and the children never share the file
+    descriptors libpci keeps open. The shared object must not be closed
+    while in use; if it is, the next call creates a new one.
+    """
+    global _shared, _shared_args
+    args = (method, dict(params or {}), id_file)
+    with _shared_lock:
+        if _shared is None or _shared.closed:
+            _shared = LibPCI(method, params, id_file)
+            _shared_args = args
+            _shared.load_ids()
+        elif args != _shared_args:
+            raise ValueError(
+                "shared LibPCI object exists with different arguments")
+        return _shared
+
+
+def _after_fork_in_child():
+    global _shared_lock
+    # The lock may have been held by another thread of the parent.
+    _shared_lock = threading.Lock()
+    for pci in list(_instances):
+        pci._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class ChangeSet(namedtuple("ChangeSet", "added removed changed")):
+
+    """
+    Result of :meth:`LibPCI.rescan()`.
+
+    :attr added:
+        Tuple of :class:`Device` objects found for the first time
+    :attr removed:
+        Tuple of (now detached) :class:`Device` objects that are gone
+    :attr changed:
+        Tuple of new :class:`Device` objects that replaced a device with
+        the same address but a different fingerprint
+    """
+
+    __slots__ = ()
+
+    def __bool__(self):
+        """Check if anything has changed."""
+        return bool(self.added or self.removed or self.changed)
+
+
+class PciDevice(namedtuple("PciDevice", (
+        "domain bus dev func vendor_id device_id device_class irq"
+        " base_addr size rom_base_addr rom_size phy_slot module_alias"
+        " vendor_name device_name"))):
+
+    """
+    Immutable record of a single PCI device.
+
+    Records are created by :meth:`LibPCI.records()` and
+    :meth:`Device.record()` and do not depend on libpci once created.
+    String fields are interned, so the many devices sharing a module alias
+    or a name share a single string.
+
+    :attr base_addr:
+        Tuple of the six base addresses, including the flags in the low bits
+    :attr size:
+        Tuple of the sizes of the six regions
+    :attr phy_slot:
+        Name of the physical slot, or None
+    :attr module_alias:
+        Kernel module alias, or None
+    :attr vendor_name:
+    :attr device_name:
+        Names from the PCI ID database, or None if not looked up
+    """
+
+    __slots__ = ()
+
+    @property
+    def slot(self):
+        """Address of the device in the ``DDDD:BB:dd.f`` notation."""
+        return '{:04x}:{:02x}:{:02x}.{:x}'.format(
+            self.domain, self.bus, self.dev, self.func)
+
+
+_RECORD_FILL = (
+    PCI_FILL_IDENT.value | PCI_FILL_IRQ.value | PCI_FILL_BASES.value
+    | PCI_FILL_ROM_BASE.value | PCI_FILL_SIZES.value | PCI_FILL_CLASS.value
+    | PCI_FILL_PHYS_SLOT.value | PCI_FILL_MODULE_ALIAS.value)
+
+# Shared by all devices without memory regions
+_NO_REGIONS = (0,) * 6
+
+
+def _intern(value):
+    if value is not None:
+        return sys.intern(value.decode("utf-8"))
+
+
+def _regions(values):
+    values = tuple(values)
+    return values if any(values) else _NO_REGIONS
+
+
+def _make_record(pci, dev, names_cache=None):
+    pci_fill_info(dev, _RECORD_FILL)
+    contents = dev.contents
+    vendor_name = device_name = None
+    if names_cache is not None:
+        key = (contents.vendor_id, contents.device_id)
+        try:
+            vendor_name, device_name = names_cache[key]
+        except KeyError:
+            vendor_name = sys.intern(pci.lookup_vendor_name(key[0]))
+            device_name = sys.intern(pci.lookup_device_name(*key))
+            names_cache[key] = vendor_name, device_name
+    return PciDevice(
+        contents.domain, contents.bus, contents.dev, contents.func,
+        contents.vendor_id, contents.device_id, contents.device_class,
+        contents.irq, _regions(contents.base_addr), _regions(contents.size),
+        contents.rom_base_addr, contents.rom_file,
+        _intern(contents.phy_slot), _intern(contents.module_alias),
+        vendor_name, device_name)
+
+
+class Device(object):
+
+    """
+    A single PCI device (function) found by :meth:`LibPCI.scan_bus()`.
+
+    Devices are owned by the :class:`LibPCI` object that found them and
+    cannot be used after that object is closed.
+    """
+
+    def __init__(self, pci, dev, fingerprint=None):
+        """
+        Initialize a device wrapper.
+
+        :param pci:
+            The :class:`LibPCI` object that owns the device
+        :param dev:
+            Pointer to the underlying ``struct pci_dev``
+        :param fingerprint:
+            Value used by :meth:`LibPCI.rescan()` to detect changes
+        """
+        self._pci = pci
+        self._dev = dev
+        self._fingerprint = fingerprint
+        contents = dev.contents
+        self._key = (contents.domain, contents.bus, contents.dev,
+                     contents.func)
+
+    def __repr__(self):
+        """Get a debugging representation of the device."""
+        if self._dev is None:
+            return '<{} {} (removed)>'.format(
+                self.__class__.__name__, self.slot)
+        return '<{} {} {:04x}:{:04x}>'.format(
+            self.__class__.__name__, self.slot, self.vendor_id,
+            self.device_id)
+
+    def _check(self):
+        if self._pci.closed:
+            _err_closed()
+        if self._dev is None:
+            raise ValueError("attempt to use removed Device object")
+
+    def _contents(self):
+        self._check()
+        return self._dev.contents
+
+    # The address never changes and remains known after the device is
+    # removed, so it is kept on the Python side.
+
+    @property
+    def domain(self):
+        """PCI domain number."""
+        return self._key[0]
+
+    @property
+    def bus(self):
+        """PCI bus number."""
+        return self._key[1]
+
+    @property
+    def dev(self):
+        """PCI device number."""
+        return self._key[2]
+
+    @property
+    def func(self):
+        """PCI function number."""
+        return self._key[3]
+
+    @property
+    def slot(self):
+        """Address of the device in the ``DDDD:BB:dd.f`` notation."""
+        return '{:04x}:{:02x}:{:02x}.{:x}'.format(*self._key)
+
+    @property
+    def removed(self):
+        """Flag determining if the device is gone, see LibPCI.rescan()."""
+        return self._dev is None
+
+    @property
+    def vendor_id(self):
+        """PCI vendor identifier."""
+        return self._contents().vendor_id
+
+    @property
+    def device_id(self):
+        """PCI device identifier."""
+        return self._contents().device_id
+
+    @property
+    def device_class(self):
+        """PCI device class (base class and sub-class)."""
+        return self._contents().device_class
+
+    @property
+    def phy_slot(self):
+        """Name of the physical slot the device is plugged into, or None."""
+        return self._string_field('phy_slot', PCI_FILL_PHYS_SLOT.value)
+
+    @property
+    def module_alias(self):
+        """Kernel module alias of the device, or None."""
+        return self._string_field('module_alias', PCI_FILL_MODULE_ALIAS.value)
+
+    def _string_field(self, name, flag):
+        dev = self._contents()
+        if not dev.known_fields & flag:
+            pci_fill_info(self._dev, flag)
+        value = getattr(dev, name)
+        if value is not None:
+            return value.decode("utf-8")
+
+    def fill_info(self, flags):
+        """
+        Ask libpci to fill in more information about the device.
+
+        :param flags:
+            Bitmask of ``PCI_FILL_xxx`` constants
+        :returns:
+            Bitmask of fields that are now known
+        """
+        self._check()
+        return pci_fill_info(self._dev, flags)
+
+    def read_config(self, size=PCI_CONFIG_SPACE_SIZE, pos=0):
+        """
+        Read a block of the configuration space.
+
+        :param size:
+            Number of bytes to read
+        :param pos:
+            Offset of the first byte to read
+        :returns:
+            The configuration space block, as bytes, or None if it could not
+            be read (typically when reading extended configuration space of
+            a conventional PCI device or without sufficient privileges).
+        """
+        self._check()
+        tracer = tracing.tracer
+        if tracer is not None:
+            start = tracing.clock()
+        buf = (ctypes.c_uint8 * size)()
+        _logger.debug("Reading %d bytes of %s at %#05x", size, self.slot, pos)
+        result = None
+        if pci_read_block(self._dev, pos, buf, size):
+            result = bytes(buf)
+        if tracer is not None:
+            tracing.emit(tracer, "read_config", start, slot=self.slot,
+                         pos=pos, size=size,
+                         result_size=len(result) if result else 0)
+        return result
+
+    def ext_capabilities(self):
+        """
+        Get the index of the extended capabilities of the device.
+
+        :returns:
+            :class:`~libpci.capabilities.ExtCapabilityIndex` built from a
+            single read of the whole extended configuration space. Devices
+            without extended configuration space get an empty index.
+        """
+        config = self.read_config(PCI_EXT_CONFIG_SPACE_SIZE)
+        return ExtCapabilityIndex(config or b'')
+
+    def virtual_functions(self):
+        """
+        Get the SR-IOV virtual functions of the device.
+
+        :returns:
+            :class:`~libpci.sriov.VirtualFunctions`, a sequence of
+            :class:`~libpci.sriov.VirtualFunction` computed from the SR-IOV
+            capability of the device. It is empty unless the device is a
+            physical function with virtual functions enabled.
+
+        Only the configuration space of this device is read; the virtual
+        functions are not looked for on the bus.
+        """
+        return VirtualFunctions(self, read_sriov(self.ext_capabilities()))
+
+    def record(self, names=False):
+        """
+        Get an immutable record of the device.
+
+        :param names:
+            If True, look up the vendor and device names as well
+        :returns:
+            :class:`PciDevice` with the current state of the device
+        """
+        self._check()
+        return _make_record(self._pci, self._dev, {} if names else None)
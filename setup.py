@@ -45,8 +45,12 @@ setup(
     license="LGPLv3",
     zip_safe=True,
     keywords='libpci binding',
-    install_requires=['guacamole'],
+    extras_require={
+        'vector': ['numpy'],
+    },
     scripts=['pci-lookup'],
+    python_requires='>=3.7',
+    test_suite='libpci.tests',
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
@@ -58,7 +62,11 @@ setup(
         'Topic :: Software Development',
         'Topic :: Software Development :: Libraries',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Programming Language :: Python :: Implementation :: CPython',
     ],
 )